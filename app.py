@@ -1,15 +1,15 @@
 import os
+import signal
 import socket
-from flask import Flask, jsonify, make_response
-from app.gitlab_webhook import git
+import sys
+from app import create_app
+from config.config import SERVER_HOST, SERVER_PORT, FLASK_DEBUG, SERVER_GRACEFUL_TIMEOUT
+from gitlab_integration.webhook_listener import webhook_listener
 from utils.args_check import check_config
 from utils.logger import log
 
-app = Flask(__name__)
-app.config['debug'] = True
-
-# router group
-app.register_blueprint(git, url_prefix='/git')
+# 开发模式入口，生产环境请使用 gunicorn -c gunicorn.conf.py wsgi:app
+app = create_app()
 
 
 def get_local_ip():
@@ -95,21 +95,21 @@ def print_webhook_info():
     log.info(f"🔧 GitLab服务器: {gitlab_url}")
 
 
-@app.errorhandler(400)
-@app.errorhandler(404)
-def handle_error(error):
-    error_msg = 'Args Error' if error.code == 400 else 'Page Not Found'
-    return make_response(jsonify({'code': error.code, 'msg': error_msg}), error.code)
-
-
 if __name__ == '__main__':
     os.environ['STABILITY_HOST'] = 'grpc.stability.ai:443'
-    app.config['JSON_AS_ASCII'] = False
     log.info('Starting args check...')
     check_config()
     log.info('Starting the app...')
+    # 启动审查worker，配置了任务存储时会接管上次未完成的任务
+    webhook_listener.review_queue.start()
     
     # 显示webhook配置信息
     print_webhook_info()
     
-    app.run(debug=True, host="0.0.0.0", port=80, use_reloader=False)
+    # docker stop发送SIGTERM，转为SystemExit以便执行下面的优雅退出
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        app.run(debug=FLASK_DEBUG, host=SERVER_HOST, port=SERVER_PORT, use_reloader=False, threaded=True)
+    finally:
+        # 停止接收新任务，等待已入队的审查完成
+        webhook_listener.shutdown(SERVER_GRACEFUL_TIMEOUT)
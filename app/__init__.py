@@ -0,0 +1,35 @@
+from flask import Flask, Response, jsonify, make_response
+
+
+def create_app():
+    """
+    创建Flask应用，开发模式（app.py）与生产模式（wsgi.py）共用
+    """
+    from app.gitlab_webhook import git
+    from gitlab_integration.webhook_listener import webhook_listener
+
+    app = Flask(__name__)
+    app.config['JSON_AS_ASCII'] = False
+
+    # router group
+    app.register_blueprint(git, url_prefix='/git')
+
+    @app.route('/health', methods=['GET'])
+    def health():
+        stats = webhook_listener.get_queue_stats()
+        code = 503 if stats['closed'] else 200
+        return make_response(jsonify({'status': 'closing' if stats['closed'] else 'ok',
+                                      'queue_depth': stats['queue_depth'],
+                                      'busy_workers': stats['busy_workers']}), code)
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(webhook_listener.get_metrics(), mimetype='text/plain; version=0.0.4')
+
+    @app.errorhandler(400)
+    @app.errorhandler(404)
+    def handle_error(error):
+        error_msg = 'Args Error' if error.code == 400 else 'Page Not Found'
+        return make_response(jsonify({'code': error.code, 'msg': error_msg}), error.code)
+
+    return app
@@ -5,4 +5,8 @@ git = Blueprint('git', __name__)
 
 @git.route('/webhook', methods=['POST'])
 def webhook():
-    return webhook_listener.handle_webhook()
\ No newline at end of file
+    return webhook_listener.handle_webhook()
+
+@git.route('/queue', methods=['GET'])
+def queue_stats():
+    return jsonify(webhook_listener.get_queue_stats())
@@ -53,6 +53,25 @@ api_config = {
 #     "model": "azure/o1-mini",
 # }
 
+# 大模型请求并发：开启后默认实现通过litellm的异步接口（acompletion）在一个共享的事件循环中执行所有请求，
+# 按provider限制同时进行的请求数，少量线程即可保持大量进行中的请求；litellm不支持的provider在线程中调用unionchat
+LLM_ASYNC_ENABLED = False         # 默认关闭：在调用线程（generate_text）或provider的线程池（generate_texts）中调用阻塞的unionchat
+LLM_MAX_CONCURRENCY = 16          # 每个provider同时进行的最大请求数，同步、异步、流式调用都占用名额，对所有审查共享
+LLM_PROVIDER_CONCURRENCY = {}     # 按provider单独设置，例如 {"openai": 64, "ollama": 2}
+
+# 大模型响应缓存：按 (模型实现, 模型参数, 消息) 的哈希缓存响应，相同的内容重复审查（MR重新打开、没有新commit的更新事件、
+# 相同的cherry-pick）时不再调用模型；none（不缓存，默认）、disk（本地磁盘）、redis（多实例共享，使用REDIS_URL）
+# 需要手动开启：开启后重复审查会得到与上次相同的意见，且审查的代码会保存在缓存中
+LLM_RESPONSE_CACHE_TYPE = os.getenv("LLM_RESPONSE_CACHE_TYPE", "none")
+LLM_RESPONSE_CACHE_DIR = os.getenv("LLM_RESPONSE_CACHE_DIR", "./repo/llm_cache")
+LLM_RESPONSE_CACHE_MAX_SIZE = 512 * 1024 * 1024  # 磁盘缓存的总大小上限（字节），超出后淘汰最久未使用的响应
+LLM_RESPONSE_CACHE_TTL = 7 * 24 * 3600           # 缓存的保留时间（秒）
+
+# token计数：本地有tokenizer（tiktoken）时精确计数，否则使用近似计数；计数结果按内容哈希缓存
+TOKEN_COUNTER_TYPE = "auto"       # auto（优先tiktoken）、tiktoken、approximate
+TOKEN_COUNT_CACHE_SIZE = 4096     # 计数结果缓存的条目数
+LLM_CONTEXT_WINDOW = 0            # 模型的上下文窗口（token数），0表示从litellm的模型信息中获取，获取不到时不按窗口截断
+
 # 旧的prompt配置已移动到 review_engine/review_prompt.py 文件中
 
 
@@ -66,6 +85,36 @@ GITLAB_PRIVATE_TOKEN = os.getenv("GITLAB_PRIVATE_TOKEN", "")
 # Gitlab modifies the maximum number of files
 MAX_FILES = 50
 
+# GitLab API客户端：所有GitLab请求共用一个keep-alive连接池
+GITLAB_POOL_CONNECTIONS = 10      # 连接池缓存的host数
+GITLAB_POOL_MAXSIZE = 32          # 每个host保持的最大连接数，应不小于同时访问GitLab的线程数
+GITLAB_CONNECT_TIMEOUT = 5        # 建立连接超时（秒）
+GITLAB_READ_TIMEOUT = 60          # 读取响应超时（秒）
+GITLAB_RETRY_MAX_ATTEMPTS = 4     # 单个请求的最大请求次数（包含第一次），只重试连接失败、429与5xx
+GITLAB_RETRY_BASE_DELAY = 1       # 指数退避的初始等待时间（秒），实际等待时间加随机抖动
+GITLAB_RETRY_MAX_DELAY = 60       # 单次等待时间上限（秒），Retry-After、RateLimit-Reset要求的等待时间也不超过该值
+GITLAB_RATE_LIMIT_PER_SECOND = 10 # 客户端限流：每个进程每秒最多发起的GitLab请求数，为0时不限流
+GITLAB_RATE_LIMIT_BURST = 20      # 客户端限流允许的突发请求数
+GITLAB_FETCH_CONCURRENCY = 8      # 批量获取commit变更、文件内容时单个审查的最大并发请求数
+GITLAB_PAGE_SIZE = 100            # 分页接口（MR commits、评论等）每页的条数，GitLab最大为100
+
+# 仓库本地镜像：每个项目一个长期保留的bare仓库，审查时增量fetch并通过git worktree检出，不再每次完整clone
+REPO_MIRROR_DIR = os.getenv("REPO_MIRROR_DIR", "./repo/mirrors")
+REPO_MIRROR_MAX_SIZE = 20 * 1024 * 1024 * 1024  # 镜像占用磁盘的总大小上限（字节），超出后按最近使用时间淘汰
+REPO_GIT_TIMEOUT = 600            # 单个git命令的超时（秒）
+REPO_MIRROR_FETCH_MIN_FILES = 5   # 批量读取的文件数不少于该值时，先把commit增量fetch到本地镜像（没有镜像时初始化浅镜像）再从本地读取
+CODE_SEARCH_MAX_FILE_SIZE = 1024 * 1024  # 代码搜索跳过超过该大小（字节）的文件
+CODE_SEARCH_CACHE_SIZE = 256      # 代码搜索结果缓存的查询数（按 项目 + commit + 查询 缓存）
+CODE_SEARCH_REFERENCES_ENABLED = False  # 详细审查时在仓库中搜索引用了变更函数/类的文件，作为影响分析的上下文（需要检出代码，需同时启用CONTEXT_IMPACT_ANALYSIS）
+CODE_SEARCH_MAX_REFERENCES = 5   # 每个变更符号最多列出的引用文件数
+GITLAB_HTTP_CACHE_MAX_ENTRIES = 2000  # MR信息、changes、commits、评论等接口按URL缓存ETag与解析结果的条目数，更新事件时发送条件请求，未变化（304）时不重新下载
+
+# GitLab文件内容缓存：所有审查共享，按项目 + blob SHA 缓存，MR更新或多个MR之间未变化的文件不再重复下载
+# none（不缓存）、memory（进程内LRU）、redis（多实例共享，进程内LRU作为一级缓存，使用REDIS_URL）
+FILE_CONTENT_CACHE_TYPE = os.getenv("FILE_CONTENT_CACHE_TYPE", "memory")
+FILE_CONTENT_CACHE_MAX_SIZE = 256 * 1024 * 1024  # 进程内缓存的总大小上限（按字符数计），超出后淘汰最久未使用的文件
+FILE_CONTENT_CACHE_TTL = 7 * 24 * 3600           # Redis中缓存的保留时间（秒）
+
 # ------------- 应用程序行为配置 --------------------
 
 # 代码审查模式配置 - 重要说明：
@@ -115,12 +164,71 @@ ENABLE_ENHANCED_COMMIT_REVIEW = True  # 启用增强版commit审查（防止失
 MAX_ESTIMATED_TOKENS = 50000      # 触发分批处理的预估token阈值
 BATCH_SIZE_FOR_COMMIT_REVIEW = 5  # 分批处理时每批的文件数量
 INCOMPLETE_RESPONSE_THRESHOLD = 0.5  # 占位符缺失超过此比例时触发降级处理（0.5表示50%）
+STREAMING_COMMIT_REVIEW = True    # 流式接收响应并增量检查占位符，确定缺失超过上述比例时立即中止请求并降级，不再等待剩余输出
 
 # 其他功能开关
 ENABLE_INLINE_COMMENTS = False   # 是否启用inline评论功能（每个diff块生成单独评论, 源码功能，如果大量文件变更，会导致一堆评论）
 SHOW_FILE_LIST_TITLE = False     # 是否在总结评论中显示"修改文件列表"标题
 REVIEW_SECTION_TITLE = ""        # 自定义审查部分的标题，设为空字符串则不显示标题
 
+# Push审查设置：对推送到受保护分支（或指定分支）的commit进行per-commit审查，结果评论在commit上
+PUSH_REVIEW_ENABLED = False       # 是否启用push审查（默认关闭，需要在GitLab中同时勾选Push events）
+PUSH_REVIEW_PROTECTED_BRANCHES = True  # 是否审查推送到受保护分支的commit
+PUSH_REVIEW_BRANCHES = []         # 额外需要审查的分支，支持通配符，例如 ["release/*"]
+PUSH_REVIEW_MAX_COMMITS = 20      # 单次push最多审查的commit数，超出时只审查最新的commit（防止force-push大量commit）
+PUSH_REVIEW_RATE_PER_MINUTE = 10  # push审查调用大模型的速率上限（次/分钟，按每次模型请求计，detailed模式每个文件一次），所有push共享
+PUSH_REVIEW_BURST = 5             # push审查允许的突发调用次数
+
+# ------------- 服务运行配置 --------------------
+# 生产环境使用 gunicorn -c gunicorn.conf.py wsgi:app 启动（Dockerfile默认方式），python app.py 仅用于本地开发
+SERVER_HOST = "0.0.0.0"
+SERVER_PORT = int(os.getenv("SERVER_PORT", "80"))
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "1"))     # gunicorn进程数，必须为1：审查队列在进程内，并发通过线程数与REVIEW_WORKER_NUM扩展
+SERVER_THREADS = int(os.getenv("SERVER_THREADS", "8"))     # 每个进程处理HTTP请求的线程数
+SERVER_GRACEFUL_TIMEOUT = 300     # 停止服务时等待已入队审查任务完成的最长时间（秒）
+FLASK_DEBUG = False               # 开发服务器是否开启debug
+
+# ------------- 审查任务队列配置 --------------------
+# webhook只负责入队，审查由固定数量的worker线程执行
+REVIEW_WORKER_NUM = 4             # 同时执行审查任务的worker数量
+REVIEW_HANDLER_HEADROOM = 8       # handler线程池为取消后仍在退出中的handler预留的线程数，已用完时被取消的任务等待handler退出后才释放worker
+REVIEW_QUEUE_MAX_SIZE = 100       # 等待队列的最大长度，队列满时webhook返回429
+REVIEW_QUEUE_RETRY_AFTER = 30     # 返回429/503时建议GitLab重试的间隔（秒）
+REVIEW_UPDATE_DEBOUNCE_SECONDS = 10  # MR更新事件的防抖时间（秒），期间同一MR的新推送会合并，只审查最新的head
+
+# 审查任务调度：排队的任务按"虚拟开始时间" = 可执行时间 + 优先级偏移 排序，偏移越小越先执行
+# 偏移以秒为单位，任务等待的时间会抵消偏移（aging），偏移有上限，因此大任务或低优先级任务不会被饿死
+REVIEW_SCHEDULER_ENABLED = True   # 是否按优先级调度，关闭时先进先出
+REVIEW_SIZING_WORKER_NUM = 2      # 入队后预估MR规模（获取changes并估算token）的线程数
+PROJECT_PRIORITY = {}             # 项目优先级，key为项目id或path_with_namespace，value为PROJECT_PRIORITY_TIERS中的等级，例如 {"group/payment": "high"}
+PROJECT_PRIORITY_TIERS = {"high": -300, "normal": 0, "low": 300}  # 各项目等级的偏移（秒），未配置的项目为normal
+PRIORITY_LABELS = {"hotfix": -600, "urgent": -600, "critical": -600, "low-priority": 300}  # MR标签的偏移（秒），多个标签取最小值
+PRIORITY_SECONDS_PER_FILE = 2     # 每个变更文件的偏移（秒）
+PRIORITY_SECONDS_PER_1K_TOKENS = 1  # 每1000个预估token的偏移（秒）
+PRIORITY_MAX_SIZE_PENALTY = 600   # MR规模偏移的上限（秒）
+PRIORITY_UNSIZED_PENALTY = 60     # 尚未完成规模预估的任务使用的规模偏移（秒）
+
+# 多项目公平调度（需开启REVIEW_SCHEDULER_ENABLED）：避免单个项目的大量MR占满所有worker
+PROJECT_MAX_CONCURRENCY = None    # 单个项目同时执行的审查任务数上限，None表示不限制（只按公平调度分配worker）
+GROUP_MAX_CONCURRENCY = None      # 单个GitLab group（项目所在namespace）同时执行的审查任务数上限，None表示不限制
+PROJECT_CONCURRENCY_LIMITS = {}   # 按项目覆盖并发上限，key为项目id或path_with_namespace，例如 {"group/monorepo": 3}，0表示暂停该项目的审查
+GROUP_CONCURRENCY_LIMITS = {}     # 按group覆盖并发上限，key为namespace，例如 {"infra": 4}
+PROJECT_WEIGHTS = {}              # 项目的公平调度权重（默认1），权重越大可占用的worker时间份额越大，key为项目id或path_with_namespace
+
+# 审查任务持久化（可选）：任务入队时写入存储，完成后删除，实例崩溃后未完成的任务会被重新投递
+# none（不持久化）、memory（进程内存，仅用于测试）、sqlite（单机）、redis（多实例共享，对应docker-compose.prod.yml中的redis服务）
+JOB_STORE_TYPE = os.getenv("JOB_STORE_TYPE", "none")
+JOB_STORE_SQLITE_PATH = os.getenv("JOB_STORE_SQLITE_PATH", "./review_jobs.db")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+JOB_STORE_KEY_PREFIX = "codereview"  # Redis key前缀
+JOB_LEASE_SECONDS = 120           # 任务租约时长（秒），持有实例未续约超过该时间后任务会被其他实例接管
+JOB_RENEW_INTERVAL = 30           # 续约与接管过期任务的间隔（秒）
+JOB_MAX_DELIVERIES = 3            # 单个任务的最大投递次数，超过后放弃，避免异常任务反复重试
+
+# webhook事件去重：同一事件（项目 + MR + head SHA + action，或相同的X-Gitlab-Event-UUID）在TTL内只调度一次
+WEBHOOK_DEDUP_TTL = 3600          # 去重记录保留时间（秒）
+WEBHOOK_DEDUP_MAX_SIZE = 10000    # 去重记录的最大数量（进程内索引）；JOB_STORE_TYPE=redis时去重记录保存在Redis中，所有进程、实例共享
+
 # ------------- Message notification --------------------
 # dingding notification （un necessary）
 DINGDING_BOT_WEBHOOK = ""  # 设为空字符串禁用钉钉通知
@@ -0,0 +1,146 @@
+import mmap
+import os
+import re
+import shutil
+import subprocess
+import threading
+from collections import OrderedDict
+from fnmatch import fnmatch
+
+try:
+    import re._parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+from config.config import CODE_SEARCH_MAX_FILE_SIZE, CODE_SEARCH_CACHE_SIZE, REPO_GIT_TIMEOUT
+from utils.logger import log
+
+# 判断二进制文件时检查的前缀长度
+_BINARY_SNIFF_SIZE = 8192
+
+
+def required_literal(pattern):
+    """
+    从正则中提取匹配结果必然包含的最长字面量，用于预筛选文件；无法提取时返回None
+    只分析顶层的连续字面量，忽略大小写的正则不提取
+    """
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error:
+        return None
+    if parsed.state.flags & re.IGNORECASE:
+        return None
+    literals, current = [], []
+    for op, value in parsed:
+        if op == sre_parse.LITERAL:
+            current.append(chr(value))
+        else:
+            literals.append("".join(current))
+            current = []
+    literals.append("".join(current))
+    longest = max(literals, key=len)
+    return longest if len(longest) >= 3 else None
+
+
+def _walk_files(root):
+    for dir_path, dir_names, files in os.walk(root):
+        dir_names[:] = [name for name in dir_names if name != ".git"]
+        for file in files:
+            yield os.path.relpath(os.path.join(dir_path, file), root)
+
+
+class CodeSearcher:
+    """
+    工作目录中的代码搜索
+    - 预筛选：用正则中必然出现的字面量做原生的固定字符串搜索（安装了ripgrep时用rg，否则用git grep），只有候选文件进入下一步
+    - 校验：候选文件通过mmap用Python正则匹配，跳过二进制文件和超过大小上限的文件，不再整文件读入内存并解码
+    - 缓存：commit不可变，同一 (项目, commit, 查询) 的结果与文件列表按LRU缓存
+    """
+
+    def __init__(self, max_file_size=CODE_SEARCH_MAX_FILE_SIZE, cache_size=CODE_SEARCH_CACHE_SIZE):
+        self.max_file_size = max_file_size
+        self.cache_size = cache_size
+        self.ripgrep = shutil.which("rg")
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def search(self, root, pattern, path_globs=None, extensions=None, cache_key=None):
+        """
+        :param root: 工作目录
+        :param pattern: Python正则
+        :param path_globs: 路径过滤（相对于工作目录的glob），例如 ["src/**"]
+        :param extensions: 扩展名过滤，例如 [".py", ".js"]
+        :param cache_key: 工作目录内容的标识（例如 (项目id, commit SHA)），为None时不缓存
+        :return: 匹配文件的相对路径列表
+        """
+        regex = re.compile(pattern.encode("utf-8"))
+        path_globs = tuple(path_globs or ())
+        extensions = tuple(extensions or ())
+        key = None if cache_key is None else (cache_key, pattern, path_globs, extensions)
+        if key is not None:
+            with self._lock:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    return list(self._cache[key])
+
+        literal = required_literal(pattern)
+        candidates = self._prefilter(root, literal, path_globs, extensions)
+        matches = sorted(path for path in candidates if self._file_matches(os.path.join(root, path), regex))
+
+        if key is not None:
+            with self._lock:
+                self._cache[key] = matches
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return list(matches)
+
+    def _prefilter(self, root, literal, path_globs, extensions):
+        # 多个glob在rg、git中是"或"的关系，只用一类缩小范围，路径与扩展名两类过滤最后统一按"且"处理
+        globs = list(path_globs) or [f"**/*{extension}" for extension in extensions]
+        try:
+            if self.ripgrep:
+                command = [self.ripgrep, "--no-messages", "--hidden", "--glob", "!.git"]
+                command += ["--files-with-matches", "--fixed-strings", "-e", literal] if literal else ["--files"]
+                for glob in globs:
+                    command += ["--glob", glob]
+            else:
+                if literal:
+                    command = ["git", "grep", "--files-with-matches", "--fixed-strings", "-I", "-e", literal]
+                else:
+                    command = ["git", "ls-files"]
+                if globs:
+                    command += ["--"] + [f":(glob){glob}" for glob in globs]
+            # 没有匹配时rg与git grep返回1
+            paths = [os.path.normpath(path) for path in self._run(command, root, ok_codes=(0, 1)).splitlines()]
+        except (OSError, RuntimeError, subprocess.TimeoutExpired) as e:
+            log.warning(f"⚠️ 代码搜索预筛选失败，改为逐个文件匹配: {e}")
+            paths = list(_walk_files(root))
+
+        if path_globs:
+            paths = [path for path in paths if any(fnmatch(path, glob) for glob in path_globs)]
+        if extensions:
+            suffixes = tuple(extension.lower() for extension in extensions)
+            paths = [path for path in paths if path.lower().endswith(suffixes)]
+        return paths
+
+    @staticmethod
+    def _run(command, cwd, ok_codes=(0,)):
+        result = subprocess.run(command, cwd=cwd, capture_output=True, text=True, timeout=REPO_GIT_TIMEOUT)
+        if result.returncode not in ok_codes:
+            raise RuntimeError(f"{os.path.basename(command[0])} failed: {result.stderr.strip()}")
+        return result.stdout
+
+    def _file_matches(self, file_path, regex):
+        try:
+            size = os.path.getsize(file_path)
+            if size == 0 or size > self.max_file_size:
+                return False
+            with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if data.find(b"\0", 0, _BINARY_SNIFF_SIZE) != -1:
+                    return False
+                return regex.search(data) is not None
+        except (OSError, ValueError):
+            return False
+
+
+code_searcher = CodeSearcher()
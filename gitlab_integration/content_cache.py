@@ -0,0 +1,114 @@
+import threading
+from collections import OrderedDict
+
+from config.config import (FILE_CONTENT_CACHE_TYPE, FILE_CONTENT_CACHE_MAX_SIZE, FILE_CONTENT_CACHE_TTL, REDIS_URL,
+                           JOB_STORE_KEY_PREFIX)
+from utils.logger import log
+
+
+class MemoryContentCache:
+    """
+    进程内LRU缓存，按内容大小（字符数）淘汰
+    所有审查共享，线程安全
+    """
+
+    def __init__(self, max_size=FILE_CONTENT_CACHE_MAX_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()  # key -> value，按最近使用排序
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        size = len(value)
+        if size > self.max_size:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._entries[key] = value
+            self._size += size
+            while self._size > self.max_size:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def get_stats(self):
+        with self._lock:
+            return {'type': 'memory', 'entries': len(self._entries), 'size': self._size, 'max_size': self.max_size,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+class RedisContentCache(MemoryContentCache):
+    """
+    Redis缓存，多实例共享；进程内LRU作为一级缓存
+    Redis中的条目按TTL过期，内存上限由Redis的maxmemory-policy控制
+    """
+
+    def __init__(self, url=REDIS_URL, prefix=JOB_STORE_KEY_PREFIX, ttl=FILE_CONTENT_CACHE_TTL,
+                 max_size=FILE_CONTENT_CACHE_MAX_SIZE):
+        super().__init__(max_size)
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("FILE_CONTENT_CACHE_TYPE='redis' requires the redis package, please `pip install redis`")
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+        self._prefix = f"{prefix}:content"
+        self.ttl = ttl
+
+    def get(self, key):
+        value = super().get(key)
+        if value is not None:
+            return value
+        try:
+            value = self._redis.get(f"{self._prefix}:{key}")
+        except Exception as e:
+            log.warning(f"⚠️ 读取Redis文件缓存失败: {e}")
+            return None
+        if value is not None:
+            with self._lock:
+                self.misses -= 1
+                self.hits += 1
+            super().set(key, value)
+        return value
+
+    def set(self, key, value):
+        super().set(key, value)
+        try:
+            self._redis.set(f"{self._prefix}:{key}", value, ex=self.ttl)
+        except Exception as e:
+            log.warning(f"⚠️ 写入Redis文件缓存失败: {e}")
+
+    def get_stats(self):
+        return dict(super().get_stats(), type='redis')
+
+
+def create_content_cache(cache_type=FILE_CONTENT_CACHE_TYPE):
+    """
+    根据配置创建文件内容缓存，cache_type为none时返回None（不缓存）
+    """
+    cache_type = (cache_type or 'none').lower()
+    if cache_type == 'none':
+        return None
+    if cache_type == 'memory':
+        return MemoryContentCache()
+    if cache_type == 'redis':
+        return RedisContentCache()
+    raise ValueError(f"Unsupported FILE_CONTENT_CACHE_TYPE: {cache_type}")
+
+
+# GitLab文件内容缓存，所有审查共享
+# - blob:{project_id}:{blob_id} -> 文件内容，内容寻址，不同commit、不同MR中未变化的文件共用一份
+# - ref:{project_id}:{commit_sha}:{path} -> blob_id，commit不可变，命中时无需访问GitLab
+file_content_cache = create_content_cache()
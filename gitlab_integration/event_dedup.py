@@ -0,0 +1,133 @@
+import threading
+import time
+from collections import OrderedDict
+
+from config.config import WEBHOOK_DEDUP_TTL, WEBHOOK_DEDUP_MAX_SIZE, JOB_STORE_TYPE, REDIS_URL, JOB_STORE_KEY_PREFIX
+from gitlab_integration.gitlab_fetcher import get_merge_request_head_sha
+from utils.logger import log
+
+
+class WebhookEventDeduplicator:
+    """
+    webhook事件去重索引（带TTL）
+    GitLab在webhook超时后会重试，同一事件在TTL内只会被调度一次
+    索引在进程内，只对单进程部署有效；多进程、多实例部署使用RedisWebhookEventDeduplicator
+    """
+
+    def __init__(self, ttl=WEBHOOK_DEDUP_TTL, max_size=WEBHOOK_DEDUP_MAX_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._seen = OrderedDict()  # key -> 记录时间，按插入顺序即按时间顺序
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def build_keys(gitlab_payload, event_uuid=None):
+        """
+        构建事件标识
+        - MR事件内容标识：项目 + MR iid + head SHA + action
+        - push事件内容标识：项目 + ref + before + after
+        - X-Gitlab-Event-UUID（如果有）
+        """
+        keys = []
+        project_id = (gitlab_payload.get('project') or {}).get('id')
+        if gitlab_payload.get('object_kind') == 'push':
+            if gitlab_payload.get('after'):
+                keys.append(f"push:{project_id}:{gitlab_payload.get('ref')}:{gitlab_payload.get('before')}:"
+                            f"{gitlab_payload.get('after')}")
+        else:
+            object_attributes = gitlab_payload.get('object_attributes') or {}
+            head_sha = get_merge_request_head_sha(gitlab_payload)
+            if head_sha:
+                keys.append(f"mr:{project_id}:{object_attributes.get('iid')}:{head_sha}:{object_attributes.get('action')}")
+        if event_uuid:
+            keys.append(f"uuid:{event_uuid}")
+        return keys
+
+    def claim(self, keys):
+        """
+        记录事件，任一标识在TTL内已出现过则返回False
+        """
+        if not keys:
+            return True
+        now = time.time()
+        with self._lock:
+            self._evict(now)
+            if any(key in self._seen for key in keys):
+                return False
+            for key in keys:
+                self._seen[key] = now
+            while len(self._seen) > self.max_size:
+                self._seen.popitem(last=False)
+        return True
+
+    def release(self, keys):
+        """事件最终没有被调度（例如队列已满），移除记录以便GitLab重试时能够重新处理"""
+        with self._lock:
+            for key in keys:
+                self._seen.pop(key, None)
+
+    def _evict(self, now):
+        expire_before = now - self.ttl
+        while self._seen:
+            key, seen_at = next(iter(self._seen.items()))
+            if seen_at > expire_before:
+                break
+            self._seen.popitem(last=False)
+
+
+class RedisWebhookEventDeduplicator(WebhookEventDeduplicator):
+    """
+    Redis去重索引，所有进程、实例共享：GitLab重试的请求落到其他gunicorn进程或实例时同样能识别
+    每个标识一个带TTL的key，claim通过脚本原子地检查并写入所有标识
+    """
+
+    _CLAIM_SCRIPT = """
+    for _, key in ipairs(KEYS) do
+        if redis.call('EXISTS', key) == 1 then
+            return 0
+        end
+    end
+    for _, key in ipairs(KEYS) do
+        redis.call('SET', key, ARGV[1], 'EX', tonumber(ARGV[2]))
+    end
+    return 1
+    """
+
+    def __init__(self, url=REDIS_URL, prefix=JOB_STORE_KEY_PREFIX, ttl=WEBHOOK_DEDUP_TTL):
+        super().__init__(ttl=ttl)
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("JOB_STORE_TYPE='redis' requires the redis package, please `pip install redis`")
+        self._redis = redis.Redis.from_url(url)
+        self._prefix = f"{prefix}:dedup"
+        self._claim = self._redis.register_script(self._CLAIM_SCRIPT)
+
+    def claim(self, keys):
+        if not keys:
+            return True
+        try:
+            return bool(self._claim(keys=[f"{self._prefix}:{key}" for key in keys],
+                                    args=[int(time.time()), int(self.ttl)]))
+        except Exception as e:
+            # Redis不可用时退回进程内去重，不因此丢弃事件
+            log.warning(f"⚠️ Redis去重索引不可用，使用进程内去重: {e}")
+            return super().claim(keys)
+
+    def release(self, keys):
+        super().release(keys)
+        if not keys:
+            return
+        try:
+            self._redis.delete(*[f"{self._prefix}:{key}" for key in keys])
+        except Exception as e:
+            log.warning(f"⚠️ 删除Redis去重记录失败: {e}")
+
+
+def create_event_deduplicator(store_type=JOB_STORE_TYPE):
+    """
+    JOB_STORE_TYPE为redis（多进程、多实例部署）时使用Redis去重索引，否则使用进程内索引
+    """
+    if (store_type or 'none').lower() == 'redis':
+        return RedisWebhookEventDeduplicator()
+    return WebhookEventDeduplicator()
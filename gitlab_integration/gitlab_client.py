@@ -0,0 +1,253 @@
+import random
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config.config import (GITLAB_SERVER_URL, GITLAB_PRIVATE_TOKEN, GITLAB_POOL_CONNECTIONS, GITLAB_POOL_MAXSIZE,
+                           GITLAB_CONNECT_TIMEOUT, GITLAB_READ_TIMEOUT, GITLAB_HTTP_CACHE_MAX_ENTRIES, GITLAB_PAGE_SIZE,
+                           GITLAB_RETRY_MAX_ATTEMPTS, GITLAB_RETRY_BASE_DELAY, GITLAB_RETRY_MAX_DELAY,
+                           GITLAB_RATE_LIMIT_PER_SECOND, GITLAB_RATE_LIMIT_BURST)
+from utils.logger import log
+from utils.rate_limiter import TokenBucket
+
+# 304响应中可能不带分页信息，与缓存的解析结果一起保存
+_PAGINATION_HEADERS = ("X-Next-Page", "Link")
+
+
+class RetryPolicy:
+    """
+    GitLab请求的重试策略
+    - 可重试：连接失败/超时、429、500、502、503、504；其他状态码（400、401、403、404、409等）直接返回给调用方
+    - 非幂等请求（POST等）只在确定服务端未处理时重试：建立连接超时、429、503
+    - 等待时间：优先使用响应头 Retry-After、RateLimit-Reset，否则按指数退避并加随机抖动（full jitter）
+    """
+    RETRYABLE_STATUS = frozenset({429, 500, 502, 503, 504})
+    UNPROCESSED_STATUS = frozenset({429, 503})
+    IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+    def __init__(self, max_attempts=GITLAB_RETRY_MAX_ATTEMPTS, base_delay=GITLAB_RETRY_BASE_DELAY,
+                 max_delay=GITLAB_RETRY_MAX_DELAY):
+        """
+        :param max_attempts: 最大请求次数（包含第一次）
+        :param base_delay: 指数退避的初始等待时间（秒）
+        :param max_delay: 单次等待时间上限（秒），响应头要求的等待时间也不会超过该值
+        """
+        self.max_attempts = max(1, int(max_attempts))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def should_retry(self, method, attempt, response=None, error=None):
+        """
+        :param attempt: 已经请求的次数
+        """
+        if attempt >= self.max_attempts:
+            return False
+        idempotent = method.upper() in self.IDEMPOTENT_METHODS
+        if error is not None:
+            if idempotent:
+                return isinstance(error, (requests.ConnectionError, requests.Timeout))
+            return isinstance(error, requests.ConnectTimeout)
+        if idempotent:
+            return response.status_code in self.RETRYABLE_STATUS
+        return response.status_code in self.UNPROCESSED_STATUS
+
+    def delay(self, attempt, response=None):
+        """第attempt次请求失败后的等待时间（秒）"""
+        wait = rate_limit_wait(response) if response is not None else None
+        if wait is None:
+            wait = random.uniform(0, self.base_delay * 2 ** (attempt - 1))
+        return min(wait, self.max_delay)
+
+
+def rate_limit_wait(response):
+    """
+    根据GitLab的限流响应头计算需要等待的秒数，没有相关信息时返回None
+    - Retry-After：秒数或HTTP日期
+    - RateLimit-Remaining为0时等到RateLimit-Reset（unix时间戳）
+    """
+    retry_after = response.headers.get("Retry-After")
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    if response.headers.get("RateLimit-Remaining") == "0":
+        try:
+            return max(0.0, float(response.headers.get("RateLimit-Reset")) - time.time())
+        except (TypeError, ValueError):
+            pass
+    return None
+
+
+class GitlabClient:
+    """
+    共享的GitLab API客户端
+    - 所有fetcher与GitLab回复共用一个requests.Session，连接保持keep-alive并在连接池中复用，避免每次调用重新建立TCP+TLS连接
+    - 统一携带PRIVATE-TOKEN，统一设置连接与读取超时
+    - get_json按URL记录ETag/Last-Modified并发送条件请求，未变化（304）时直接返回缓存的解析结果
+    - iter_json_pages逐页获取列表接口
+    - 统一的重试策略（RetryPolicy），客户端令牌桶限流；GitLab返回剩余配额为0时所有线程暂停到配额重置
+    """
+
+    def __init__(self, base_url=GITLAB_SERVER_URL, private_token=GITLAB_PRIVATE_TOKEN,
+                 pool_connections=GITLAB_POOL_CONNECTIONS, pool_maxsize=GITLAB_POOL_MAXSIZE,
+                 connect_timeout=GITLAB_CONNECT_TIMEOUT, read_timeout=GITLAB_READ_TIMEOUT,
+                 http_cache_max_entries=GITLAB_HTTP_CACHE_MAX_ENTRIES, retry_policy=None,
+                 rate_limit=GITLAB_RATE_LIMIT_PER_SECOND, rate_limit_burst=GITLAB_RATE_LIMIT_BURST):
+        """
+        :param pool_connections: 连接池缓存的host数
+        :param pool_maxsize: 每个host保持的最大连接数，应不小于同时访问GitLab的线程数
+        :param http_cache_max_entries: 条件请求缓存的URL数上限，为0时不缓存
+        :param rate_limit: 每秒最多发起的请求数，为0时不限流
+        :param rate_limit_burst: 允许的突发请求数
+        """
+        self.api_url = f"{base_url.rstrip('/')}/api/v4"
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        self.session.headers.update({"PRIVATE-TOKEN": private_token})
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.http_cache_max_entries = http_cache_max_entries
+        self._http_cache = OrderedDict()  # (url, params) -> (ETag, Last-Modified, 解析后的JSON, 分页响应头)，按最近使用排序
+        self._http_cache_lock = threading.Lock()
+        self.not_modified = 0
+        self.modified = 0
+        self.retry_policy = retry_policy or RetryPolicy()
+        self._rate_limiter = TokenBucket(rate_limit, rate_limit_burst) if rate_limit > 0 else None
+        self._paused_until = 0  # GitLab配额耗尽时，所有请求暂停到该时间
+        self.retries = 0
+        self.throttled = 0
+
+    def url(self, path):
+        """path可以是完整URL，也可以是 /projects/... 形式的API路径"""
+        if path.startswith("http://") or path.startswith("https://"):
+            return path
+        return f"{self.api_url}{path}"
+
+    def request(self, method, path, **kwargs):
+        """
+        发起请求，按重试策略重试；重试用尽后返回最后一次的响应或抛出最后一次的异常
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        url = self.url(path)
+        attempt = 0
+        while True:
+            self._wait_for_quota()
+            attempt += 1
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.RequestException as e:
+                if not self.retry_policy.should_retry(method, attempt, error=e):
+                    raise
+                delay = self.retry_policy.delay(attempt)
+                log.warning(f"⚠️ GitLab请求失败，{delay:.1f}s后第{attempt}次重试: {method} {url} {e}")
+            else:
+                self._observe_quota(response)
+                if not self.retry_policy.should_retry(method, attempt, response=response):
+                    return response
+                delay = self.retry_policy.delay(attempt, response)
+                log.warning(f"⚠️ GitLab返回{response.status_code}，{delay:.1f}s后第{attempt}次重试: {method} {url}")
+            self.retries += 1
+            time.sleep(delay)
+
+    def _wait_for_quota(self):
+        if self._rate_limiter is not None:
+            self._rate_limiter.acquire()
+        wait = self._paused_until - time.time()
+        if wait > 0:
+            time.sleep(min(wait, self.retry_policy.max_delay))
+
+    def _observe_quota(self, response):
+        """记录GitLab返回的剩余配额，配额耗尽时暂停后续请求（不只是当前请求）"""
+        if response.status_code == 429 or response.headers.get("RateLimit-Remaining") == "0":
+            wait = rate_limit_wait(response)
+            if wait:
+                self.throttled += 1
+                self._paused_until = max(self._paused_until, time.time() + min(wait, self.retry_policy.max_delay))
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def head(self, path, **kwargs):
+        return self.request("HEAD", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def get_json(self, path, params=None, **kwargs):
+        """
+        GET并解析JSON，带条件请求缓存
+        返回的对象可能被多个审查共享，调用方不要修改
+        :return: (response, data)，data为解析后的JSON，304时为缓存的对象，请求失败时为None
+        """
+        url = self.url(path)
+        cache_key = (url, tuple(sorted((params or {}).items())))
+        headers = dict(kwargs.pop("headers", None) or {})
+        with self._http_cache_lock:
+            cached = self._http_cache.get(cache_key)
+        if cached:
+            etag, last_modified, _, _ = cached
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+        response = self.get(url, params=params, headers=headers, **kwargs)
+        if response.status_code == 304 and cached:
+            with self._http_cache_lock:
+                self.not_modified += 1
+                if cache_key in self._http_cache:
+                    self._http_cache.move_to_end(cache_key)
+            for name, value in cached[3].items():
+                response.headers.setdefault(name, value)
+            return response, cached[2]
+        if response.status_code != 200:
+            return response, None
+
+        data = response.json()
+        etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+        with self._http_cache_lock:
+            self.modified += 1
+            if (etag or last_modified) and self.http_cache_max_entries > 0:
+                pagination = {name: response.headers[name] for name in _PAGINATION_HEADERS if name in response.headers}
+                self._http_cache[cache_key] = (etag, last_modified, data, pagination)
+                self._http_cache.move_to_end(cache_key)
+                while len(self._http_cache) > self.http_cache_max_entries:
+                    self._http_cache.popitem(last=False)
+        return response, data
+
+    def iter_json_pages(self, path, params=None, per_page=GITLAB_PAGE_SIZE):
+        """
+        逐页获取列表接口，按 X-Next-Page（keyset分页时按 Link: rel="next"）翻页，以生成器返回每个元素
+        调用方可以随时停止迭代，之后的页不会被请求；每一页都经过get_json的条件请求缓存
+        :raise requests.HTTPError: 某一页请求失败
+        """
+        url, params = self.url(path), dict(params or {}, per_page=per_page)
+        while url:
+            response, data = self.get_json(url, params=params)
+            if data is None:
+                raise requests.HTTPError(f"{response.status_code} {response.text}", response=response)
+            yield from data
+            next_page = response.headers.get("X-Next-Page")
+            if next_page:
+                params = dict(params, page=next_page)
+            elif "next" in response.links and not response.headers.get("X-Page"):
+                url, params = response.links["next"]["url"], None
+            else:
+                url = None
+
+    def get_stats(self):
+        with self._http_cache_lock:
+            return {'http_cache_entries': len(self._http_cache), 'not_modified': self.not_modified,
+                    'modified': self.modified, 'retries': self.retries, 'throttled': self.throttled}
+
+
+gitlab_client = GitlabClient()
@@ -1,51 +1,199 @@
+import itertools
 import os
 import re
 import shutil
 import subprocess
 import time
+import uuid
+from urllib.parse import quote
 
 import requests
 from retrying import retry
 from config.config import *
+from gitlab_integration.content_cache import file_content_cache
+from gitlab_integration.gitlab_client import gitlab_client
+from gitlab_integration.code_search import code_searcher
+from gitlab_integration.repo_mirror import repo_mirror_cache, run_git
+from utils.cancellation import cancellable_executor, wait_futures
 from utils.logger import log
-from utils.tools import run_command
 
+_COMMIT_SHA_PATTERN = re.compile(r"^[0-9a-f]{40}$")
 
-class GitlabMergeRequestFetcher:
+
+def fetch_file_content(project_id, file_path, ref, force=False):
+    """
+    获取文件内容，经过所有审查共享的文件内容缓存（file_content_cache）
+    - ref为commit SHA且本地镜像中已有该commit时，通过常驻的 git cat-file --batch 进程直接读取
+    - 记录 (ref, 路径) -> blob 的映射：ref为commit SHA时命中即无需访问GitLab；
+      ref为分支名时分支可能已更新，用HEAD请求（只返回blob SHA等元数据）确认，blob已缓存则不下载
+    - 未缓存时只发一次raw请求，从响应头 X-Gitlab-Blob-Id 获取blob SHA写入缓存，未变化的文件在MR更新、不同MR之间共用
+    :param ref: 分支名或commit SHA
+    :param force: 跳过缓存重新下载
+    :return: 文件内容，文件不存在时返回None
+    """
+    is_commit = _COMMIT_SHA_PATTERN.match(ref)
+    if not force and is_commit:
+        found, content = repo_mirror_cache.read_file(project_id, ref, file_path)
+        if found:
+            return content
+
+    url = f"{GITLAB_SERVER_URL}/api/v4/projects/{project_id}/repository/files/{quote(file_path, safe='')}"
+    cache = file_content_cache
+    if cache is None:
+        response = gitlab_client.get(f"{url}/raw", params={"ref": ref})
+        return response.text if response.status_code == 200 else None
+
+    ref_key = f"ref:{project_id}:{ref}:{file_path}"
+    cached_blob_id = None if force else cache.get(ref_key)
+    if cached_blob_id:
+        blob_id = cached_blob_id
+        if not is_commit:
+            response = gitlab_client.head(url, params={"ref": ref})
+            if response.status_code == 404:
+                return None
+            blob_id = response.headers.get("X-Gitlab-Blob-Id") if response.status_code == 200 else None
+        content = cache.get(f"blob:{project_id}:{blob_id}") if blob_id else None
+        if content is not None:
+            if blob_id != cached_blob_id:
+                cache.set(ref_key, blob_id)
+            return content
+
+    response = gitlab_client.get(f"{url}/raw", params={"ref": ref})
+    if response.status_code != 200:
+        return None
+    content = response.text
+    blob_id = response.headers.get("X-Gitlab-Blob-Id")
+    if blob_id:
+        cache.set(f"blob:{project_id}:{blob_id}", content)
+        cache.set(ref_key, blob_id)
+        commit_id = response.headers.get("X-Gitlab-Commit-Id")
+        if commit_id and commit_id != ref:
+            cache.set(f"ref:{project_id}:{commit_id}:{file_path}", blob_id)
+    return content
+
+
+def fetch_concurrently(fetch, items, cancel_token=None, max_workers=GITLAB_FETCH_CONCURRENCY):
+    """
+    以有限并发批量调用GitLab API，总耗时约等于最慢的一次请求
+    :param fetch: 单个请求函数，参数为items中的元素
+    :param items: 请求参数列表，需可hash
+    :param cancel_token: 可选的CancellationToken，被取消时不再发起新的请求并抛出ReviewCancelledError
+    :return: dict {item: result}，请求失败的item结果为None
+    """
+    items = list(dict.fromkeys(items))
+    if not items:
+        return {}
+    with cancellable_executor(cancel_token, max_workers=min(max_workers, len(items)),
+                              thread_name_prefix='gitlab-fetch') as executor:
+        futures = {executor.submit(fetch, item): item for item in items}
+        wait_futures(futures, cancel_token)
+    results = {}
+    for future, item in futures.items():
+        try:
+            results[item] = future.result()
+        except Exception as e:
+            log.error(f"批量请求GitLab失败: {item} {e}")
+            results[item] = None
+    return results
+
+
+def fetch_commit_to_mirror(project_id, commit_sha):
+    """
+    把commit增量fetch到项目的本地镜像，之后的文件读取都通过cat-file从镜像进行
+    项目还没有镜像时初始化一个浅镜像（只fetch该commit），不完整clone
+    :return: 镜像中是否有该commit
+    """
+    if not _COMMIT_SHA_PATTERN.match(commit_sha):
+        return False
+    if repo_mirror_cache.has_commit(project_id, commit_sha):
+        return True
+    response, project_info = gitlab_client.get_json(f"/projects/{project_id}")
+    if not project_info or not project_info.get("http_url_to_repo"):
+        return False
+    try:
+        repo_mirror_cache.fetch(project_id, project_info["http_url_to_repo"], commit_sha, initial_depth=1)
+        return True
+    except Exception as e:
+        log.warning(f"⚠️ 增量fetch commit {commit_sha[:8]} 到本地镜像失败，回退到GitLab API: {e}")
+        return False
+
+
+class BulkFetchMixin:
+    """fetcher的批量接口，依赖 get_commit_changes 与 get_file_content"""
+
+    def resolve_ref(self, branch_name):
+        """读取文件时实际使用的ref"""
+        return branch_name
+
+    def get_commits_changes(self, commit_ids, cancel_token=None):
+        """
+        并发获取多个commit的变更
+        :return: dict {commit_id: changes}，获取失败的commit不包含在内
+        """
+        results = fetch_concurrently(self.get_commit_changes, commit_ids, cancel_token)
+        return {commit_id: changes for commit_id, changes in results.items() if changes is not None}
+
+    def get_files_content(self, file_paths, branch_name='main', cancel_token=None):
+        """
+        并发获取同一分支（或commit）下多个文件的内容
+        :return: dict {file_path: content}，文件不存在或获取失败时为None
+        """
+        file_paths = list(file_paths)
+        if len(file_paths) >= REPO_MIRROR_FETCH_MIN_FILES:
+            fetch_commit_to_mirror(self.project_id, self.resolve_ref(branch_name))
+        return fetch_concurrently(lambda file_path: self.get_file_content(file_path, branch_name),
+                                  file_paths, cancel_token)
+
+
+class GitlabMergeRequestFetcher(BulkFetchMixin):
     def __init__(self, project_id, merge_request_iid):
         self.project_id = project_id
         self.iid = merge_request_iid
         self._changes_cache = None
-        self._file_content_cache = {}
+        self._changes_complete = False
+        self._commit_changes_cache = {}
         self._info_cache = None
 
-    @retry(stop_max_attempt_number=3, wait_fixed=2000)
-    def get_changes(self, force=False):
+    def iter_changes(self):
+        """
+        逐页获取MR的变更（/diffs），以生成器返回每个文件的变更，调用方停止迭代后不再请求后续的页
+        GitLab 15.7之前没有/diffs接口，回退到一次返回全部变更的/changes
+        :raise requests.HTTPError: 请求失败
+        """
+        url = f"{GITLAB_SERVER_URL}/api/v4/projects/{self.project_id}/merge_requests/{self.iid}/diffs"
+        yielded = False
+        try:
+            for change in gitlab_client.iter_json_pages(url):
+                yielded = True
+                yield change
+            return
+        except requests.HTTPError as e:
+            if yielded or e.response is None or e.response.status_code != 404:
+                raise
+        response, data = gitlab_client.get_json(
+            f"{GITLAB_SERVER_URL}/api/v4/projects/{self.project_id}/merge_requests/{self.iid}/changes")
+        if data is None:
+            raise requests.HTTPError(f"{response.status_code} {response.text}", response=response)
+        yield from data["changes"]
+
+    def get_changes(self, force=False, limit=None):
         """
         Get the changes of the merge request
+        :param limit: 最多获取的文件数，达到后不再下载后续的页（超过MAX_FILES的MR不会被审查，无需下载全部diff）
         :return: changes
         """
-        if self._changes_cache and not force:
-            return self._changes_cache
-        # URL for the GitLab API endpoint
-        url = f"{GITLAB_SERVER_URL}/api/v4/projects/{self.project_id}/merge_requests/{self.iid}/changes"
-
-        # Headers for the request
-        headers = {
-            "PRIVATE-TOKEN": GITLAB_PRIVATE_TOKEN
-        }
-
-        # Make the GET request
-        response = requests.get(url, headers=headers)
-
-        # Check if the request was successful
-        if response.status_code == 200:
-            self._changes_cache = response.json()["changes"]
-            return response.json()["changes"]
-        else:
+        if self._changes_cache is not None and not force and (
+                self._changes_complete or (limit is not None and len(self._changes_cache) >= limit)):
+            return self._changes_cache if limit is None else self._changes_cache[:limit]
+        try:
+            changes = list(itertools.islice(self.iter_changes(), limit))
+        except requests.HTTPError as e:
+            log.error(f"获取MR变更失败: {e}")
             return None
+        self._changes_cache = changes
+        self._changes_complete = limit is None or len(changes) < limit
+        return changes
 
-    @retry(stop_max_attempt_number=3, wait_fixed=2000)
     # 获取文件内容
     def get_file_content(self, file_path, branch_name='main', force=False):
         """
@@ -53,29 +201,15 @@ class GitlabMergeRequestFetcher:
         :param file_path: The path of the file
         :return: The content of the file
         """
-        # 对file_path中的'/'转换为'%2F'
-        file_path = file_path.replace('/', '%2F')
-        if file_path in self._file_content_cache and not force:
-            return self._file_content_cache[file_path]
-        # URL for the GitLab API endpoint
-        url = f"{GITLAB_SERVER_URL}/api/v4/projects/{self.project_id}/repository/files/{file_path}/raw?ref={branch_name}"
+        return fetch_file_content(self.project_id, file_path, self.resolve_ref(branch_name), force)
 
-        # Headers for the request
-        headers = {
-            "PRIVATE-TOKEN": GITLAB_PRIVATE_TOKEN
-        }
-
-        # Make the GET request
-        response = requests.get(url, headers=headers)
+    def resolve_ref(self, branch_name):
+        # MR的源分支按本次审查的head SHA获取，与diff保持一致，且可以直接命中共享缓存和本地镜像
+        info = self._info_cache or {}
+        if branch_name == info.get('source_branch') and info.get('sha'):
+            return info['sha']
+        return branch_name
 
-        # Check if the request was successful
-        if response.status_code == 200:
-            self._file_content_cache[file_path] = response.text
-            return response.text
-        else:
-            return None
-
-    @retry(stop_max_attempt_number=3, wait_fixed=2000)
     def get_info(self, force=False):
         """
         Get the merge request information
@@ -86,22 +220,24 @@ class GitlabMergeRequestFetcher:
         # URL for the GitLab API endpoint
         url = f"{GITLAB_SERVER_URL}/api/v4/projects/{self.project_id}/merge_requests/{self.iid}"
 
-        # Headers for the request
-        headers = {
-            "PRIVATE-TOKEN": GITLAB_PRIVATE_TOKEN
-        }
-
         # Make the GET request
-        response = requests.get(url, headers=headers)
+        response, data = gitlab_client.get_json(url)
 
         # Check if the request was successful
-        if response.status_code == 200:
-            self._info_cache = response.json()
-            return response.json()
+        if data is not None:
+            self._info_cache = data
+            return data
         else:
             return None
 
-    @retry(stop_max_attempt_number=3, wait_fixed=2000)
+    def iter_commits(self):
+        """
+        逐页获取MR的commits（最新的在前），以生成器返回
+        :raise requests.HTTPError: 请求失败
+        """
+        url = f"{GITLAB_SERVER_URL}/api/v4/projects/{self.project_id}/merge_requests/{self.iid}/commits"
+        return gitlab_client.iter_json_pages(url)
+
     def get_commits(self, force=False):
         """
         Get the commits of the merge request
@@ -109,26 +245,13 @@ class GitlabMergeRequestFetcher:
         """
         if hasattr(self, '_commits_cache') and self._commits_cache and not force:
             return self._commits_cache
-        # URL for the GitLab API endpoint
-        url = f"{GITLAB_SERVER_URL}/api/v4/projects/{self.project_id}/merge_requests/{self.iid}/commits"
-
-        # Headers for the request
-        headers = {
-            "PRIVATE-TOKEN": GITLAB_PRIVATE_TOKEN
-        }
-
-        # Make the GET request
-        response = requests.get(url, headers=headers)
-
-        # Check if the request was successful
-        if response.status_code == 200:
-            self._commits_cache = response.json()
-            return response.json()
-        else:
-            log.error(f"获取MR commits失败: {response.status_code} {response.text}")
+        try:
+            self._commits_cache = list(self.iter_commits())
+            return self._commits_cache
+        except requests.HTTPError as e:
+            log.error(f"获取MR commits失败: {e}")
             return []
 
-    @retry(stop_max_attempt_number=3, wait_fixed=2000)
     def get_commit_changes(self, commit_id, force=False):
         """
         Get the changes of a specific commit
@@ -136,31 +259,31 @@ class GitlabMergeRequestFetcher:
         :return: changes for this commit
         """
         cache_key = f"commit_{commit_id}"
-        if hasattr(self, '_commit_changes_cache') and cache_key in self._commit_changes_cache and not force:
+        if cache_key in self._commit_changes_cache and not force:
             return self._commit_changes_cache[cache_key]
         
         # URL for the GitLab API endpoint
         url = f"{GITLAB_SERVER_URL}/api/v4/projects/{self.project_id}/repository/commits/{commit_id}/diff"
 
-        # Headers for the request
-        headers = {
-            "PRIVATE-TOKEN": GITLAB_PRIVATE_TOKEN
-        }
-
         # Make the GET request
-        response = requests.get(url, headers=headers)
+        response = gitlab_client.get(url)
 
         # Check if the request was successful
         if response.status_code == 200:
-            if not hasattr(self, '_commit_changes_cache'):
-                self._commit_changes_cache = {}
             self._commit_changes_cache[cache_key] = response.json()
             return response.json()
         else:
             log.error(f"获取commit {commit_id} 变更失败: {response.status_code} {response.text}")
             return []
 
-    @retry(stop_max_attempt_number=3, wait_fixed=2000)
+    def iter_notes(self):
+        """
+        逐页获取MR的评论（最新的在前），以生成器返回
+        :raise requests.HTTPError: 请求失败
+        """
+        url = f"{GITLAB_SERVER_URL}/api/v4/projects/{self.project_id}/merge_requests/{self.iid}/notes"
+        return gitlab_client.iter_json_pages(url)
+
     def get_existing_notes(self, force=False):
         """
         Get existing notes/comments from the merge request
@@ -168,69 +291,137 @@ class GitlabMergeRequestFetcher:
         """
         if hasattr(self, '_notes_cache') and self._notes_cache and not force:
             return self._notes_cache
-        
-        # URL for the GitLab API endpoint
-        url = f"{GITLAB_SERVER_URL}/api/v4/projects/{self.project_id}/merge_requests/{self.iid}/notes"
+        try:
+            self._notes_cache = list(self.iter_notes())
+            return self._notes_cache
+        except requests.HTTPError as e:
+            log.error(f"获取MR notes失败: {e}")
+            return []
 
-        # Headers for the request
-        headers = {
-            "PRIVATE-TOKEN": GITLAB_PRIVATE_TOKEN
-        }
+    def get_reviewed_commits(self, force=False, commit_ids=None):
+        """
+        获取已经被审查过的commit列表
+        通过分析现有的评论来判断哪些commits已经被审查过
+        :param commit_ids: 关心的commit短ID（8位），全部找到后不再获取更早的评论
+        :return: 已审查的commit ID列表
+        """
+        if hasattr(self, '_notes_cache') and self._notes_cache and not force:
+            notes = self._notes_cache
+        else:
+            notes = self.iter_notes()
+        targets = set(commit_ids) if commit_ids else None
 
-        # Make the GET request
-        response = requests.get(url, headers=headers)
+        reviewed_commits = set()
+        try:
+            for note in notes:
+                if note.get('system', False):  # 跳过系统消息
+                    continue
 
-        # Check if the request was successful
+                body = note.get('body', '')
+                if not body:
+                    continue
+
+                # 查找评论中的commit ID（通常是8位短ID）
+                # 匹配格式如: "🔍 Commit 审查: `12345678`" 或 "Commit 审查: `12345678`"
+                commit_matches = re.findall(r'(?:🔍\s*)?[Cc]ommit\s*审查?\s*[：:]\s*`([a-f0-9]{8})`', body)
+                if commit_matches:
+                    reviewed_commits.update(commit_matches)
+
+                # 也匹配其他可能的格式
+                commit_matches = re.findall(r'`([a-f0-9]{8})`', body)
+                if commit_matches:
+                    reviewed_commits.update(commit_matches)
+
+                if targets is not None and targets <= reviewed_commits:
+                    break
+        except requests.HTTPError as e:
+            log.error(f"获取MR notes失败: {e}")
+
+        log.info(f"📋 发现 {len(reviewed_commits)} 个已审查的commits: {list(reviewed_commits)}")
+        return list(reviewed_commits)
+
+# push事件的commit获取
+class GitlabCommitFetcher(BulkFetchMixin):
+    def __init__(self, project_id):
+        self.project_id = project_id
+        self._commit_changes_cache = {}
+
+    def get_compare_commits(self, from_sha, to_sha):
+        """
+        Get the commits between two revisions (oldest first)
+        :param from_sha: push前的commit（before）
+        :param to_sha: push后的commit（after）
+        :return: commits list
+        """
+        url = f"{GITLAB_SERVER_URL}/api/v4/projects/{self.project_id}/repository/compare"
+        response = gitlab_client.get(url, params={"from": from_sha, "to": to_sha})
         if response.status_code == 200:
-            self._notes_cache = response.json()
+            return response.json().get("commits") or []
+        else:
+            log.error(f"获取commit对比失败: {response.status_code} {response.text}")
+            return None
+
+    def get_commit_changes(self, commit_id, force=False):
+        """
+        Get the changes of a specific commit
+        :param commit_id: The commit SHA
+        :return: changes for this commit
+        """
+        if commit_id in self._commit_changes_cache and not force:
+            return self._commit_changes_cache[commit_id]
+        url = f"{GITLAB_SERVER_URL}/api/v4/projects/{self.project_id}/repository/commits/{commit_id}/diff"
+        response = gitlab_client.get(url)
+        if response.status_code == 200:
+            self._commit_changes_cache[commit_id] = response.json()
             return response.json()
         else:
-            log.error(f"获取MR notes失败: {response.status_code} {response.text}")
+            log.error(f"获取commit {commit_id} 变更失败: {response.status_code} {response.text}")
             return []
 
-    def get_reviewed_commits(self, force=False):
+    def get_commit_merge_requests(self, commit_id):
         """
-        获取已经被审查过的commit列表
-        通过分析现有的评论来判断哪些commits已经被审查过
-        :return: 已审查的commit ID列表
+        Get the merge requests that contain the commit
+        :param commit_id: The commit SHA
+        :return: merge requests list
         """
-        import re
-        
-        existing_notes = self.get_existing_notes(force)
-        if not existing_notes:
+        url = f"{GITLAB_SERVER_URL}/api/v4/projects/{self.project_id}/repository/commits/{commit_id}/merge_requests"
+        response = gitlab_client.get(url)
+        if response.status_code == 200:
+            return response.json()
+        else:
+            log.error(f"获取commit {commit_id} 关联的MR失败: {response.status_code} {response.text}")
             return []
-        
-        reviewed_commits = set()
-        
-        for note in existing_notes:
-            if note.get('system', False):  # 跳过系统消息
-                continue
-            
-            body = note.get('body', '')
-            if not body:
-                continue
-            
-            # 查找评论中的commit ID（通常是8位短ID）
-            # 匹配格式如: "🔍 Commit 审查: `12345678`" 或 "Commit 审查: `12345678`"
-            commit_matches = re.findall(r'(?:🔍\s*)?[Cc]ommit\s*审查?\s*[：:]\s*`([a-f0-9]{8})`', body)
-            if commit_matches:
-                reviewed_commits.update(commit_matches)
-            
-            # 也匹配其他可能的格式
-            commit_matches = re.findall(r'`([a-f0-9]{8})`', body)
-            if commit_matches:
-                reviewed_commits.update(commit_matches)
-        
-        log.info(f"📋 发现 {len(reviewed_commits)} 个已审查的commits: {list(reviewed_commits)}")
-        return list(reviewed_commits)
+
+    def is_protected_branch(self, branch_name):
+        """
+        判断分支是否是受保护分支
+        """
+        url = f"{GITLAB_SERVER_URL}/api/v4/projects/{self.project_id}/protected_branches/{quote(branch_name, safe='')}"
+        response = gitlab_client.get(url)
+        if response.status_code == 200:
+            return True
+        if response.status_code != 404:
+            log.error(f"获取受保护分支 {branch_name} 失败: {response.status_code} {response.text}")
+        return False
+
+    def get_file_content(self, file_path, branch_name='main', force=False):
+        """
+        Get the content of the file
+        :param file_path: The path of the file
+        :param branch_name: 分支名或commit SHA
+        :return: The content of the file
+        """
+        return fetch_file_content(self.project_id, file_path, branch_name, force)
+
 
 # gitlab仓库clone和管理
 class GitlabRepoManager:
     def __init__(self, project_id, branch_name = ""):
         self.project_id = project_id
         self.timestamp = int(time.time() * 1000)
-        self.repo_path = f"./repo/{self.project_id}_{self.timestamp}"
-        self.has_cloned = False
+        # 同一项目的多个审查可能在同一毫秒内开始，加随机后缀避免共用（并互相删除）检出目录
+        self.repo_path = f"./repo/{self.project_id}_{self.timestamp}_{uuid.uuid4().hex[:8]}"
+        self._worktrees = []
 
     def get_info(self):
         """
@@ -240,13 +431,8 @@ class GitlabRepoManager:
         # URL for the GitLab API endpoint
         url = f"{GITLAB_SERVER_URL}/api/v4/projects/{self.project_id}"
 
-        # Headers for the request
-        headers = {
-            "PRIVATE-TOKEN": GITLAB_PRIVATE_TOKEN
-        }
-
         # Make the GET request
-        response = requests.get(url, headers=headers)
+        response = gitlab_client.get(url)
 
         # Check if the request was successful
         if response.status_code == 200:
@@ -256,81 +442,59 @@ class GitlabRepoManager:
             return None
 
     @retry(stop_max_attempt_number=3, wait_fixed=2000)
-    def shallow_clone(self, branch_name = "main"):
+    def checkout_worktree(self, branch_name="main"):
         """
-        Perform a shallow clone of the repository
-        param branch_name: The name of the branch to clone
+        在项目的本地镜像上检出分支（或commit）到临时工作目录，镜像只增量fetch该分支
+        param branch_name: 分支名或commit SHA
         """
-        # If the target directory exists, remove it
-        self.delete_repo()
+        worktree_path = self.worktree_path(branch_name)
+        if worktree_path in self._worktrees:
+            repo_mirror_cache.remove_worktree(self.project_id, worktree_path)
+            self._worktrees.remove(worktree_path)
 
-        # Build the authenticated URL
         repo_info = self.get_info()
         if not repo_info or "http_url_to_repo" not in repo_info:
             raise ValueError("无法获取仓库信息或http_url_to_repo")
-        authenticated_url = self._build_authenticated_url(repo_info["http_url_to_repo"])
+        repo_mirror_cache.add_worktree(self.project_id, repo_info["http_url_to_repo"], branch_name, worktree_path)
+        self._worktrees.append(worktree_path)
 
-        # Build the Git command
-        command = ["git", "clone", authenticated_url, "--depth", "1"]
-        if branch_name:
-            command.extend(["--branch", branch_name])
-            command.extend([self.repo_path + "/" + str(branch_name)])
-        else:
-            command.extend([self.repo_path + "/default"])
-        # command 添加clone到的位置：
-        if run_command(command) != 0:
-            log.error("Failed to clone the repository")
-        self.has_cloned = True
+    def worktree_path(self, branch_name):
+        return self.repo_path + "/" + str(branch_name or "default")
 
     # 切换分支
     def checkout_branch(self, branch_name, force=False):
-        # Build the Git command
-        if not self.has_cloned:
-            self.shallow_clone(branch_name)
-        else:
-            # 检查是否已经在目标分支上
-            if not force and os.path.exists(self.repo_path + "/" + str(branch_name) + "/.git"):
-                return
-            else:
-                self.shallow_clone(branch_name)
+        # 检查是否已经检出目标分支
+        if not force and self.worktree_path(branch_name) in self._worktrees:
+            return
+        self.checkout_worktree(branch_name)
 
     # 删除库
     def delete_repo(self):
+        for worktree_path in self._worktrees:
+            repo_mirror_cache.remove_worktree(self.project_id, worktree_path)
+        self._worktrees = []
         if os.path.exists(self.repo_path):
             shutil.rmtree(self.repo_path)
 
     # 查找相关文件列表
-    def find_files_by_keyword(self, keyword, branch_name="main"):
-        matching_files = []
-        regex = re.compile(keyword)
+    def find_files_by_keyword(self, keyword, branch_name="main", path_globs=None, extensions=None):
+        """
+        在分支（或commit）的代码中搜索正则keyword
+        :param path_globs: 路径过滤（相对于仓库根目录的glob），例如 ["src/**"]
+        :param extensions: 扩展名过滤，例如 [".py"]
+        :return: 匹配文件的路径列表
+        """
         self.checkout_branch(branch_name)
-        for root, _, files in os.walk(self.repo_path + "/" + str(branch_name)):
-            for file in files:
-                file_path = os.path.join(root, file)
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                        if regex.search(content):
-                            matching_files.append(file_path)
-                except (UnicodeDecodeError, FileNotFoundError, PermissionError):
-                    # 跳过无法读取的文件
-                    continue
-
-        return matching_files
+        worktree_path = self.worktree_path(branch_name)
+        try:
+            commit_sha = run_git(["-C", worktree_path, "rev-parse", "HEAD"]).strip()
+        except RuntimeError:
+            commit_sha = None
+        matches = code_searcher.search(worktree_path, keyword, path_globs, extensions,
+                                       cache_key=(str(self.project_id), commit_sha) if commit_sha else None)
+        return [os.path.join(worktree_path, path) for path in matches]
 
 
-    # 构建带有身份验证信息的 URL
-    def _build_authenticated_url(self, repo_url):
-        # 如果 URL 使用 https
-        token = GITLAB_PRIVATE_TOKEN
-        if repo_url.startswith("https://"):
-            return f"https://oauth2:{token}@{repo_url[8:]}"
-        # 如果 URL 使用 http
-        elif repo_url.startswith("http://"):
-            return f"http://oauth2:{token}@{repo_url[7:]}"
-        else:
-            raise ValueError("Unsupported URL scheme")
-
 def is_merge_request_opened(gitlab_payload) -> bool:
     """
     判断是否是需要审查的merge request事件
@@ -357,7 +521,7 @@ def is_merge_request_opened(gitlab_payload) -> bool:
                 merge_status in ["preparing", "unchecked"] and 
                 action == "open"
             )
-            log.info(f"严格模式检查: {is_first_open}")
+            log.debug(f"严格模式检查: {is_first_open}")
             return is_first_open
         else:
             # 灵活模式：根据配置决定是否在更新时审查
@@ -371,9 +535,32 @@ def is_merge_request_opened(gitlab_payload) -> bool:
                 action in allowed_actions
             )
             
-            log.info(f"灵活模式检查: {is_reviewable}")
+            log.debug(f"灵活模式检查: {is_reviewable}")
             return is_reviewable
         
     except Exception as e:
         log.error(f"判断是否是merge request打开事件失败: {e}")
-        return False
\ No newline at end of file
+        return False
+
+def get_merge_request_head_sha(gitlab_payload):
+    """
+    获取webhook中MR的head commit SHA
+    优先使用 diff_refs.head_sha，其次使用 last_commit.id
+    """
+    object_attributes = (gitlab_payload or {}).get("object_attributes") or {}
+    diff_refs = object_attributes.get("diff_refs") or {}
+    if diff_refs.get("head_sha"):
+        return diff_refs["head_sha"]
+    last_commit = object_attributes.get("last_commit") or {}
+    return last_commit.get("id")
+
+
+def get_push_branch(gitlab_payload):
+    """
+    获取push事件推送的分支名，删除分支或非分支的ref返回None
+    """
+    ref = (gitlab_payload or {}).get("ref") or ""
+    after = (gitlab_payload or {}).get("after") or ""
+    if not ref.startswith("refs/heads/") or not after.strip("0"):
+        return None
+    return ref[len("refs/heads/"):]
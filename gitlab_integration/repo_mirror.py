@@ -0,0 +1,263 @@
+import base64
+import os
+import re
+import shutil
+import subprocess
+import threading
+
+from config.config import GITLAB_PRIVATE_TOKEN, REPO_MIRROR_DIR, REPO_MIRROR_MAX_SIZE, REPO_GIT_TIMEOUT
+from utils.logger import log
+
+_COMMIT_SHA_PATTERN = re.compile(r"^[0-9a-f]{40}$")
+
+
+def run_git(args, timeout=REPO_GIT_TIMEOUT, authenticated=False):
+    """
+    执行git命令，失败时抛出RuntimeError
+    :param authenticated: 通过环境变量传入GitLab认证头，token不会写入仓库配置，也不会出现在命令行参数中
+    :return: stdout
+    """
+    env = None
+    if authenticated:
+        credential = base64.b64encode(f"oauth2:{GITLAB_PRIVATE_TOKEN}".encode()).decode()
+        env = dict(os.environ, GIT_TERMINAL_PROMPT="0", GIT_CONFIG_COUNT="1",
+                   GIT_CONFIG_KEY_0="http.extraHeader", GIT_CONFIG_VALUE_0=f"Authorization: Basic {credential}")
+    result = subprocess.run(["git"] + args, capture_output=True, text=True, timeout=timeout, env=env)
+    if result.returncode != 0:
+        command = next((arg for arg in args if not arg.startswith("-") and not os.path.isabs(arg)), "")
+        raise RuntimeError(f"git {command} failed: {result.stderr.strip()}")
+    return result.stdout
+
+
+def _dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            try:
+                total += os.path.getsize(os.path.join(root, file))
+            except OSError:
+                continue
+    return total
+
+
+class CatFileReader:
+    """
+    持久的 git cat-file --batch 进程：通过同一个管道读取任意数量的对象，不再每个文件启动一个子进程
+    线程安全，进程异常退出后下次读取时自动重启
+    """
+
+    def __init__(self, repo_path):
+        self.repo_path = repo_path
+        self._process = None
+        self._lock = threading.Lock()
+
+    def read(self, spec):
+        """
+        :param spec: git对象名，例如 <commit>:<path>、<sha>^{commit}
+        :return: (对象类型, 内容bytes)，对象不存在时返回None
+        :raise OSError: cat-file进程无法读取，或输出不符合协议
+        """
+        with self._lock:
+            for attempt in range(2):
+                if self._process is None or self._process.poll() is not None:
+                    self._process = subprocess.Popen(["git", "-C", self.repo_path, "cat-file", "--batch"],
+                                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                                     stderr=subprocess.DEVNULL)
+                try:
+                    self._process.stdin.write(spec.encode("utf-8") + b"\n")
+                    self._process.stdin.flush()
+                    header = self._process.stdout.readline()
+                    if not header:
+                        raise BrokenPipeError("git cat-file exited")
+                except OSError:
+                    # 进程已退出，重启后重试一次
+                    self._close_locked()
+                    if attempt:
+                        raise
+                    continue
+                header = header.rstrip(b"\n")
+                # "<spec> missing" / "<spec> ambiguous"，spec中可能包含空格
+                if header.endswith((b" missing", b" ambiguous")):
+                    return None
+                # "<oid> <type> <size>"
+                parts = header.rsplit(b" ", 2)
+                if len(parts) != 3 or not parts[2].isdigit():
+                    # 输出与请求已经错位，进程不能再用，重试也无意义
+                    self._close_locked()
+                    raise OSError(f"unexpected git cat-file header: {header[:200]!r}")
+                data = self._process.stdout.read(int(parts[2]))
+                self._process.stdout.read(1)  # 对象内容后的换行
+                return parts[1].decode(), data
+        return None
+
+    def close(self):
+        with self._lock:
+            self._close_locked()
+
+    def _close_locked(self):
+        if self._process is not None:
+            try:
+                self._process.stdin.close()
+                self._process.kill()
+                self._process.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                pass
+            self._process = None
+
+
+class RepoMirrorCache:
+    """
+    项目仓库的本地bare镜像缓存
+    - 每个项目一个长期保留的bare仓库，之后的审查只增量fetch需要的分支（或commit），不再每次完整clone
+    - 审查通过 git worktree 在镜像上检出临时工作目录，用完即删除
+    - 镜像中已有的commit，文件内容通过常驻的 git cat-file --batch 进程直接读取
+    - 镜像总大小超过上限时按最近使用时间淘汰（LRU），正在使用的镜像不淘汰
+    """
+
+    def __init__(self, root=REPO_MIRROR_DIR, max_size=REPO_MIRROR_MAX_SIZE):
+        self.root = root
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._project_locks = {}
+        self._in_use = {}  # str(project_id) -> 正在使用的worktree数
+        self._readers = {}  # str(project_id) -> CatFileReader
+
+    def mirror_path(self, project_id):
+        return os.path.join(self.root, f"{project_id}.git")
+
+    def _project_lock(self, project_id):
+        with self._lock:
+            return self._project_locks.setdefault(str(project_id), threading.Lock())
+
+    def _update_in_use(self, project_id, delta):
+        key = str(project_id)
+        with self._lock:
+            self._in_use[key] = self._in_use.get(key, 0) + delta
+            if self._in_use[key] <= 0:
+                del self._in_use[key]
+
+    def fetch(self, project_id, repo_url, ref, initial_depth=None):
+        """
+        增量更新镜像中的一个分支或commit，首次使用时初始化镜像
+        :param ref: 分支名或commit SHA
+        :param initial_depth: 初始化镜像时只fetch该深度的历史（浅镜像），已有镜像时忽略
+        :return: 可检出的ref
+        """
+        path = self.mirror_path(project_id)
+        if _COMMIT_SHA_PATTERN.match(ref):
+            refspec, target = ref, ref
+        else:
+            refspec, target = f"+refs/heads/{ref}:refs/heads/{ref}", f"refs/heads/{ref}"
+        depth_args = []
+        with self._project_lock(project_id):
+            if not os.path.exists(os.path.join(path, "HEAD")):
+                os.makedirs(path, exist_ok=True)
+                run_git(["init", "--bare", "--quiet", path])
+                log.info(f"📦 初始化项目 {project_id} 的仓库镜像")
+                if initial_depth:
+                    depth_args = ["--depth", str(initial_depth)]
+            elif _COMMIT_SHA_PATTERN.match(ref) and self.has_commit(project_id, ref):
+                os.utime(path)
+                return target
+            run_git(["-C", path, "fetch", "--quiet", "--no-tags", *depth_args, repo_url, refspec],
+                    authenticated=True)
+            os.utime(path)
+        return target
+
+    def has_mirror(self, project_id):
+        return os.path.exists(os.path.join(self.mirror_path(project_id), "HEAD"))
+
+    def _reader(self, project_id):
+        with self._lock:
+            reader = self._readers.get(str(project_id))
+            if reader is None:
+                reader = self._readers[str(project_id)] = CatFileReader(self.mirror_path(project_id))
+            return reader
+
+    def has_commit(self, project_id, sha):
+        if not self.has_mirror(project_id):
+            return False
+        try:
+            return self._reader(project_id).read(f"{sha}^{{commit}}") is not None
+        except OSError:
+            return False
+
+    def read_file(self, project_id, commit_sha, file_path):
+        """
+        从镜像读取某个commit中的文件
+        :return: (镜像中是否有该commit, 文件内容)，没有该commit时调用方应回退到GitLab API；文件不存在时内容为None
+        """
+        if not self.has_commit(project_id, commit_sha):
+            return False, None
+        try:
+            result = self._reader(project_id).read(f"{commit_sha}:{file_path}")
+        except OSError as e:
+            log.warning(f"⚠️ 从本地镜像读取 {file_path} 失败: {e}")
+            return False, None
+        if result is None or result[0] != "blob":
+            return True, None
+        return True, result[1].decode("utf-8", errors="replace")
+
+    def add_worktree(self, project_id, repo_url, ref, worktree_path):
+        """
+        更新镜像并在worktree_path检出ref（detached），使用完后需调用remove_worktree
+        """
+        self._update_in_use(project_id, 1)
+        try:
+            target = self.fetch(project_id, repo_url, ref)
+            with self._project_lock(project_id):
+                os.makedirs(os.path.dirname(os.path.abspath(worktree_path)), exist_ok=True)
+                run_git(["-C", self.mirror_path(project_id), "worktree", "add", "--detach", "--force", "--quiet",
+                         os.path.abspath(worktree_path), target])
+        except Exception:
+            self._update_in_use(project_id, -1)
+            raise
+
+    def remove_worktree(self, project_id, worktree_path):
+        """删除worktree，之后检查镜像总大小"""
+        try:
+            with self._project_lock(project_id):
+                try:
+                    run_git(["-C", self.mirror_path(project_id), "worktree", "remove", "--force",
+                             os.path.abspath(worktree_path)])
+                except RuntimeError as e:
+                    log.warning(f"⚠️ 删除worktree失败: {e}")
+                    shutil.rmtree(worktree_path, ignore_errors=True)
+                    run_git(["-C", self.mirror_path(project_id), "worktree", "prune"])
+        finally:
+            self._update_in_use(project_id, -1)
+        self.evict()
+
+    def evict(self):
+        """镜像总大小超过上限时，按最近使用时间从旧到新删除未在使用的镜像"""
+        if not os.path.isdir(self.root):
+            return
+        mirrors = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.endswith(".git") and os.path.isdir(path):
+                mirrors.append((os.path.getmtime(path), name[:-4], path, _dir_size(path)))
+        total = sum(size for _, _, _, size in mirrors)
+        for _, project_id, path, size in sorted(mirrors):
+            if total <= self.max_size:
+                break
+            lock = self._project_lock(project_id)
+            if not lock.acquire(blocking=False):
+                continue
+            try:
+                with self._lock:
+                    if self._in_use.get(project_id):
+                        continue
+                with self._lock:
+                    reader = self._readers.pop(project_id, None)
+                if reader is not None:
+                    reader.close()
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+                log.info(f"🧹 淘汰项目 {project_id} 的仓库镜像，释放 {size / 1024 / 1024:.1f}MB")
+            finally:
+                lock.release()
+
+
+# 所有审查共享的仓库镜像缓存
+repo_mirror_cache = RepoMirrorCache()
@@ -1,92 +1,345 @@
-import json
-import threading
+from fnmatch import fnmatch
 
 from flask import request, jsonify
 
-from gitlab_integration.gitlab_fetcher import GitlabMergeRequestFetcher, GitlabRepoManager
+from config.config import (REVIEW_QUEUE_RETRY_AFTER, REVIEW_UPDATE_DEBOUNCE_SECONDS, REVIEW_SCHEDULER_ENABLED,
+                           PUSH_REVIEW_ENABLED, PUSH_REVIEW_PROTECTED_BRANCHES, PUSH_REVIEW_BRANCHES, MAX_FILES)
+from gitlab_integration.event_dedup import create_event_deduplicator
+from gitlab_integration.content_cache import file_content_cache
+from gitlab_integration.gitlab_client import gitlab_client
+from gitlab_integration.gitlab_fetcher import GitlabMergeRequestFetcher, GitlabRepoManager, GitlabCommitFetcher
+from large_model.llm_generator import LLMGenerator
+from large_model.token_counter import count_tokens
+from large_model.llm_runtime import llm_event_loop
 from response_module.response_controller import ReviewResponse
-from review_engine.review_engine import ReviewEngine
+from review_engine.job_store import create_job_store
+from review_engine.review_engine import ReviewEngine, get_handler_stats
+from review_engine.review_queue import ReviewJob, ReviewJobQueue, ReviewQueueFullError, ReviewQueueClosedError
+from review_engine.review_scheduler import ReviewScheduler
+from utils.json_scanner import scan_json_fields
 from utils.logger import log
-from gitlab_integration.gitlab_fetcher import is_merge_request_opened
+from utils.metrics import render_prometheus
+from gitlab_integration.gitlab_fetcher import is_merge_request_opened, get_merge_request_head_sha, get_push_branch
+
+# webhook响应前只提取以下字段（调度、去重与合并所需），其余内容在worker中解析
+# 按事件类型分别定义：所需字段全部找到后扫描即提前结束，不必扫描commits、changes等大字段
+MERGE_REQUEST_EVENT_FIELDS = {
+    'object_kind': None,
+    'project': {'id': None, 'path_with_namespace': None},
+    'object_attributes': {
+        'iid': None,
+        'action': None,
+        'state': None,
+        'merge_status': None,
+        # head commit优先使用diff_refs.head_sha（与审查的diff一致），其次last_commit.id
+        'diff_refs': {'head_sha': None},
+        'last_commit': {'id': None},
+    },
+    'labels': None,
+}
+PUSH_EVENT_FIELDS = {
+    'object_kind': None,
+    'project': {'id': None, 'path_with_namespace': None},
+    'ref': None,
+    'before': None,
+    'after': None,
+}
+# X-Gitlab-Event请求头 -> (object_kind, 提取字段)
+WEBHOOK_EVENT_SPECS = {
+    'Merge Request Hook': ('merge_request', MERGE_REQUEST_EVENT_FIELDS),
+    'Push Hook': ('push', PUSH_EVENT_FIELDS),
+}
+# 请求头缺失或未知（如System Hook）时使用所有字段，需要扫描整个payload
+WEBHOOK_EVENT_FIELDS = {**MERGE_REQUEST_EVENT_FIELDS, **PUSH_EVENT_FIELDS}
+
+
+def scan_webhook_event(raw_payload, event_header=None):
+    """
+    按X-Gitlab-Event请求头选择需要提取的字段
+    请求头与payload的object_kind不一致时按所有字段重新提取
+    :raises ValueError: payload不是合法的JSON对象
+    """
+    object_kind, fields = WEBHOOK_EVENT_SPECS.get(event_header, (None, WEBHOOK_EVENT_FIELDS))
+    event = scan_json_fields(raw_payload, fields)
+    if object_kind is not None and event.get('object_kind') != object_kind:
+        event = scan_json_fields(raw_payload, WEBHOOK_EVENT_FIELDS)
+    return event
+
 
 class WebhookListener:
     def __init__(self):
-        pass
+        scheduler = ReviewScheduler(self.size_review_job) if REVIEW_SCHEDULER_ENABLED else None
+        self.review_queue = ReviewJobQueue(self.run_review_job, job_store=create_job_store(), scheduler=scheduler)
+        self.event_deduplicator = create_event_deduplicator()
 
     def handle_webhook(self):
         """
         处理webhook的请求
+        只从原始body中提取调度所需的少量字段并立即响应，完整payload在worker中解析
         :return:
         """
-        gitlab_payload = request.data.decode('utf-8')
-        gitlab_payload = json.loads(gitlab_payload)
-        
-        # 提取关键信息用于日志
-        event_type = gitlab_payload.get('object_kind')
-        if event_type == 'merge_request':
-            object_attributes = gitlab_payload.get('object_attributes', {})
-            project_info = gitlab_payload.get('project', {})
-            log.info(f"📋 MR #{object_attributes.get('iid', 'Unknown')} - {object_attributes.get('title', 'Unknown')} (项目: {project_info.get('name', 'Unknown')})")
-            log.info(f"📊 状态: {object_attributes.get('state')}/{object_attributes.get('action')}/{object_attributes.get('merge_status')}")
-        else:
-            log.info(f"📋 收到Webhook: {event_type}")
-        
-        return self.call_handle(gitlab_payload, event_type)
+        raw_payload = request.get_data()
+        try:
+            event = scan_webhook_event(raw_payload, request.headers.get('X-Gitlab-Event'))
+        except ValueError as e:
+            log.warning(f"⚠️ 无法解析webhook payload: {e}")
+            return jsonify({'status': 'bad request', 'msg': 'invalid json payload'}), 400
+        if not isinstance(event.get('project'), dict) or 'id' not in event['project']:
+            return jsonify({'status': 'bad request', 'msg': 'missing project id'}), 400
+
+        return self.call_handle(event, raw_payload, event.get('object_kind'))
 
-    def call_handle(self, gitlab_payload, event_type):
+    def call_handle(self, event, raw_payload, event_type):
+        """
+        :param event: scan_webhook_event提取出的最小字段，结构与webhook payload一致
+        :param raw_payload: webhook原始body
+        """
         if event_type == 'merge_request':
+            if 'iid' not in (event.get('object_attributes') or {}):
+                return jsonify({'status': 'bad request', 'msg': 'missing merge request iid'}), 400
             config = {
                 'type': 'merge_request',
-                'project_id': gitlab_payload.get('project')['id'],
-                'merge_request_iid': gitlab_payload.get('object_attributes')['iid']
+                'project_id': event.get('project')['id'],
+                'merge_request_iid': event.get('object_attributes')['iid']
             }
             reply = ReviewResponse(config)
-            return self.handle_merge_request(gitlab_payload, reply)
+            return self.handle_merge_request(event, raw_payload, reply)
         elif event_type == 'push':
             config = {
                 'type': 'push',
-                'project_id': gitlab_payload.get('project')['id']
+                'project_id': event.get('project')['id']
             }
             reply = ReviewResponse(config)
 
-            return self.handle_push(gitlab_payload, reply)
+            return self.handle_push(event, raw_payload, reply)
         else:
             config = {
                 'type': 'other',
-                'project_id': gitlab_payload.get('project')['id']
+                'project_id': event.get('project')['id']
             }
             reply = ReviewResponse(config)
-            return self.handle_other(gitlab_payload, reply)
+            return self.handle_other(event, reply)
 
-    def handle_merge_request(self, gitlab_payload, reply):
+    def handle_merge_request(self, event, raw_payload, reply):
         """
         处理合并请求事件
         """
-        if is_merge_request_opened(gitlab_payload):
-            project_id = gitlab_payload.get('project')['id']
-            merge_request_iid = gitlab_payload.get("object_attributes")["iid"]
-            log.info(f"🚀 开始处理MR #{merge_request_iid}")
+        object_attributes = event.get("object_attributes") or {}
+        if object_attributes.get("action") in ('close', 'merge'):
+            # MR已关闭或合并，排队和执行中的审查都不再需要
+            cancelled = self.review_queue.cancel('merge_request', (event.get('project')['id'], object_attributes['iid']),
+                                                 f"merge request {object_attributes.get('action')}d")
+            return jsonify({'status': 'cancelled' if cancelled else 'do not need check',
+                            'cancelled_jobs': cancelled}), 200
+        if is_merge_request_opened(event):
+            project_id = event.get('project')['id']
+            merge_request_iid = event.get("object_attributes")["iid"]
+            action = event.get("object_attributes", {}).get("action")
+            # 更新事件延迟执行，期间同一MR的后续推送会合并为一次审查
+            job = ReviewJob('merge_request', project_id, raw_payload,
+                            merge_request_iid=merge_request_iid, reply_config=reply.config,
+                            head_sha=get_merge_request_head_sha(event),
+                            debounce=REVIEW_UPDATE_DEBOUNCE_SECONDS if action == 'update' else 0,
+                            labels=[label.get('title') for label in event.get('labels') or []
+                                    if isinstance(label, dict) and label.get('title')],
+                            project_path=event.get('project').get('path_with_namespace'))
+            # GitLab超时重试的同一事件直接忽略，不再调度审查
+            dedup_keys = self.event_deduplicator.build_keys(event, request.headers.get('X-Gitlab-Event-UUID'))
+            if not self.event_deduplicator.claim(dedup_keys):
+                log.info(f"🔁 MR #{merge_request_iid} 的重复webhook事件，忽略")
+                return jsonify({'status': 'duplicate event'}), 200
+            response, code = self.enqueue_job(job)
+            if code != 200:
+                self.event_deduplicator.release(dedup_keys)
+            return response, code
+        return jsonify({'status': 'do not need check'}), 200
+
+    def enqueue_job(self, job):
+        """
+        将审查任务放入队列，队列满或关闭时返回背压响应
+        """
+        try:
+            job = self.review_queue.submit(job)
+        except ReviewQueueFullError:
+            log.warning(f"⚠️ 审查队列已满，拒绝任务 {job.job_id}")
+            return self._backpressure_response('review queue is full', 429)
+        except ReviewQueueClosedError:
+            log.warning(f"⚠️ 服务正在关闭，拒绝任务 {job.job_id}")
+            return self._backpressure_response('service is shutting down', 503)
+        return jsonify({'status': 'success', 'job_id': job.job_id}), 200
+
+    def _backpressure_response(self, msg, code):
+        response = jsonify({'status': 'rejected', 'msg': msg})
+        response.headers['Retry-After'] = str(REVIEW_QUEUE_RETRY_AFTER)
+        return response, code
+
+    def run_review_job(self, job):
+        """
+        worker线程中执行审查任务
+        """
+        if job.kind == 'merge_request':
+            gitlab_payload = job.load_payload()
+            object_attributes = gitlab_payload.get('object_attributes', {})
+            project_info = gitlab_payload.get('project', {})
+            log.info(f"📋 MR #{object_attributes.get('iid', 'Unknown')} - {object_attributes.get('title', 'Unknown')} (项目: {project_info.get('name', 'Unknown')})")
+            log.info(f"📊 状态: {object_attributes.get('state')}/{object_attributes.get('action')}/{object_attributes.get('merge_status')}")
+            log.info(f"🚀 开始处理MR #{job.merge_request_iid}")
+            reply = ReviewResponse(job.reply_config)
             review_engine = ReviewEngine(reply)
-            gitlabMergeRequestFetcher = GitlabMergeRequestFetcher(project_id, merge_request_iid)
-            gitlabRepoManager = GitlabRepoManager(project_id)
-            thread = threading.Thread(target=review_engine.handle_merge, args=(gitlabMergeRequestFetcher, gitlabRepoManager, gitlab_payload))
-            thread.start()
+            gitlabMergeRequestFetcher = job.fetcher or GitlabMergeRequestFetcher(job.project_id, job.merge_request_iid)
+            gitlabRepoManager = GitlabRepoManager(job.project_id)
+            review_engine.handle_merge(gitlabMergeRequestFetcher, gitlabRepoManager, gitlab_payload, job.cancel_token)
+        elif job.kind == 'push':
+            self.run_push_job(job)
+        else:
+            log.warning(f"未知的任务类型: {job.kind}")
 
-            return jsonify({'status': 'success'}), 200
-        return jsonify({'status': 'do not need check'}), 200
+    def run_push_job(self, job):
+        """
+        worker线程中执行push审查任务
+        """
+        gitlab_payload = job.load_payload()
+        branch = get_push_branch(gitlab_payload)
+        gitlabCommitFetcher = GitlabCommitFetcher(job.project_id)
+        if not self._is_push_review_branch(branch) and not (
+                PUSH_REVIEW_PROTECTED_BRANCHES and gitlabCommitFetcher.is_protected_branch(branch)):
+            log.info(f"📋 分支 {branch} 不是受保护分支，跳过push审查")
+            return
+        before, after = gitlab_payload.get('before') or '', gitlab_payload.get('after')
+        if before.strip('0'):
+            commits = gitlabCommitFetcher.get_compare_commits(before, after)
+        else:
+            # 新建分支没有before，使用webhook中的commit列表
+            commits = [{
+                'id': commit['id'],
+                'message': commit.get('message', ''),
+                'author_name': (commit.get('author') or {}).get('name', ''),
+                'created_at': commit.get('timestamp', ''),
+            } for commit in gitlab_payload.get('commits') or []]
+        if not commits:
+            log.info(f"📋 push {after[:8]} 没有新的commits，跳过审查")
+            return
+        log.info(f"🚀 开始处理push {branch}@{after[:8]}（{len(commits)} 个commits，"
+                 f"项目: {(gitlab_payload.get('project') or {}).get('name', 'Unknown')}）")
+        push_info = {
+            'branch': branch,
+            'before': before,
+            'after': after,
+            'commits': commits,
+            'hook_info': gitlab_payload,
+        }
+        review_engine = ReviewEngine(ReviewResponse(job.reply_config))
+        review_engine.handle_push(gitlabCommitFetcher, push_info, job.cancel_token)
+
+    def size_review_job(self, job):
+        """
+        预估MR规模供调度器排序：变更文件数与diff的预估token数
+        获取changes的fetcher保存在任务上，执行审查时直接复用
+        """
+        fetcher = GitlabMergeRequestFetcher(job.project_id, job.merge_request_iid)
+        changes = fetcher.get_changes(limit=MAX_FILES + 1) or []
+        job.fetcher = fetcher
+        return len(changes), sum(count_tokens(change.get('diff') or '') for change in changes)
+
+    def get_queue_stats(self):
+        return dict(self.review_queue.get_stats(), handlers=get_handler_stats())
+
+    def get_metrics(self):
+        """
+        审查队列的Prometheus指标，包含各项目排队与执行中的任务数
+        """
+        stats = self.review_queue.get_stats()
+        tenant_labels = [({'project_id': project_id, 'project_path': tenant['project_path'], 'group': tenant['group']},
+                          tenant) for project_id, tenant in stats['tenants'].items()]
+        counters = ['submitted', 'rejected', 'completed', 'failed', 'coalesced', 'superseded', 'cancelled',
+                    'redelivered']
+        metrics = [
+            ('codereview_queue_depth', 'gauge', 'Review jobs waiting in the queue', [({}, stats['queue_depth'])]),
+            ('codereview_queue_max_size', 'gauge', 'Review queue capacity', [({}, stats['queue_max_size'])]),
+            ('codereview_workers', 'gauge', 'Review worker threads', [({}, stats['workers'])]),
+            ('codereview_busy_workers', 'gauge', 'Review workers running a job', [({}, stats['busy_workers'])]),
+            ('codereview_jobs_total', 'counter', 'Review jobs by outcome',
+             [({'result': name}, stats[name]) for name in counters]),
+            ('codereview_tenant_queued_jobs', 'gauge', 'Queued review jobs per project',
+             [(labels, tenant['queued']) for labels, tenant in tenant_labels]),
+            ('codereview_tenant_running_jobs', 'gauge', 'In-flight review jobs per project',
+             [(labels, tenant['running']) for labels, tenant in tenant_labels]),
+        ]
+        handler_stats = get_handler_stats()
+        metrics.append(('codereview_zombie_handlers', 'gauge',
+                        'Handlers still running after their review job was cancelled',
+                        [({}, handler_stats['zombie_handlers'])]))
+        client_stats = gitlab_client.get_stats()
+        metrics.append(('codereview_gitlab_conditional_requests_total', 'counter',
+                        'GitLab JSON requests by ETag revalidation outcome',
+                        [({'result': 'not_modified'}, client_stats['not_modified']),
+                         ({'result': 'modified'}, client_stats['modified'])]))
+        metrics.append(('codereview_gitlab_retries_total', 'counter', 'GitLab requests retried after an error',
+                        [({}, client_stats['retries'])]))
+        metrics.append(('codereview_gitlab_throttled_total', 'counter',
+                        'Times GitLab reported an exhausted rate limit', [({}, client_stats['throttled'])]))
+        metrics.append(('codereview_llm_requests_in_flight', 'gauge', 'LLM requests in flight per provider',
+                        [({'provider': provider}, count)
+                         for provider, count in llm_event_loop.get_stats()['in_flight'].items()]))
+        llm_cache_stats = LLMGenerator.response_cache_stats()
+        if llm_cache_stats is not None:
+            metrics.append(('codereview_llm_cache_requests_total', 'counter', 'LLM response cache lookups',
+                            [({'result': 'hit'}, llm_cache_stats['hits']),
+                             ({'result': 'miss'}, llm_cache_stats['misses'])]))
+        if file_content_cache is not None:
+            cache_stats = file_content_cache.get_stats()
+            metrics += [
+                ('codereview_file_cache_requests_total', 'counter', 'GitLab file content cache lookups',
+                 [({'result': 'hit'}, cache_stats['hits']), ({'result': 'miss'}, cache_stats['misses'])]),
+                ('codereview_file_cache_size', 'gauge', 'Characters held in the in-process file content cache',
+                 [({}, cache_stats['size'])]),
+            ]
+        return render_prometheus(metrics)
+
+    def shutdown(self, timeout=None):
+        """
+        优雅退出：不再接收新任务，等待队列中已有的审查完成
+        """
+        log.info(f"🛑 服务停止中，等待审查任务完成（最长 {timeout}s）...")
+        self.review_queue.shutdown(wait=True, timeout=timeout)
+        stats = self.review_queue.get_stats()
+        left = stats['queue_depth'] + stats['busy_workers']
+        if left:
+            log.warning(f"⚠️ 仍有 {left} 个审查任务未完成" +
+                        ("，将在重启后重新投递" if 'stored_jobs' in stats else "，这些任务将丢失"))
+        else:
+            log.info("✅ 所有审查任务已完成")
 
-    def handle_push(self, gitlab_payload, reply):
+    def handle_push(self, event, raw_payload, reply):
         """
         处理推送事件
+        受保护分支的检查需要访问GitLab，在worker中进行
         """
+        branch = get_push_branch(event)
+        if not PUSH_REVIEW_ENABLED or not branch or not (
+                PUSH_REVIEW_PROTECTED_BRANCHES or self._is_push_review_branch(branch)):
+            return jsonify({'status': 'do not need check'}), 200
+        # 一次push的所有commit作为一个任务
+        job = ReviewJob('push', event.get('project')['id'], raw_payload, reply_config=reply.config,
+                        head_sha=event.get('after'), project_path=event.get('project').get('path_with_namespace'))
+        dedup_keys = self.event_deduplicator.build_keys(event, request.headers.get('X-Gitlab-Event-UUID'))
+        if not self.event_deduplicator.claim(dedup_keys):
+            log.info(f"🔁 push {event.get('after')} 的重复webhook事件，忽略")
+            return jsonify({'status': 'duplicate event'}), 200
+        response, code = self.enqueue_job(job)
+        if code != 200:
+            self.event_deduplicator.release(dedup_keys)
+        return response, code
 
-        return jsonify({'status': 'success'}), 200
+    @staticmethod
+    def _is_push_review_branch(branch):
+        return any(fnmatch(branch, pattern) for pattern in PUSH_REVIEW_BRANCHES)
 
-    def handle_other(self, gitlab_payload, reply):
+    def handle_other(self, event, reply):
         """
         处理其他事件
         """
-        event_type = gitlab_payload.get('object_kind')
+        event_type = event.get('object_kind')
         log.info(f"Unhandled event type: {event_type}")
         return jsonify({'status': 'unhandled event type'}), 200
 
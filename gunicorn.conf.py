@@ -0,0 +1,35 @@
+# gunicorn配置，运行参数统一来自 config/config.py
+# 启动方式：gunicorn -c gunicorn.conf.py wsgi:app
+from config.config import SERVER_HOST, SERVER_PORT, SERVER_WORKERS, SERVER_THREADS, SERVER_GRACEFUL_TIMEOUT
+
+bind = f"{SERVER_HOST}:{SERVER_PORT}"
+workers = SERVER_WORKERS
+threads = SERVER_THREADS
+worker_class = "gthread"
+# webhook只做入队，请求本身很快返回
+timeout = 60
+# worker退出时需要等待已入队的审查任务完成
+graceful_timeout = SERVER_GRACEFUL_TIMEOUT
+keepalive = 5
+accesslog = "-"
+
+
+def on_starting(server):
+    # 审查队列（合并、防抖、公平调度、取消）在进程内，多个进程各自维护一个队列时这些保证只在单个进程内成立，
+    # 同一MR的更新落到不同进程会被重复审查；并发通过 SERVER_THREADS 与 REVIEW_WORKER_NUM 扩展
+    if SERVER_WORKERS != 1:
+        raise RuntimeError(f"SERVER_WORKERS={SERVER_WORKERS} is not supported: the review queue lives in the "
+                           f"worker process, run a single worker and scale with SERVER_THREADS / REVIEW_WORKER_NUM")
+    from utils.args_check import check_config
+    check_config()
+
+
+def post_worker_init(worker):
+    # 启动审查worker，配置了任务存储时会接管上次未完成的任务
+    from gitlab_integration.webhook_listener import webhook_listener
+    webhook_listener.review_queue.start()
+
+
+def worker_exit(server, worker):
+    from gitlab_integration.webhook_listener import webhook_listener
+    webhook_listener.shutdown(SERVER_GRACEFUL_TIMEOUT)
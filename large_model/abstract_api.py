@@ -1,6 +1,97 @@
+import asyncio
+import threading
+import time
 from abc import ABC, abstractmethod
 
+from large_model.llm_runtime import llm_event_loop
+from utils.cancellation import wait_futures
+
+
+class LLMResponse:
+    """
+    单次模型调用的结果，每次generate_text返回新的对象，调用之间互不影响
+    """
+
+    def __init__(self, content: str, tokens: int = 0, latency: float = 0.0, raw=None, cached: bool = False):
+        """
+        :param content: 模型返回内容
+        :param tokens: 本次调用消耗的token数（命中缓存时为原调用的token数）
+        :param latency: 本次调用耗时（秒）
+        :param raw: 模型接口的原始响应
+        :param cached: 是否来自响应缓存
+        """
+        self.content = content
+        self.tokens = tokens
+        self.latency = latency
+        self.raw = raw
+        self.cached = cached
+
+    def __repr__(self):
+        return (f"LLMResponse(tokens={self.tokens}, latency={self.latency:.2f}s, "
+                f"content_length={len(self.content or '')}, cached={self.cached})")
+
+
+class LLMStream:
+    """
+    流式调用的结果：迭代得到模型返回内容的片段，调用方可以随时close()中止请求，不再等待（也不再消耗）剩余的输出
+    迭代结束或中止后，response为已收到内容的LLMResponse，completed表示模型是否输出完毕
+    """
+
+    def __init__(self, chunks):
+        """
+        :param chunks: 产生内容片段（str）的生成器，返回值为本次调用的token数（未知时为0）
+        """
+        self._chunks = chunks
+        self._parts = []
+        self._start = time.monotonic()
+        self.tokens = 0
+        self.completed = False
+        self.response = None
+
+    @property
+    def content(self):
+        return "".join(self._parts)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.response is not None:
+            raise StopIteration
+        try:
+            chunk = next(self._chunks)
+        except StopIteration as stop:
+            self.tokens = stop.value or 0
+            self.completed = True
+            self._finish()
+            raise StopIteration
+        except BaseException:
+            self._finish()
+            raise
+        self._parts.append(chunk)
+        return chunk
+
+    def close(self):
+        """中止请求"""
+        if self.response is None:
+            self._chunks.close()
+            self._finish()
+
+    def _finish(self):
+        self.response = LLMResponse(self.content, self.tokens, time.monotonic() - self._start)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
 class AbstractApi(ABC):
+    """
+    大模型接口
+    实现需要是可重入的：同一个实例会被多个审查线程同时调用，调用结果通过generate_text的返回值传递，不保存在实例上
+    """
 
     @abstractmethod
     def set_config(self, api_config: dict) -> bool:
@@ -8,16 +99,68 @@ class AbstractApi(ABC):
         pass
 
     @abstractmethod
-    def generate_text(self, messages: str) -> bool:
-        """根据提示生成文本"""
+    def generate_text(self, messages: list) -> LLMResponse:
+        """根据提示生成文本，返回本次调用的结果"""
         pass
 
-    @abstractmethod
+    @property
+    def provider(self) -> str:
+        """并发数按provider限制，同一provider的所有模型实例共用并发名额；默认按实现类区分，对接具体provider的实现应覆盖"""
+        return type(self).__name__
+
+    async def agenerate_text(self, messages: list) -> LLMResponse:
+        """
+        generate_text的异步版本，在共享事件循环中执行并受provider并发数限制
+        默认在provider的线程池中调用generate_text，支持异步接口的实现应覆盖该方法
+        """
+        return await llm_event_loop.run_async(
+            llm_event_loop.limit(self.provider, llm_event_loop.run_blocking, self.provider, self.generate_text,
+                                 messages))
+
+    def generate_texts(self, messages_list: list, cancel_token=None) -> list:
+        """
+        并发执行多个互不依赖的请求，阻塞等待全部完成
+        :param cancel_token: 可选的CancellationToken，被取消时取消所有未完成的请求（释放并发名额）并抛出ReviewCancelledError
+        :return: 与messages_list顺序一致的结果列表，失败的请求对应位置为异常对象
+        """
+        async def gather():
+            return await asyncio.gather(*(self.agenerate_text(messages) for messages in messages_list),
+                                        return_exceptions=True)
+        future = llm_event_loop.submit(gather())
+        # 取消future会取消事件循环中的gather任务，进而取消其中所有请求
+        wait_futures([future], cancel_token)
+        return future.result()
+
+    def stream_text(self, messages: list) -> LLMStream:
+        """
+        流式生成文本，逐块返回模型输出
+        默认调用generate_text后一次性返回全部内容，支持流式接口的实现应覆盖该方法
+        """
+        def chunks():
+            response = self.generate_text(messages)
+            if response.content:
+                yield response.content
+            return response.tokens
+        return LLMStream(chunks())
+
+    def _thread_state(self):
+        # 兼容旧接口：按线程记录最近一次调用的结果，子类无需调用super().__init__()
+        return self.__dict__.setdefault('_local', threading.local())
+
+    def _remember(self, response: LLMResponse) -> LLMResponse:
+        self._thread_state().response = response
+        return response
+
+    def _last_response(self) -> LLMResponse:
+        response = getattr(self._thread_state(), 'response', None)
+        if response is None:
+            raise ValueError("Response is None. Call generate_text first.")
+        return response
+
     def get_respond_content(self) -> str:
-        """获取模型返回内容"""
-        pass
+        """获取当前线程最近一次调用的模型返回内容（兼容旧接口，建议直接使用generate_text的返回值）"""
+        return self._last_response().content
 
-    @abstractmethod
     def get_respond_tokens(self) -> int:
-        """获取模型返回token数"""
-        pass
\ No newline at end of file
+        """获取当前线程最近一次调用的token数（兼容旧接口，建议直接使用generate_text的返回值）"""
+        return self._last_response().tokens
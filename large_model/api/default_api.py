@@ -1,16 +1,23 @@
 import os
+import time
+from functools import partial
 from math import trunc
 
+import litellm
 from unionllm import unionchat
 
-from large_model.abstract_api import AbstractApi
+from config.config import LLM_ASYNC_ENABLED
+from large_model.abstract_api import AbstractApi, LLMResponse, LLMStream
+from large_model.llm_runtime import llm_event_loop
+
+# UnionLLM的参数，不传给litellm
+_UNIONLLM_ONLY_PARAMS = ('provider', 'model', 'set_verbose')
 
 
 class DefaultApi(AbstractApi):
 
     def __init__(self):
         self.params = {}
-        self.response = None
 
     def set_config(self, api_config: dict) -> bool:
         if api_config is None:
@@ -21,25 +28,102 @@ class DefaultApi(AbstractApi):
                 os.environ[key] = api_config[key]
                 continue
             self.params[key] = api_config[key]
-            
+
         # Enable verbose logging for debugging
         os.environ['LITELLM_LOG'] = 'DEBUG'
-        
-        return True
 
-    def generate_text(self, messages: list) -> bool:
-        try:
-            self.response = unionchat(messages=messages, **self.params)
-        except Exception as e:
-            raise e
         return True
 
-    def get_respond_content(self) -> str:
-        if self.response is None:
-            raise ValueError("Response is None. Call generate_text first.")
-        return self.response['choices'][0]['message']['content']
+    @property
+    def provider(self):
+        return self.params.get('provider') or str(self.params.get('model', '')).split('/', 1)[0]
+
+    def _litellm_params(self):
+        """
+        转换为litellm.acompletion的参数（model为 provider/model 形式）
+        :return: litellm不支持该provider时返回None，此时使用unionchat
+        """
+        provider, model = self.params.get('provider'), str(self.params.get('model', ''))
+        if provider:
+            if provider not in litellm.provider_list:
+                return None
+            if not model.startswith(f"{provider}/"):
+                model = f"{provider}/{model}"
+        params = {key: value for key, value in self.params.items() if key not in _UNIONLLM_ONLY_PARAMS}
+        return dict(params, model=model)
+
+    def generate_text(self, messages: list) -> LLMResponse:
+        if LLM_ASYNC_ENABLED:
+            response = llm_event_loop.run(self.agenerate_text(messages))
+        else:
+            # 阻塞调用同样占用provider的并发名额
+            with llm_event_loop.blocking_slot(self.provider):
+                start = time.monotonic()
+                response = self._to_response(unionchat(messages=messages, **self.params), start)
+        return self._remember(response)
+
+    async def agenerate_text(self, messages: list) -> LLMResponse:
+        return await llm_event_loop.run_async(llm_event_loop.limit(self.provider, self._acomplete, messages))
+
+    async def _acomplete(self, messages):
+        start = time.monotonic()
+        params = self._litellm_params() if LLM_ASYNC_ENABLED else None
+        if params is None:
+            raw = await llm_event_loop.run_blocking(self.provider, partial(unionchat, messages=messages, **self.params))
+        else:
+            raw = await litellm.acompletion(messages=messages, **params)
+        return self._to_response(raw, start)
+
+    def stream_text(self, messages: list) -> LLMStream:
+        params = self._litellm_params()
+        if not LLM_ASYNC_ENABLED or params is None:
+            return super().stream_text(messages)
+        if _supports_stream_usage(params['model']):
+            params['stream_options'] = {'include_usage': True}
+        usage = {'tokens': 0}
+        parts = []
+
+        async def chunks():
+            # 整个读取过程占用并发名额，调用方中止时关闭连接，模型不再继续输出
+            async with llm_event_loop.slot(self.provider):
+                stream = await litellm.acompletion(messages=messages, stream=True, **params)
+                try:
+                    async for chunk in stream:
+                        if getattr(chunk, 'usage', None):
+                            usage['tokens'] = trunc(int(chunk.usage.total_tokens))
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            parts.append(chunk.choices[0].delta.content)
+                            yield chunk.choices[0].delta.content
+                finally:
+                    close = getattr(stream, 'aclose', None)
+                    if close is not None:
+                        await close()
+
+        def sync_chunks():
+            yield from llm_event_loop.iterate(chunks())
+            if not usage['tokens']:
+                # 模型没有在流中返回用量时按tokenizer计算
+                try:
+                    usage['tokens'] = (litellm.token_counter(model=params['model'], messages=messages) +
+                                       litellm.token_counter(model=params['model'], text="".join(parts)))
+                except Exception:
+                    pass
+            return usage['tokens']
+
+        return LLMStream(sync_chunks())
+
+    @staticmethod
+    def _to_response(raw, start):
+        return LLMResponse(
+            content=raw['choices'][0]['message']['content'],
+            tokens=trunc(int(raw['usage']['total_tokens'])),
+            latency=time.monotonic() - start,
+            raw=raw,
+        )
+
 
-    def get_respond_tokens(self) -> int:
-        if self.response is None:
-            raise ValueError("Response is None. Call generate_text first.")
-        return trunc(int(self.response['usage']['total_tokens']))
+def _supports_stream_usage(model):
+    try:
+        return 'stream_options' in (litellm.get_supported_openai_params(model=model) or [])
+    except Exception:
+        return False
@@ -1,10 +1,15 @@
 import importlib
+import threading
 import warnings
 
 from config.config import llm_api_impl, api_config
+from large_model.response_cache import CachedApi, create_response_cache
 
 
 class LLMGenerator:
+    # 共享的模型实例（模型接口是可重入的，所有审查共用，只初始化一次配置），配置了响应缓存时带缓存
+    _shared_model = None
+    _shared_lock = threading.Lock()
 
     @classmethod
     def new_model(cls, config = api_config):
@@ -12,6 +17,30 @@ class LLMGenerator:
         api.set_config(config)
         return api
 
+    @classmethod
+    def shared_model(cls):
+        """
+        获取按默认配置创建的共享模型实例，并发调用安全
+        配置了LLM_RESPONSE_CACHE_TYPE时返回带响应缓存的实例；new_model不带缓存（例如启动时的模型配置检查）
+        """
+        if cls._shared_model is None:
+            with cls._shared_lock:
+                if cls._shared_model is None:
+                    cache = create_response_cache()
+                    if cache is None:
+                        cls._shared_model = cls.new_model()
+                    else:
+                        model = CachedApi(cls.create_model_instance(), cache)
+                        model.set_config(api_config)
+                        cls._shared_model = model
+        return cls._shared_model
+
+    @classmethod
+    def response_cache_stats(cls):
+        """共享模型实例的响应缓存统计，尚未创建或未配置缓存时返回None"""
+        model = cls._shared_model
+        return model.get_stats() if isinstance(model, CachedApi) else None
+
     @classmethod
     def get_llm_api_class(cls):
         module_name, class_name = llm_api_impl.rsplit('.', 1)
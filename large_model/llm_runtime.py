@@ -0,0 +1,148 @@
+import asyncio
+import concurrent.futures
+import threading
+from contextlib import asynccontextmanager, contextmanager
+
+from config.config import LLM_MAX_CONCURRENCY, LLM_PROVIDER_CONCURRENCY
+
+
+class LLMEventLoop:
+    """
+    所有大模型请求共用的后台事件循环
+    - 一个守护线程运行asyncio事件循环，任意线程提交的协程都在其中执行，等待模型响应时不占用线程
+    - 按provider限制同时进行的请求数（asyncio.Semaphore），限制对所有审查、所有调用线程生效，
+      异步请求（slot）与普通线程中的阻塞请求（blocking_slot）共用同一个限制
+    - 阻塞调用（例如unionchat）在每个provider专用的线程池中执行，线程数与该provider的并发数一致
+    """
+
+    def __init__(self, max_concurrency=LLM_MAX_CONCURRENCY, provider_concurrency=None):
+        """
+        :param max_concurrency: 每个provider默认的最大并发请求数
+        :param provider_concurrency: 按provider单独设置的最大并发请求数
+        """
+        self.max_concurrency = max_concurrency
+        self.provider_concurrency = dict(LLM_PROVIDER_CONCURRENCY if provider_concurrency is None
+                                         else provider_concurrency)
+        self._loop = None
+        self._lock = threading.Lock()
+        self._semaphores = {}  # provider -> asyncio.Semaphore，只在事件循环线程中访问
+        self._executors = {}  # provider -> 执行阻塞调用的线程池
+        self._in_flight = {}  # provider -> 正在进行的请求数
+
+    def _get_loop(self):
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='llm-event-loop', daemon=True).start()
+                self._loop = loop
+            return self._loop
+
+    def submit(self, coro):
+        """
+        在共享事件循环中执行协程
+        :return: concurrent.futures.Future
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self._get_loop())
+
+    def run(self, coro):
+        """在共享事件循环中执行协程并阻塞等待结果，不能在事件循环线程中调用"""
+        loop = self._get_loop()
+        if _running_loop() is loop:
+            coro.close()
+            raise RuntimeError("LLMEventLoop.run() cannot be called from the LLM event loop, await the coroutine instead")
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+    async def run_async(self, coro):
+        """在任意事件循环中等待协程在共享事件循环中执行完成"""
+        loop = self._get_loop()
+        if _running_loop() is loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+    async def limit(self, provider, func, *args, **kwargs):
+        """占用provider的一个并发名额执行 await func(*args, **kwargs)，需在共享事件循环中调用"""
+        async with self.slot(provider):
+            return await func(*args, **kwargs)
+
+    def provider_limit(self, provider):
+        """provider的最大并发请求数"""
+        return max(1, int(self.provider_concurrency.get(provider, self.max_concurrency)))
+
+    async def _acquire(self, provider):
+        semaphore = self._semaphores.get(provider)
+        if semaphore is None:
+            semaphore = self._semaphores[provider] = asyncio.Semaphore(self.provider_limit(provider))
+        await semaphore.acquire()
+        with self._lock:
+            self._in_flight[provider] = self._in_flight.get(provider, 0) + 1
+
+    def _release(self, provider):
+        with self._lock:
+            self._in_flight[provider] -= 1
+        self._semaphores[provider].release()
+
+    @asynccontextmanager
+    async def slot(self, provider):
+        """占用provider的一个并发名额，流式请求在整个读取过程中占用，需在共享事件循环中调用"""
+        provider = provider or 'default'
+        await self._acquire(provider)
+        try:
+            yield
+        finally:
+            self._release(provider)
+
+    @contextmanager
+    def blocking_slot(self, provider):
+        """在普通线程中阻塞等待并占用provider的一个并发名额，与异步请求共用同一个限制，不能在事件循环线程中调用"""
+        provider = provider or 'default'
+        self.run(self._acquire(provider))
+        try:
+            yield
+        finally:
+            self._get_loop().call_soon_threadsafe(self._release, provider)
+
+    async def run_blocking(self, provider, func, *args):
+        """
+        在provider专用的线程池中执行阻塞调用 func(*args)
+        asyncio.to_thread使用的默认线程池只有 min(32, cpu+4) 个线程，会成为比provider并发数更低的上限
+        """
+        provider = provider or 'default'
+        with self._lock:
+            executor = self._executors.get(provider)
+            if executor is None:
+                executor = self._executors[provider] = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.provider_limit(provider), thread_name_prefix=f'llm-{provider}')
+        return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+    def iterate(self, agen):
+        """
+        在共享事件循环中逐个读取异步生成器，以同步生成器返回，不能在事件循环线程中调用
+        调用方提前停止迭代（close）时关闭异步生成器，从而中止对应的请求
+        """
+        async def next_item():
+            return await agen.__anext__()
+
+        try:
+            while True:
+                try:
+                    item = self.run(next_item())
+                except StopAsyncIteration:
+                    return
+                yield item
+        finally:
+            self.run(agen.aclose())
+
+    def get_stats(self):
+        with self._lock:
+            return {'in_flight': dict(self._in_flight)}
+
+
+def _running_loop():
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+# 所有模型实例共享的事件循环与并发限制
+llm_event_loop = LLMEventLoop()
@@ -0,0 +1,42 @@
+import asyncio
+
+from large_model.abstract_api import AbstractApi, LLMResponse, LLMStream
+
+
+class RateLimitedApi(AbstractApi):
+    """
+    按调用次数限流的模型接口，包装实际的模型实现
+    每次模型调用（generate_text、agenerate_text、stream_text，以及generate_texts中的每个请求）前从令牌桶获取一个令牌
+    """
+
+    def __init__(self, api: AbstractApi, limiter, cancel_token=None):
+        """
+        :param limiter: TokenBucket，可以在多个实例之间共享
+        :param cancel_token: 可选的CancellationToken，等待令牌期间被取消时抛出ReviewCancelledError
+        """
+        self.api = api
+        self.limiter = limiter
+        self.cancel_token = cancel_token
+
+    @property
+    def provider(self):
+        return self.api.provider
+
+    def set_config(self, api_config: dict) -> bool:
+        return self.api.set_config(api_config)
+
+    def generate_text(self, messages: list) -> LLMResponse:
+        self.limiter.acquire(cancel_token=self.cancel_token)
+        return self._remember(self.api.generate_text(messages))
+
+    async def agenerate_text(self, messages: list) -> LLMResponse:
+        # 在事件循环中等待令牌，不能调用阻塞的acquire
+        while not self.limiter.try_acquire():
+            if self.cancel_token is not None:
+                self.cancel_token.raise_if_cancelled()
+            await asyncio.sleep(min(1.0, 1 / self.limiter.rate) if self.limiter.rate > 0 else 1.0)
+        return await self.api.agenerate_text(messages)
+
+    def stream_text(self, messages: list) -> LLMStream:
+        self.limiter.acquire(cancel_token=self.cancel_token)
+        return self.api.stream_text(messages)
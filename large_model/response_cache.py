@@ -0,0 +1,248 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+
+from config.config import (LLM_RESPONSE_CACHE_TYPE, LLM_RESPONSE_CACHE_DIR, LLM_RESPONSE_CACHE_MAX_SIZE,
+                           LLM_RESPONSE_CACHE_TTL, REDIS_URL, JOB_STORE_KEY_PREFIX)
+from large_model.abstract_api import AbstractApi, LLMResponse, LLMStream
+from utils.logger import log
+
+
+class DiskResponseCache:
+    """
+    本地磁盘缓存，每个响应一个JSON文件
+    - 条目超过TTL后视为不存在并删除
+    - 总大小超过上限时按最近使用时间（文件mtime，命中时更新）淘汰
+    """
+
+    def __init__(self, root=LLM_RESPONSE_CACHE_DIR, max_size=LLM_RESPONSE_CACHE_MAX_SIZE, ttl=LLM_RESPONSE_CACHE_TTL):
+        self.root = root
+        self.max_size = max_size
+        self.ttl = ttl
+        self._size = None  # 首次写入时统计
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], f"{key}.json")
+
+    def get(self, key):
+        path = self._path(key)
+        value = None
+        try:
+            if time.time() - os.path.getmtime(path) <= self.ttl:
+                with open(path, encoding="utf-8") as f:
+                    value = json.load(f)
+                os.utime(path)
+            else:
+                self._remove(path)
+        except (OSError, ValueError):
+            value = None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        path = self._path(key)
+        data = json.dumps(value, ensure_ascii=False).encode("utf-8")
+        if len(data) > self.max_size:
+            return
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError as e:
+            log.warning(f"⚠️ 写入大模型响应缓存失败: {e}")
+            return
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += len(data) - old_size
+            if self._size > self.max_size:
+                self._evict()
+
+    def _scan_size(self):
+        total = 0
+        for path, _ in self._entries():
+            total += os.path.getsize(path)
+        return total
+
+    def _entries(self):
+        for dir_path, _, files in os.walk(self.root):
+            for file in files:
+                if file.endswith(".json"):
+                    path = os.path.join(dir_path, file)
+                    try:
+                        yield path, os.path.getmtime(path)
+                    except OSError:
+                        continue
+
+    def _evict(self):
+        # 淘汰到上限的90%，避免每次写入都扫描目录
+        target = self.max_size * 0.9
+        for path, _ in sorted(self._entries(), key=lambda entry: entry[1]):
+            if self._size <= target:
+                break
+            self._size -= self._remove(path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            return size
+        except OSError:
+            return 0
+
+    def get_stats(self):
+        with self._lock:
+            return {'type': 'disk', 'size': self._size or 0, 'max_size': self.max_size,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+class RedisResponseCache:
+    """
+    Redis缓存，多实例共享
+    条目按TTL过期，内存上限由Redis的maxmemory-policy（建议allkeys-lru）控制
+    """
+
+    def __init__(self, url=REDIS_URL, prefix=JOB_STORE_KEY_PREFIX, ttl=LLM_RESPONSE_CACHE_TTL):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("LLM_RESPONSE_CACHE_TYPE='redis' requires the redis package, please `pip install redis`")
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+        self._prefix = f"{prefix}:llm"
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        try:
+            data = self._redis.get(f"{self._prefix}:{key}")
+            value = json.loads(data) if data is not None else None
+        except Exception as e:
+            log.warning(f"⚠️ 读取Redis大模型响应缓存失败: {e}")
+            value = None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        try:
+            self._redis.set(f"{self._prefix}:{key}", json.dumps(value, ensure_ascii=False), ex=self.ttl)
+        except Exception as e:
+            log.warning(f"⚠️ 写入Redis大模型响应缓存失败: {e}")
+
+    def get_stats(self):
+        with self._lock:
+            return {'type': 'redis', 'hits': self.hits, 'misses': self.misses}
+
+
+def create_response_cache(cache_type=LLM_RESPONSE_CACHE_TYPE):
+    """
+    根据配置创建大模型响应缓存，cache_type为none时返回None（不缓存）
+    """
+    cache_type = (cache_type or 'none').lower()
+    if cache_type == 'none':
+        return None
+    if cache_type == 'disk':
+        return DiskResponseCache()
+    if cache_type == 'redis':
+        return RedisResponseCache()
+    raise ValueError(f"Unsupported LLM_RESPONSE_CACHE_TYPE: {cache_type}")
+
+
+class CachedApi(AbstractApi):
+    """
+    带响应缓存的模型接口，包装实际的模型实现
+    缓存key为 (模型实现, 模型参数, 消息) 的SHA-256，鉴权相关的参数不参与计算；只缓存完整、非空的响应
+    """
+
+    def __init__(self, api: AbstractApi, cache):
+        self.api = api
+        self.cache = cache
+        self._key_prefix = f"{type(api).__module__}.{type(api).__name__}"
+        self._config = {}
+
+    @property
+    def provider(self):
+        # 与被包装的实现共用provider的并发名额
+        return self.api.provider
+
+    def set_config(self, api_config: dict) -> bool:
+        self._config = {key: value for key, value in (api_config or {}).items() if not _is_secret(key)}
+        return self.api.set_config(api_config)
+
+    def cache_key(self, messages):
+        payload = json.dumps([self._key_prefix, self._config, messages], sort_keys=True, ensure_ascii=False,
+                             default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _lookup(self, key):
+        value = self.cache.get(key)
+        if value is None:
+            return None
+        log.info(f"♻️ 命中大模型响应缓存: {key[:12]}")
+        return LLMResponse(value['content'], value.get('tokens', 0), 0.0, cached=True)
+
+    def _store(self, key, response):
+        if response.content:
+            self.cache.set(key, {'content': response.content, 'tokens': response.tokens})
+
+    def generate_text(self, messages: list) -> LLMResponse:
+        key = self.cache_key(messages)
+        response = self._lookup(key)
+        if response is None:
+            response = self.api.generate_text(messages)
+            self._store(key, response)
+        return self._remember(response)
+
+    async def agenerate_text(self, messages: list) -> LLMResponse:
+        # 读写缓存是阻塞IO，不在事件循环线程中执行
+        key = self.cache_key(messages)
+        response = await asyncio.to_thread(self._lookup, key)
+        if response is None:
+            response = await self.api.agenerate_text(messages)
+            await asyncio.to_thread(self._store, key, response)
+        return response
+
+    def stream_text(self, messages: list) -> LLMStream:
+        key = self.cache_key(messages)
+        response = self._lookup(key)
+        if response is not None:
+            def cached_chunks():
+                yield response.content
+                return response.tokens
+            return LLMStream(cached_chunks())
+
+        def chunks():
+            # 只有完整接收的流才写入缓存，中止的请求不缓存
+            with self.api.stream_text(messages) as stream:
+                yield from stream
+            if stream.completed:
+                self._store(key, stream.response)
+            return stream.tokens
+        return LLMStream(chunks())
+
+    def get_stats(self):
+        return self.cache.get_stats()
+
+
+def _is_secret(key):
+    return key.lower().endswith(('key', '_token', 'secret', 'password'))
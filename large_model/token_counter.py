@@ -0,0 +1,219 @@
+import hashlib
+import math
+import re
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from config.config import api_config, TOKEN_COUNTER_TYPE, TOKEN_COUNT_CACHE_SIZE, LLM_CONTEXT_WINDOW
+from utils.logger import log
+
+# 提示词模板（文件信息、格式要求等）预留的token数
+PROMPT_TEMPLATE_RESERVE = 1024
+
+# 中日韩文字（含全角符号），通常每个字约1个token
+_CJK_PATTERN = re.compile(r"[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]")
+# 短文本直接计数，哈希的开销与计数相当
+_MEMO_MIN_LENGTH = 256
+# 每条消息的格式开销（role、分隔符）
+_MESSAGE_OVERHEAD = 4
+
+
+class TokenCounter(ABC):
+    """
+    token计数器，子类实现_count
+    计数结果按内容哈希缓存（LRU），同一diff在调度预估、分批、构建提示词时只计数一次
+    """
+
+    def __init__(self, cache_size=TOKEN_COUNT_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # 内容哈希 -> token数
+        self._lock = threading.Lock()
+
+    def count(self, text):
+        if not text:
+            return 0
+        if len(text) < _MEMO_MIN_LENGTH or self.cache_size <= 0:
+            return self._count(text)
+        key = hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        tokens = self._count(text)
+        with self._lock:
+            self._cache[key] = tokens
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return tokens
+
+    def count_messages(self, messages):
+        return sum(self.count(message.get('content') or '') + _MESSAGE_OVERHEAD for message in messages)
+
+    def truncate(self, text, max_tokens):
+        """截断到不超过max_tokens，默认按比例缩短后校验"""
+        tokens = self.count(text)
+        if tokens <= max_tokens:
+            return text
+        if max_tokens <= 0:
+            return ""
+        length = int(len(text) * max_tokens / tokens)
+        while length > 0 and self.count(text[:length]) > max_tokens:
+            length = int(length * 0.9)
+        return text[:length]
+
+    @abstractmethod
+    def _count(self, text):
+        """计算text的token数"""
+        pass
+
+
+class ApproximateTokenCounter(TokenCounter):
+    """
+    没有本地tokenizer时的近似计数，逐字符的统计都在正则引擎和编解码器（C实现）中完成
+    - 中日韩文字：约1个token/字
+    - 其他非ASCII字符：约2个字符/token
+    - ASCII（代码、英文）：约4个字符/token
+    """
+    name = 'approximate'
+
+    def _count(self, text):
+        ascii_chars = len(text.encode("ascii", "ignore"))
+        cjk_chars = len(text) - len(_CJK_PATTERN.sub("", text))
+        other_chars = len(text) - ascii_chars - cjk_chars
+        return math.ceil(cjk_chars + other_chars / 2 + ascii_chars / 4)
+
+
+class TiktokenCounter(TokenCounter):
+    """使用tiktoken精确计数（非OpenAI模型使用相近的编码，误差远小于近似计数）"""
+    name = 'tiktoken'
+
+    def __init__(self, encoding, **kwargs):
+        super().__init__(**kwargs)
+        self.encoding = encoding
+
+    def _count(self, text):
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text, max_tokens):
+        tokens = self.encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        return self.encoding.decode(tokens[:max(0, max_tokens)])
+
+
+def _create_tiktoken_counter(model):
+    import tiktoken
+    try:
+        encoding = tiktoken.encoding_for_model(model.rsplit('/', 1)[-1])
+    except KeyError:
+        encoding = tiktoken.get_encoding("cl100k_base")
+    return TiktokenCounter(encoding)
+
+
+_factories = []  # (模型名前缀, 工厂函数)
+_counters = {}  # 模型名 -> TokenCounter
+_input_budgets = {}  # 模型名 -> 可用于输入的token数
+_lock = threading.Lock()
+
+
+def register_token_counter(model_prefix, factory):
+    """
+    为模型注册自定义的token计数器（例如模型自己的tokenizer）
+    :param model_prefix: 模型名前缀（provider/model 形式），匹配最长的前缀
+    :param factory: factory(model) -> TokenCounter
+    """
+    with _lock:
+        _factories.append((model_prefix, factory))
+        _factories.sort(key=lambda item: len(item[0]), reverse=True)
+        _counters.clear()
+
+
+def default_model():
+    """api_config中配置的模型名（provider/model 形式）"""
+    provider, model = api_config.get('provider'), str(api_config.get('model', ''))
+    if provider and not model.startswith(f"{provider}/"):
+        return f"{provider}/{model}"
+    return model
+
+
+def _create_counter(model):
+    for prefix, factory in _factories:
+        if model.startswith(prefix):
+            return factory(model)
+    counter_type = (TOKEN_COUNTER_TYPE or 'auto').lower()
+    if counter_type == 'approximate':
+        return ApproximateTokenCounter()
+    if counter_type not in ('auto', 'tiktoken'):
+        raise ValueError(f"Unsupported TOKEN_COUNTER_TYPE: {counter_type}")
+    try:
+        return _create_tiktoken_counter(model)
+    except Exception as e:
+        # 未安装tiktoken，或编码文件无法下载
+        if counter_type == 'tiktoken':
+            raise
+        log.info(f"ℹ️ tiktoken不可用，使用近似token计数: {e}")
+        return ApproximateTokenCounter()
+
+
+def get_token_counter(model=None):
+    model = model or default_model()
+    with _lock:
+        counter = _counters.get(model)
+    if counter is None:
+        counter = _create_counter(model)
+        with _lock:
+            counter = _counters.setdefault(model, counter)
+    return counter
+
+
+def count_tokens(text, model=None):
+    return get_token_counter(model).count(text)
+
+
+def truncate_to_tokens(text, max_tokens, model=None):
+    return get_token_counter(model).truncate(text, max_tokens)
+
+
+def input_token_budget(model=None):
+    """
+    单次请求可用于输入的token数
+    - 配置了LLM_CONTEXT_WINDOW时为窗口减去为输出预留的max_tokens
+    - 否则使用litellm的模型信息：max_input_tokens与（上下文窗口 - max_tokens）中较小的一个
+    :return: 未知时返回None
+    """
+    reserved_output = int(api_config.get('max_tokens') or 0)
+    if LLM_CONTEXT_WINDOW:
+        return max(0, LLM_CONTEXT_WINDOW - reserved_output)
+    model = model or default_model()
+    with _lock:
+        if model in _input_budgets:
+            return _input_budgets[model]
+    try:
+        import litellm
+        info = litellm.get_model_info(model)
+        max_input = info.get('max_input_tokens')
+        # 输入与输出共用上下文窗口，max_input_tokens通常就是整个窗口
+        window = max(max_input or 0, info.get('max_tokens') or 0)
+        budget = min(max_input or window, max(0, window - reserved_output)) if window else None
+    except Exception:
+        budget = None
+    with _lock:
+        _input_budgets[model] = budget
+    return budget
+
+
+def fit_to_token_budget(text, reserved_tokens=PROMPT_TEMPLATE_RESERVE, model=None):
+    """
+    把text截断到模型可用输入窗口减去reserved_tokens以内，窗口未知时不截断
+    :param reserved_tokens: 同一请求中其他内容（系统提示词、模板）占用的token数
+    :return: (text, 是否被截断)
+    """
+    budget = input_token_budget(model)
+    if budget is None:
+        return text, False
+    limit = max(0, budget - reserved_tokens)
+    counter = get_token_counter(model)
+    if counter.count(text) <= limit:
+        return text, False
+    return counter.truncate(text, limit), True
@@ -1,6 +1,6 @@
 import requests
-from retrying import retry
 from config.config import *
+from gitlab_integration.gitlab_client import gitlab_client
 from response_module.abstract_response import AbstractResponseMessage
 from utils.logger import log
 
@@ -12,24 +12,24 @@ class GitlabResponse(AbstractResponseMessage):
         if self.type == 'merge_request':
             self.project_id = config['project_id']
             self.merge_request_id = config['merge_request_iid']
+        elif self.type == 'push':
+            self.project_id = config['project_id']
+            self.commit_id = config.get('commit_id')
 
     def send(self, message):
         if self.type == 'merge_request':
             return self.send_merge(message)
+        elif self.type == 'push' and self.commit_id:
+            return self.send_commit(message)
         else:
             return False
 
-    @retry(stop_max_attempt_number=3, wait_fixed=2000)
     def send_merge(self, message):
         # 检查是否已存在相同评论，避免重复
         if ENABLE_DUPLICATE_CHECK and self._check_duplicate_comment(message):
             log.info(f"发现重复评论，跳过发送：project_id:{self.project_id} merge_request_id:{self.merge_request_id}")
             return True
             
-        headers = {
-            "Private-Token": GITLAB_PRIVATE_TOKEN,
-            "Content-Type": "application/json"
-        }
         project_id = self.project_id
         merge_request_id = self.merge_request_id
         url = f"{GITLAB_SERVER_URL}/api/v4/projects/{project_id}/merge_requests/{merge_request_id}/notes"
@@ -37,7 +37,7 @@ class GitlabResponse(AbstractResponseMessage):
             "body": message
         }
 
-        response = requests.post(url, headers=headers, json=data)
+        response = gitlab_client.post(url, json=data)
 
         if response.status_code == 201:
             log.info(f"评论信息发送成功：project_id:{project_id}  merge_request_id:{merge_request_id}")
@@ -47,21 +47,46 @@ class GitlabResponse(AbstractResponseMessage):
                 f"评论信息发送失败：project_id:{project_id}  merge_request_id:{merge_request_id} response:{response}")
             return False
 
+    def send_commit(self, message):
+        """
+        push审查：在commit上发起讨论
+        """
+        if ENABLE_DUPLICATE_CHECK and self._check_duplicate_comment(message):
+            log.info(f"发现重复评论，跳过发送：project_id:{self.project_id} commit_id:{self.commit_id}")
+            return True
+
+        url = f"{GITLAB_SERVER_URL}/api/v4/projects/{self.project_id}/repository/commits/{self.commit_id}/discussions"
+        response = gitlab_client.post(url, json={"body": message})
+
+        if response.status_code == 201:
+            log.info(f"评论信息发送成功：project_id:{self.project_id}  commit_id:{self.commit_id}")
+            return True
+        else:
+            log.error(
+                f"评论信息发送失败：project_id:{self.project_id}  commit_id:{self.commit_id} response:{response}")
+            return False
+
+    def _get_existing_notes(self):
+        if self.type == 'push':
+            url = f"{GITLAB_SERVER_URL}/api/v4/projects/{self.project_id}/repository/commits/{self.commit_id}/discussions"
+        else:
+            url = f"{GITLAB_SERVER_URL}/api/v4/projects/{self.project_id}/merge_requests/{self.merge_request_id}/notes"
+        try:
+            data = list(gitlab_client.iter_json_pages(url))
+        except requests.HTTPError:
+            return None
+        if self.type == 'push':
+            return [note for discussion in data for note in discussion.get('notes', [])]
+        return data
+
     def _check_duplicate_comment(self, new_message):
         """
         检查是否存在重复评论
         """
         try:
-            headers = {
-                "Private-Token": GITLAB_PRIVATE_TOKEN,
-                "Content-Type": "application/json"
-            }
-            url = f"{GITLAB_SERVER_URL}/api/v4/projects/{self.project_id}/merge_requests/{self.merge_request_id}/notes"
-            response = requests.get(url, headers=headers)
+            existing_notes = self._get_existing_notes()
             
-            if response.status_code == 200:
-                existing_notes = response.json()
-                
+            if existing_notes is not None:
                 # 检查是否有相同内容的评论（忽略时间戳等差异）
                 new_message_clean = self._clean_message_for_comparison(new_message)
                 
@@ -132,16 +157,11 @@ class GitlabResponse(AbstractResponseMessage):
         else:
             return False
 
-    @retry(stop_max_attempt_number=3, wait_fixed=2000)
     def comment_on_changes(self, message):
-        headers = {
-            "Private-Token": GITLAB_PRIVATE_TOKEN,
-            "Content-Type": "application/json"
-        }
         project_id = self.project_id
         merge_request_id = self.merge_request_id
         url = f"{GITLAB_SERVER_URL}/api/v4/projects/{project_id}/merge_requests/{merge_request_id}/discussions"
-        response = requests.post(url, headers=headers,json={'body': message['body'], 'position': message['position']})
+        response = gitlab_client.post(url, json={'body': message['body'], 'position': message['position']})
         if response.status_code == 201:
             log.info(f"Inline Comment发送成功：project_id:{project_id}  merge_request_id:{merge_request_id}, comment_file: {message['position']['new_path']}")
             return True
@@ -7,5 +7,15 @@ class ReviewHandle(object):
     def __init__(self):
         pass
 
-    def merge_handle(self, gitlabMergeRequestFetcher, gitlabRepoManager, hook_info, reply, model):
-        pass
\ No newline at end of file
+    def merge_handle(self, gitlabMergeRequestFetcher, gitlabRepoManager, hook_info, reply, model, cancel_token=None):
+        """
+        :param cancel_token: CancellationToken，MR关闭、合并或有新的推送时被取消，handler应在调用大模型前检查
+        """
+        pass
+
+    def push_handle(self, gitlabCommitFetcher, push_info, reply, model, cancel_token=None):
+        """
+        push事件审查，默认不处理
+        :param push_info: 包含 branch、commits（本次push的commit列表，从旧到新）及原始webhook payload（hook_info）
+        """
+        pass
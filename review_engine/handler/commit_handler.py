@@ -1,5 +1,7 @@
-import concurrent.futures
+import os
+import re
 import threading
+from collections import OrderedDict
 from retrying import retry
 
 from config.config import (
@@ -14,16 +16,24 @@ from config.config import (
     MAX_ESTIMATED_TOKENS,
     BATCH_SIZE_FOR_COMMIT_REVIEW,
     INCOMPLETE_RESPONSE_THRESHOLD,
+    STREAMING_COMMIT_REVIEW,
     REVIEW_MODE,
     # 新增的上下文分析配置
     ENHANCED_CONTEXT_ANALYSIS,
     CONTEXT_ANALYSIS_MODE,
     CONTEXT_SEMANTIC_ANALYSIS,
     CONTEXT_DEPENDENCY_ANALYSIS,
-    CONTEXT_IMPACT_ANALYSIS
+    CONTEXT_IMPACT_ANALYSIS,
+    CODE_SEARCH_REFERENCES_ENABLED,
+    CODE_SEARCH_MAX_REFERENCES,
+    CODE_SEARCH_CACHE_SIZE,
+    PUSH_REVIEW_MAX_COMMITS
 )
+from gitlab_integration.gitlab_fetcher import GitlabRepoManager, fetch_concurrently
+from large_model.token_counter import count_tokens, input_token_budget, fit_to_token_budget, PROMPT_TEMPLATE_RESERVE
 from review_engine.review_prompt import CODE_REVIEW_PROMPT, ENHANCED_CONTEXT_REVIEW_PROMPT
 from review_engine.abstract_handler import ReviewHandle
+from response_module.response_controller import ReviewResponse
 from utils.gitlab_parser import (
     filter_diff_content, 
     add_context_to_diff, 
@@ -34,15 +44,96 @@ from utils.gitlab_parser import (
 )
 from utils.logger import log
 from utils.args_check import file_need_check
+from utils.cancellation import ReviewCancelledError, cancellable_executor, wait_futures
 from utils.tools import batch
 
+# 变更符号的引用搜索结果：(项目, commit, 文件, 符号) -> 引用文件列表
+_symbol_reference_cache = OrderedDict()
+_symbol_reference_lock = threading.Lock()
+
+# diff中新增或删除的函数/类定义
+_DEFINITION_PATTERN = re.compile(
+    r'^[+-]\s*(?:export\s+)?(?:(?:public|private|protected|static|async)\s+)*'
+    r'(?:def|class|function|func|interface|struct)\s+(?:\([^)]*\)\s*)?([A-Za-z_]\w{2,})', re.MULTILINE)
+
+
+def commit_token_threshold():
+    """触发分批处理的token阈值：MAX_ESTIMATED_TOKENS与模型实际可用的输入窗口（扣除提示词模板）中较小的一个"""
+    budget = input_token_budget()
+    if budget is None:
+        return MAX_ESTIMATED_TOKENS
+    return min(MAX_ESTIMATED_TOKENS, max(0, budget - PROMPT_TEMPLATE_RESERVE))
+
+def pack_changes_into_batches(changes, max_files, max_tokens):
+    """
+    按文件数与token数分批：每批不超过max_files个文件，diff的token总数不超过max_tokens（单个文件超过时单独成批）
+    """
+    batches, current, current_tokens = [], [], 0
+    for change in changes:
+        tokens = count_tokens((change.get('diff') or '')[:MAX_DIFF_LENGTH])
+        if current and (len(current) >= max_files or current_tokens + tokens > max_tokens):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(change)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def changed_symbols(diff_content):
+    """提取diff中新增或删除的函数/类名"""
+    return sorted(set(_DEFINITION_PATTERN.findall(diff_content or "")))
+
+
+def find_symbol_references(project_id, commit_sha, reviewable_changes):
+    """
+    在commit的代码中搜索引用了变更函数/类的其他文件（只搜索同扩展名的文件），用于影响分析
+    结果按 (项目, commit, 文件, 符号) 缓存，同一commit再次审查时不再检出代码
+    :return: dict {file_path: {symbol: [引用文件的相对路径]}}，没有引用的文件不包含在内
+    """
+    references, missing = {}, []
+    for change in reviewable_changes:
+        file_path = change.get('new_path') or change.get('old_path')
+        for symbol in changed_symbols(change.get('diff')):
+            key = (str(project_id), commit_sha, file_path, symbol)
+            with _symbol_reference_lock:
+                paths = _symbol_reference_cache.get(key)
+            if paths is None:
+                missing.append(key)
+            elif paths:
+                references.setdefault(file_path, {})[symbol] = paths
+    if not missing:
+        return references
+
+    repo_manager = GitlabRepoManager(project_id)
+    try:
+        worktree_path = repo_manager.worktree_path(commit_sha)
+        for key in missing:
+            _, _, file_path, symbol = key
+            extension = os.path.splitext(file_path)[1]
+            paths = repo_manager.find_files_by_keyword(rf"\b{symbol}\b", commit_sha,
+                                                       extensions=[extension] if extension else None)
+            paths = [os.path.relpath(path, worktree_path) for path in paths]
+            paths = [path for path in paths if path != file_path][:CODE_SEARCH_MAX_REFERENCES]
+            with _symbol_reference_lock:
+                _symbol_reference_cache[key] = paths
+                while len(_symbol_reference_cache) > CODE_SEARCH_CACHE_SIZE:
+                    _symbol_reference_cache.popitem(last=False)
+            if paths:
+                references.setdefault(file_path, {})[symbol] = paths
+    except Exception as e:
+        log.warning(f"⚠️ 搜索变更符号的引用失败，跳过引用上下文: {e}")
+    finally:
+        repo_manager.delete_repo()
+    return references
+
+
+def format_symbol_references(symbol_references):
+    lines = ["", "**引用了变更函数/类的其他文件**:"]
+    for symbol, paths in symbol_references.items():
+        lines.append(f"- `{symbol}`: " + ", ".join(f"`{path}`" for path in paths))
+    return "\n".join(lines)
 
-def estimate_token_count(text):
-    """粗略估算文本的token数量（中文按字符数/2，英文按单词数*1.3）"""
-    chinese_chars = len([c for c in text if '\u4e00' <= c <= '\u9fff'])
-    other_chars = len(text) - chinese_chars
-    estimated_tokens = chinese_chars // 2 + other_chars // 4
-    return estimated_tokens
 
 def validate_response_format(response_content, expected_placeholder_count):
     """验证响应格式是否完整"""
@@ -63,6 +154,103 @@ def validate_response_format(response_content, expected_placeholder_count):
         'response_length': len(response_content)
     }
 
+class CommitReviewStreamMonitor:
+    """
+    流式接收增强版commit审查的响应，增量检查占位符
+    模型按文件顺序输出分析，每个文件的分析后跟对应的占位符：下一个文件的分析（或"整体评价"）已经开始，
+    而该文件的占位符仍未出现，即可确定该占位符缺失，不必等到响应结束
+    """
+    _PLACEHOLDER_PATTERN = re.compile(r"\[DIFF_PLACEHOLDER_FILE_(\d+)\]")
+    _FILE_MARKER_PATTERN = re.compile(r"文件\s*(\d+)\s*\**\s*[:：]")
+    _ANALYSIS_SECTION = "📄 文件变更分析"
+    _SUMMARY_SECTION = "🔍 整体评价"
+    # 标记可能跨越片段边界，每次从上次扫描位置往前回退的字符数
+    _OVERLAP = 32
+
+    def __init__(self, file_count):
+        self.file_count = file_count
+        self._parts = []
+        self._tail = ""
+        self._analysis_started = False
+        self._summary_started = False
+        self._last_file_seen = 0
+        self._placeholders = set()
+
+    def feed(self, chunk):
+        """处理新收到的片段"""
+        self._parts.append(chunk)
+        text = self._tail + chunk
+        self._placeholders.update(int(index) for index in self._PLACEHOLDER_PATTERN.findall(text))
+        if not self._analysis_started and self._ANALYSIS_SECTION in text:
+            self._analysis_started = True
+            text = text[text.index(self._ANALYSIS_SECTION):]
+        # "Commit概述"中也可能提到"文件 n:"，只统计文件变更分析章节中的标记
+        if self._analysis_started:
+            for index in self._FILE_MARKER_PATTERN.findall(text):
+                self._last_file_seen = max(self._last_file_seen, int(index))
+        if self._SUMMARY_SECTION in text:
+            self._summary_started = True
+        self._tail = text[-self._OVERLAP:]
+
+    def missing_placeholders(self):
+        """已经确定缺失的占位符"""
+        closed = self.file_count if self._summary_started else min(self._last_file_seen - 1, self.file_count)
+        return [f"[DIFF_PLACEHOLDER_FILE_{i}]" for i in range(1, closed + 1) if i not in self._placeholders]
+
+    def should_abort(self):
+        """确定缺失的占位符比例已超过降级阈值，剩余的输出无法改变降级的结果"""
+        return len(self.missing_placeholders()) / self.file_count > INCOMPLETE_RESPONSE_THRESHOLD
+
+    @property
+    def content(self):
+        return "".join(self._parts)
+
+
+def _not_cancelled(exception):
+    """被取消的审查不重试"""
+    return not isinstance(exception, ReviewCancelledError)
+
+
+def request_commit_review(model, messages, cancel_token=None):
+    """
+    发送单个commit审查请求
+    :param cancel_token: 可选的CancellationToken，请求前检查；等待响应期间被取消时取消请求（释放并发名额）并抛出ReviewCancelledError
+    """
+    if cancel_token is None:
+        return model.generate_text(messages)
+    cancel_token.raise_if_cancelled()
+    llm_response = model.generate_texts([messages], cancel_token=cancel_token)[0]
+    if isinstance(llm_response, Exception):
+        raise llm_response
+    return llm_response
+
+
+def receive_commit_review(model, messages, file_count, cancel_token=None):
+    """
+    获取增强版commit审查的响应，开启STREAMING_COMMIT_REVIEW时流式接收并增量检查占位符
+    :param cancel_token: 可选的CancellationToken，流式接收期间被取消时中止请求并抛出ReviewCancelledError
+    :return: (响应内容, token数, 是否因占位符缺失过多而提前中止)
+    """
+    if not STREAMING_COMMIT_REVIEW:
+        llm_response = request_commit_review(model, messages, cancel_token)
+        return llm_response.content, llm_response.tokens, False
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
+    monitor = CommitReviewStreamMonitor(file_count)
+    with model.stream_text(messages) as stream:
+        for chunk in stream:
+            if cancel_token is not None:
+                # 退出with时关闭流，不再等待剩余的输出
+                cancel_token.raise_if_cancelled()
+            monitor.feed(chunk)
+            if monitor.should_abort():
+                stream.close()
+                log.warning(f"⚠️ 流式响应中已确定缺少占位符 {monitor.missing_placeholders()}，"
+                            f"已收到 {len(monitor.content)} 字符，提前中止请求")
+                return monitor.content, stream.response.tokens, True
+    return stream.response.content, stream.response.tokens, False
+
+
 def create_fallback_review(commit_info, reviewable_changes, error_message=""):
     """创建回退审查结果"""
     commit_id = commit_info['id'][:8]
@@ -106,8 +294,8 @@ def create_fallback_review(commit_info, reviewable_changes, error_message=""):
     
     return commit_review
 
-@retry(stop_max_attempt_number=3, wait_fixed=60000)
-def generate_commit_review_note_enhanced(commit_info, commit_changes, model, gitlab_fetcher, merge_info):
+@retry(stop_max_attempt_number=3, wait_fixed=60000, retry_on_exception=_not_cancelled)
+def generate_commit_review_note_enhanced(commit_info, commit_changes, model, gitlab_fetcher, merge_info, cancel_token=None):
     """增强版commit审查 - 包含防止失误的功能"""
     try:
         commit_id = commit_info['id'][:8]
@@ -159,13 +347,15 @@ def generate_commit_review_note_enhanced(commit_info, commit_changes, model, git
         all_changes_text = "\n".join(all_changes_content)
         
         # 第一步：Token长度预检查
-        estimated_tokens = estimate_token_count(all_changes_text)
+        estimated_tokens = count_tokens(all_changes_text)
+        token_threshold = commit_token_threshold()
         log.info(f"📊 预估输入token数: {estimated_tokens}")
         
         # 如果预估token过多，采用分批处理策略
-        if estimated_tokens > MAX_ESTIMATED_TOKENS:
-            log.warning(f"⚠️ 预估token过多({estimated_tokens})，超过阈值({MAX_ESTIMATED_TOKENS})，将采用分批处理策略")
-            return generate_commit_review_note_batch(commit_info, reviewable_changes, model, gitlab_fetcher, merge_info)
+        if estimated_tokens > token_threshold:
+            log.warning(f"⚠️ 预估token过多({estimated_tokens})，超过阈值({token_threshold})，将采用分批处理策略")
+            return generate_commit_review_note_batch(commit_info, reviewable_changes, model, gitlab_fetcher,
+                                                     merge_info, cancel_token)
         
         # 第二步：构建提示词
         unified_prompt = f"""
@@ -232,15 +422,18 @@ def generate_commit_review_note_enhanced(commit_info, commit_changes, model, git
         
         # 第三步：发送请求并获取响应
         log.info(f"📝 开始LLM分析commit {commit_id}，包含 {len(reviewable_changes)} 个文件")
-        model.generate_text(messages)
-        content = model.get_respond_content()
+        content, total_tokens, aborted = receive_commit_review(model, messages, len(reviewable_changes),
+                                                               cancel_token)
+        if aborted:
+            log.warning(f"⚠️ 占位符缺失过多，超过阈值({INCOMPLETE_RESPONSE_THRESHOLD:.1%})，尝试降级处理")
+            return generate_commit_review_note_batch(commit_info, reviewable_changes, model, gitlab_fetcher,
+                                                     merge_info, cancel_token)
         
         if not content:
             log.error(f"❌ LLM返回内容为空 (commit review) for {commit_id}")
             return create_fallback_review(commit_info, reviewable_changes, "LLM返回内容为空，请稍后重试")
         
         response_content = content.strip()
-        total_tokens = model.get_respond_tokens()
         
         log.info(f"📊 LLM响应: {total_tokens} tokens, {len(response_content)} 字符")
         
@@ -257,7 +450,8 @@ def generate_commit_review_note_enhanced(commit_info, commit_changes, model, git
             missing_ratio = len(validation_result['missing_placeholders']) / len(reviewable_changes)
             if missing_ratio > INCOMPLETE_RESPONSE_THRESHOLD:
                 log.warning(f"⚠️ 占位符缺失过多({missing_ratio:.1%})，超过阈值({INCOMPLETE_RESPONSE_THRESHOLD:.1%})，尝试降级处理")
-                return generate_commit_review_note_batch(commit_info, reviewable_changes, model, gitlab_fetcher, merge_info)
+                return generate_commit_review_note_batch(commit_info, reviewable_changes, model, gitlab_fetcher,
+                                                         merge_info, cancel_token)
         
         # 第五步：处理占位符替换
         successfully_replaced = 0
@@ -317,11 +511,13 @@ def generate_commit_review_note_enhanced(commit_info, commit_changes, model, git
         log.info(f'✅ 增强版Commit {commit_id} 审查完成')
         return commit_review
         
+    except ReviewCancelledError:
+        raise
     except Exception as e:
         log.error(f"增强版commit审查失败: {e}")
         return create_fallback_review(commit_info, reviewable_changes, f"审查过程中发生错误: {str(e)}")
 
-def generate_commit_review_note_batch(commit_info, reviewable_changes, model, gitlab_fetcher, merge_info):
+def generate_commit_review_note_batch(commit_info, reviewable_changes, model, gitlab_fetcher, merge_info, cancel_token=None):
     """分批处理commit审查"""
     try:
         commit_id = commit_info['id'][:8]
@@ -331,9 +527,9 @@ def generate_commit_review_note_batch(commit_info, reviewable_changes, model, gi
         
         log.info(f"📝 开始分批审查commit: {commit_id}")
         
-        # 分批处理（每批文件数量由配置决定）
-        batch_size = BATCH_SIZE_FOR_COMMIT_REVIEW
-        batches = [reviewable_changes[i:i + batch_size] for i in range(0, len(reviewable_changes), batch_size)]
+        # 分批处理（每批文件数量由配置决定，同时不超过模型可用的输入token数）
+        token_threshold = commit_token_threshold()
+        batches = pack_changes_into_batches(reviewable_changes, BATCH_SIZE_FOR_COMMIT_REVIEW, token_threshold)
         
         batch_reviews = []
         total_tokens = 0
@@ -356,7 +552,10 @@ def generate_commit_review_note_batch(commit_info, reviewable_changes, model, gi
                 file_content = f"### 文件 {i}: {file_path}\n\n```diff\n{diff_content}\n```\n\n"
                 batch_content.append(file_content)
             
-            batch_text = "\n".join(batch_content)
+            batch_text, truncated = fit_to_token_budget("\n".join(batch_content))
+            if truncated:
+                log.warning(f"⚠️ 第{batch_idx}批内容超过模型输入窗口，将被截断")
+                batch_text += "\n\n... (内容过长，已截断)"
             
             batch_prompt = f"""
 请分析以下文件变更（第{batch_idx}批，共{len(batches)}批）：
@@ -378,17 +577,19 @@ def generate_commit_review_note_batch(commit_info, reviewable_changes, model, gi
             ]
             
             try:
-                model.generate_text(messages)
-                content = model.get_respond_content()
+                llm_response = request_commit_review(model, messages, cancel_token)
+                content = llm_response.content
                 
                 if content:
                     batch_reviews.append(f"### 📄 第{batch_idx}批文件分析\n\n{content.strip()}")
-                    total_tokens += model.get_respond_tokens()
-                    log.info(f"✅ 完成第{batch_idx}批审查，tokens: {model.get_respond_tokens()}")
+                    total_tokens += llm_response.tokens
+                    log.info(f"✅ 完成第{batch_idx}批审查，tokens: {llm_response.tokens}")
                 else:
                     log.warning(f"⚠️ 第{batch_idx}批返回内容为空")
                     batch_reviews.append(f"### 📄 第{batch_idx}批文件分析\n\n⚠️ 此批次分析暂时不可用")
                     
+            except ReviewCancelledError:
+                raise
             except Exception as e:
                 log.error(f"❌ 第{batch_idx}批处理失败: {e}")
                 batch_reviews.append(f"### 📄 第{batch_idx}批文件分析\n\n⚠️ 此批次分析失败: {str(e)}")
@@ -434,12 +635,14 @@ def generate_commit_review_note_batch(commit_info, reviewable_changes, model, gi
         log.info(f'✅ 分批处理Commit {commit_id} 审查完成，总tokens: {total_tokens}')
         return commit_review
         
+    except ReviewCancelledError:
+        raise
     except Exception as e:
         log.error(f"分批处理commit审查失败: {e}")
         return create_fallback_review(commit_info, reviewable_changes, f"分批处理过程中发生错误: {str(e)}")
 
-@retry(stop_max_attempt_number=3, wait_fixed=60000)
-def generate_commit_review_note(commit_info, commit_changes, model, gitlab_fetcher, merge_info):
+@retry(stop_max_attempt_number=3, wait_fixed=60000, retry_on_exception=_not_cancelled)
+def generate_commit_review_note(commit_info, commit_changes, model, gitlab_fetcher, merge_info, cancel_token=None):
     """为单个commit生成简化的审查意见（一次性分析所有文件变更）"""
     try:
         commit_id = commit_info['id'][:8]  # 取前8位作为短ID
@@ -489,7 +692,10 @@ def generate_commit_review_note(commit_info, commit_changes, model, gitlab_fetch
             all_changes_content.append(file_content)
         
         # 构建统一的提示词，一次性分析所有文件
-        all_changes_text = "\n".join(all_changes_content)
+        all_changes_text, truncated = fit_to_token_budget("\n".join(all_changes_content))
+        if truncated:
+            log.warning(f"⚠️ Commit {commit_id} 的变更内容超过模型输入窗口，将被截断")
+            all_changes_text += "\n\n... (内容过长，已截断)"
         
         unified_prompt = f"""
 请分析以下commit的所有文件变更，这是一个完整的commit审查。
@@ -551,8 +757,8 @@ def generate_commit_review_note(commit_info, commit_changes, model, gitlab_fetch
         
         # 一次性进行commit审查
         log.info(f"📝 开始LLM分析commit {commit_id}，包含 {len(reviewable_changes)} 个文件")
-        model.generate_text(messages)
-        content = model.get_respond_content()
+        llm_response = request_commit_review(model, messages, cancel_token)
+        content = llm_response.content
         
         if not content:
             log.error(f"LLM返回内容为空 (commit review) for {commit_id}")
@@ -568,7 +774,7 @@ def generate_commit_review_note(commit_info, commit_changes, model, gitlab_fetch
             commit_review += "\n⚠️ AI分析暂时不可用，请手动审查代码变更。\n\n"
         else:
             response_content = content.strip()
-            total_tokens = model.get_respond_tokens()
+            total_tokens = llm_response.tokens
             
             # 检查AI响应是否完整（包含所有必需的占位符）
             missing_placeholders = []
@@ -635,13 +841,15 @@ def generate_commit_review_note(commit_info, commit_changes, model, gitlab_fetch
         log.info(f'📝 Commit {commit_id} 审查结果长度: {len(commit_review)}')
         return commit_review
         
+    except ReviewCancelledError:
+        raise
     except Exception as e:
         log.error(f"生成commit审查失败: {e}")
         return ""
 
 
-@retry(stop_max_attempt_number=3, wait_fixed=60000)
-def generate_detailed_commit_review_note(commit_info, commit_changes, model, gitlab_fetcher, merge_info):
+@retry(stop_max_attempt_number=3, wait_fixed=60000, retry_on_exception=_not_cancelled)
+def generate_detailed_commit_review_note(commit_info, commit_changes, model, gitlab_fetcher, merge_info, cancel_token=None):
     """为单个commit生成详细的审查意见（每个文件单独调用LLM进行详细分析）"""
     try:
         commit_id = commit_info['id'][:8]  # 取前8位作为短ID
@@ -667,14 +875,28 @@ def generate_detailed_commit_review_note(commit_info, commit_changes, model, git
             log.warning(f"📝 Commit {commit_id} 文件数量过多，将只审查前 {MAX_FILES_PER_COMMIT} 个文件")
             reviewable_changes = reviewable_changes[:MAX_FILES_PER_COMMIT]
         
-        # 为每个文件单独进行详细分析
-        file_reviews = []
+        # 并发获取所有文件的源代码
+        source_codes = gitlab_fetcher.get_files_content(
+            [change.get('new_path') or change.get('old_path') for change in reviewable_changes],
+            merge_info['source_branch'])
+
+        # 搜索引用了变更函数/类的文件，作为影响分析的上下文
+        symbol_references = {}
+        if ENHANCED_CONTEXT_ANALYSIS and CONTEXT_IMPACT_ANALYSIS and CODE_SEARCH_REFERENCES_ENABLED:
+            # 在被审查的commit上搜索（而不是MR的head），与该commit的diff一致
+            symbol_references = find_symbol_references(gitlab_fetcher.project_id, commit_info['id'], reviewable_changes)
+        
+        # 为每个文件单独构建详细分析的请求
+        pending_reviews = []
+        # 系统提示词在增强模式下同时出现在用户消息中
+        prompt_reserve = 2 * max(count_tokens(CODE_REVIEW_PROMPT), count_tokens(ENHANCED_CONTEXT_REVIEW_PROMPT)) + \
+            PROMPT_TEMPLATE_RESERVE
         for i, change in enumerate(reviewable_changes, 1):
             file_path = change.get('new_path') or change.get('old_path')
             log.info(f"📝 详细分析文件 {i}/{len(reviewable_changes)}: {file_path}")
             
             # 获取源代码
-            source_code = gitlab_fetcher.get_file_content(file_path, merge_info['source_branch'])
+            source_code = source_codes.get(file_path)
             
             # 检查diff内容
             diff_content = change.get('diff', '')
@@ -697,12 +919,21 @@ def generate_detailed_commit_review_note(commit_info, commit_changes, model, git
                 content = add_enhanced_context_to_diff(diff_content, source_code, CONTEXT_ANALYSIS_MODE)
             else:
                 content = add_context_to_diff(diff_content, source_code)
+            if content and file_path in symbol_references:
+                content += "\n" + format_symbol_references(symbol_references[file_path])
             
             # 检查最终内容长度限制
             if content and len(content) > MAX_CONTENT_LENGTH:
                 log.warning(f"⚠️ 文件 {file_path} 的最终内容过长，将被截断")
                 content = content[:MAX_CONTENT_LENGTH] + "\n\n... (内容过长，已截断)"
             
+            # 按模型的输入窗口截断
+            if content:
+                content, truncated = fit_to_token_budget(content, prompt_reserve)
+                if truncated:
+                    log.warning(f"⚠️ 文件 {file_path} 的内容超过模型输入窗口，将被截断")
+                    content += "\n\n... (内容过长，已截断)"
+            
             # 检查最终内容
             if not content or content.strip() == "":
                 log.warning(f"⚠️ 文件 {file_path} 处理后内容为空，跳过审查")
@@ -787,10 +1018,19 @@ def generate_detailed_commit_review_note(commit_info, commit_changes, model, git
                 },
             ]
             
-            # 进行单文件详细审查
-            log.info(f"📝 开始LLM详细分析文件: {file_path}")
-            model.generate_text(messages)
-            content = model.get_respond_content()
+            pending_reviews.append((file_path, i, diff_content, messages))
+        
+        # 各文件的详细审查互不依赖，并发发送给LLM
+        log.info(f"📝 开始LLM详细分析 {len(pending_reviews)} 个文件")
+        responses = model.generate_texts([messages for _, _, _, messages in pending_reviews],
+                                         cancel_token=cancel_token) if pending_reviews else []
+        file_reviews = []
+        for (file_path, i, diff_content, _), llm_response in zip(pending_reviews, responses):
+            if isinstance(llm_response, Exception):
+                log.error(f"LLM调用失败 (detailed file review) for {file_path}: {llm_response}")
+                content = None
+            else:
+                content = llm_response.content
             
             if not content:
                 log.error(f"LLM返回内容为空 (detailed file review) for {file_path}")
@@ -803,7 +1043,7 @@ def generate_detailed_commit_review_note(commit_info, commit_changes, model, git
                 }
             else:
                 response_content = content.strip()
-                total_tokens = model.get_respond_tokens()
+                total_tokens = llm_response.tokens
                 
                 file_review = {
                     'file_path': file_path,
@@ -864,13 +1104,21 @@ def generate_detailed_commit_review_note(commit_info, commit_changes, model, git
         log.info(f'📝 Commit {commit_id} 审查结果长度: {len(commit_review)}')
         return commit_review
         
+    except ReviewCancelledError:
+        raise
     except Exception as e:
         log.error(f"生成详细commit审查失败: {e}")
         return ""
 
 
-def chat_commit_review(commits, commit_changes_map, generate_review, *args, **kwargs):
+def chat_commit_review(commits, commit_changes_map, generate_review, *args, cancel_token=None, **kwargs):
     """对多个commits进行并发审查"""
+    return [result for _, result in chat_commit_review_with_ids(commits, commit_changes_map, generate_review,
+                                                                *args, cancel_token=cancel_token, **kwargs)]
+
+
+def chat_commit_review_with_ids(commits, commit_changes_map, generate_review, *args, cancel_token=None, **kwargs):
+    """对多个commits进行并发审查，返回 (commit, 审查结果) 列表"""
     log.info(f'开始per-commit code review - 共 {len(commits)} 个commits')
     
     # 只记录有变更的commits
@@ -887,12 +1135,14 @@ def chat_commit_review(commits, commit_changes_map, generate_review, *args, **kw
     else:
         log.info('📝 没有有变更的commits')
     
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        review_results = []
+    review_results = []
+    with cancellable_executor(cancel_token) as executor:
         result_lock = threading.Lock()
 
         def process_commit(commit):
             try:
+                if cancel_token:
+                    cancel_token.raise_if_cancelled()
                 commit_id = commit['id']
                 commit_changes = commit_changes_map.get(commit_id, [])
                 
@@ -900,7 +1150,7 @@ def chat_commit_review(commits, commit_changes_map, generate_review, *args, **kw
                     log.info(f"📝 Commit {commit_id[:8]} 没有文件变更，跳过审查")
                     return ""
                 
-                result = generate_review(commit, commit_changes, *args, **kwargs)
+                result = generate_review(commit, commit_changes, *args, cancel_token=cancel_token, **kwargs)
                 log.info(f"📝 Commit {commit_id[:8]} 审查结果长度: {len(result) if result else 0}")
                 
                 # 只有非空结果才添加到review_results
@@ -912,6 +1162,8 @@ def chat_commit_review(commits, commit_changes_map, generate_review, *args, **kw
                     log.warning(f"📝 Commit {commit_id[:8]} 审查结果为空或无效")
                 
                 return result
+            except ReviewCancelledError:
+                return ""
             except Exception as e:
                 log.error(f"处理commit {commit['id'][:8]} 时出错: {e}")
                 return ""
@@ -919,12 +1171,8 @@ def chat_commit_review(commits, commit_changes_map, generate_review, *args, **kw
         # 提交所有任务
         futures = [executor.submit(process_commit, commit) for commit in commits]
         
-        # 等待所有任务完成
-        for future in concurrent.futures.as_completed(futures):
-            try:
-                future.result()
-            except Exception as e:
-                log.error(f"Commit审查任务执行失败: {e}")
+        # 等待所有任务完成，审查被取消时立即返回
+        wait_futures(futures, cancel_token)
 
     # 按commit顺序排序结果，返回review内容列表
     sorted_results = []
@@ -932,7 +1180,7 @@ def chat_commit_review(commits, commit_changes_map, generate_review, *args, **kw
         commit_id = commit['id']
         for cid, result in review_results:
             if commit_id == cid and result.strip():
-                sorted_results.append(result)
+                sorted_results.append((commit, result))
                 log.info(f"📝 添加commit {commit_id[:8]} 的审查结果到返回列表，长度: {len(result)}")
                 break
     
@@ -940,10 +1188,49 @@ def chat_commit_review(commits, commit_changes_map, generate_review, *args, **kw
     return sorted_results
 
 
+def get_commit_review_function():
+    """根据配置选择commit审查函数"""
+    if COMMIT_REVIEW_MODE == 'detailed':
+        return generate_detailed_commit_review_note
+    elif ENABLE_ENHANCED_COMMIT_REVIEW:
+        return generate_commit_review_note_enhanced
+    else:
+        return generate_commit_review_note
+
+
+def select_push_commits(gitlab_fetcher, commits, cancel_token=None):
+    """
+    从push的commit中筛选需要审查的commit（从新到旧）
+    - 跳过merge commit
+    - 跳过已关联MR的commit，这些commit由MR审查覆盖；关联MR按批并发查询，每批只查询补足上限所需的数量
+    - 最多 PUSH_REVIEW_MAX_COMMITS 个
+    :param commits: push中的commit列表（从旧到新）
+    :return: 需要审查的commit列表（从旧到新）
+    """
+    candidates = [commit for commit in reversed(commits) if len(commit.get('parent_ids') or []) <= 1]
+    skipped_merge = len(commits) - len(candidates)
+    selected = []
+    skipped_mr = checked = 0
+    while checked < len(candidates) and len(selected) < PUSH_REVIEW_MAX_COMMITS:
+        chunk = candidates[checked:checked + PUSH_REVIEW_MAX_COMMITS - len(selected)]
+        checked += len(chunk)
+        merge_requests = fetch_concurrently(gitlab_fetcher.get_commit_merge_requests,
+                                            [commit['id'] for commit in chunk], cancel_token)
+        for commit in chunk:
+            if merge_requests.get(commit['id']):
+                skipped_mr += 1
+            else:
+                selected.append(commit)
+    skipped_limit = len(candidates) - checked
+    log.info(f"📝 push共 {len(commits)} 个commits，审查 {len(selected)} 个，跳过merge commit {skipped_merge} 个、"
+             f"已关联MR {skipped_mr} 个、超出数量上限 {skipped_limit} 个")
+    return list(reversed(selected))
+
+
 class CommitReviewHandle(ReviewHandle):
     """处理每个commit的单独审查"""
     
-    def merge_handle(self, gitlabMergeRequestFetcher, gitlabRepoManager, hook_info, reply, model):
+    def merge_handle(self, gitlabMergeRequestFetcher, gitlabRepoManager, hook_info, reply, model, cancel_token=None):
         from config.config import REVIEW_MODE
         
         # 检查是否需要执行commit审查
@@ -979,7 +1266,8 @@ class CommitReviewHandle(ReviewHandle):
                 log.info(f"📝 首次打开MR，将审查所有 {len(commits)} 个commits")
             elif action == 'update':
                 # MR更新，只审查新增的commits
-                reviewed_commits = gitlabMergeRequestFetcher.get_reviewed_commits()
+                reviewed_commits = gitlabMergeRequestFetcher.get_reviewed_commits(
+                    commit_ids=[commit['id'][:8] for commit in commits])
                 reviewed_commit_ids = set(reviewed_commits)
                 
                 # 过滤出未审查的commits
@@ -1000,13 +1288,12 @@ class CommitReviewHandle(ReviewHandle):
                 commits_to_review = commits
                 log.info(f"📝 未知action '{action}'，将审查所有 {len(commits)} 个commits")
             
-            # 获取需要审查的commits的变更
-            commit_changes_map = {}
-            for commit in commits_to_review:
-                commit_id = commit['id']
-                commit_changes = gitlabMergeRequestFetcher.get_commit_changes(commit_id)
-                if commit_changes:
-                    commit_changes_map[commit_id] = commit_changes
+            # 并发获取需要审查的commits的变更
+            commit_changes_map = {
+                commit_id: commit_changes for commit_id, commit_changes in gitlabMergeRequestFetcher.get_commits_changes(
+                    [commit['id'] for commit in commits_to_review], cancel_token=cancel_token).items()
+                if commit_changes
+            }
             
             # 打印即将审查的commits信息
             if commits_to_review:
@@ -1020,12 +1307,7 @@ class CommitReviewHandle(ReviewHandle):
             
             # 进行per-commit审查，返回每个commit的review列表
             # 根据配置选择审查函数
-            if COMMIT_REVIEW_MODE == 'detailed':
-                review_function = generate_detailed_commit_review_note
-            elif ENABLE_ENHANCED_COMMIT_REVIEW:
-                review_function = generate_commit_review_note_enhanced
-            else:
-                review_function = generate_commit_review_note
+            review_function = get_commit_review_function()
             
             review_infos = chat_commit_review(
                 commits_to_review, 
@@ -1033,7 +1315,8 @@ class CommitReviewHandle(ReviewHandle):
                 review_function,
                 model, 
                 gitlabMergeRequestFetcher, 
-                merge_info
+                merge_info,
+                cancel_token=cancel_token
             )
             
             if review_infos:
@@ -1056,5 +1339,56 @@ class CommitReviewHandle(ReviewHandle):
             else:
                 log.info("📝 Per-commit审查没有产生结果")
                 
+        except ReviewCancelledError:
+            raise
+        except Exception as e:
+            log.error(f"Per-commit审查失败: {e}") 
+
+    def push_handle(self, gitlabCommitFetcher, push_info, reply, model, cancel_token=None):
+        try:
+            commits_to_review = select_push_commits(gitlabCommitFetcher, push_info['commits'], cancel_token)
+            if not commits_to_review:
+                log.info("📝 push中没有需要审查的commits，跳过")
+                return
+
+            commit_changes_map = {
+                commit_id: commit_changes for commit_id, commit_changes in gitlabCommitFetcher.get_commits_changes(
+                    [commit['id'] for commit in commits_to_review], cancel_token=cancel_token).items()
+                if commit_changes
+            }
+
+            review_function = get_commit_review_function()
+
+            # model由ReviewEngine包装为按调用次数限流（push_review_limiter）的实例
+            def review_commit(commit, commit_changes, model, gitlab_fetcher, cancel_token=None):
+                # 文件内容按该commit自身的SHA获取，与它的diff一致（而不是push后的head）
+                return review_function(commit, commit_changes, model, gitlab_fetcher, {'source_branch': commit['id']},
+                                       cancel_token=cancel_token)
+
+            review_results = chat_commit_review_with_ids(
+                commits_to_review,
+                commit_changes_map,
+                review_commit,
+                model,
+                gitlabCommitFetcher,
+                cancel_token=cancel_token
+            )
+
+            # 每个commit的审查结果评论在对应的commit上
+            for commit, review_info in review_results:
+                if cancel_token:
+                    cancel_token.raise_if_cancelled()
+                commit_reply = ReviewResponse(dict(reply.config, commit_id=commit['id']))
+                commit_reply.add_reply({
+                    'title': '__PER_COMMIT_REVIEW__',
+                    'content': review_info,
+                    'target': 'gitlab',
+                    'msg_type': 'MAIN',
+                })
+                commit_reply.send()
+            log.info(f"📝 Push审查完成，{len(review_results)} 个commit已单独评论")
+
+        except ReviewCancelledError:
+            raise
         except Exception as e:
-            log.error(f"Per-commit审查失败: {e}") 
\ No newline at end of file
+            log.error(f"Push审查失败: {e}")
@@ -1,20 +1,21 @@
-import concurrent.futures
 import threading
 
 from retrying import retry
 from config.config import MAX_FILES, SUPPORTED_FILE_TYPES, IGNORE_FILE_TYPES, MAX_CONTENT_LENGTH, MAX_DIFF_LENGTH, MAX_SOURCE_LENGTH
+from large_model.token_counter import count_tokens, fit_to_token_budget, PROMPT_TEMPLATE_RESERVE
 from review_engine.review_prompt import CODE_REVIEW_PROMPT
 from review_engine.abstract_handler import ReviewHandle
 from utils.gitlab_parser import (filter_diff_content, add_context_to_diff, extract_diffs,
                                  get_comment_request_json, extract_comment_end_line)
 from utils.logger import log
 from utils.args_check import file_need_check
+from utils.cancellation import cancellable_executor, wait_futures
 from utils.tools import batch
 from review_engine.review_prompt import (REVIEW_SUMMARY_SETTING, FILE_DIFF_REVIEW_PROMPT, BATCH_SUMMARY_PROMPT,
                                          FINAL_SUMMARY_PROMPT,SUMMARY_OUTPUT_PROMPT)
 
 
-def chat_review(changes, generate_review, *args, **kwargs):
+def chat_review(changes, generate_review, *args, cancel_token=None, **kwargs):
     log.info(f'开始code review - 共 {len(changes)} 个文件')
     
     # 只记录需要审查的文件
@@ -29,12 +30,14 @@ def chat_review(changes, generate_review, *args, **kwargs):
     else:
         log.info('📄 没有需要审查的文件')
     
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        review_results = []
+    review_results = []
+    with cancellable_executor(cancel_token) as executor:
         result_lock = threading.Lock()
 
         def process_change(change):
             file_path = change["new_path"]
+            if cancel_token and cancel_token.is_cancelled():
+                return
             log.info(f'🔍 开始处理文件: {file_path}')
             try:
                 result = generate_review(change, *args, **kwargs)
@@ -56,8 +59,8 @@ def chat_review(changes, generate_review, *args, **kwargs):
 
         log.info(f'📊 将处理 {processed_count} 个文件，跳过 {len(changes) - processed_count} 个文件')
         
-        # 等待所有任务完成
-        concurrent.futures.wait(futures)
+        # 等待所有任务完成，审查被取消时立即返回
+        wait_futures(futures, cancel_token)
 
     log.info(f'✅ Code review 完成，生成了 {len(review_results)} 个审查结果')
     
@@ -78,7 +81,7 @@ def chat_review(changes, generate_review, *args, **kwargs):
         return "\n\n".join(review_results)
 
 
-def chat_review_summary(changes, model):
+def chat_review_summary(changes, model, cancel_token=None):
     log.info("开始 code review summary")
     file_diff_map = {}
     file_summary_map = {}
@@ -91,8 +94,10 @@ def chat_review_summary(changes, model):
             file_diff_map[change['new_path']] = filter_diff_content(change['diff'])
 
     # 对单个文件diff进行总结
-    with concurrent.futures.ThreadPoolExecutor() as executor:
+    with cancellable_executor(cancel_token) as executor:
         def process_summary(file, diff, model):
+            if cancel_token and cancel_token.is_cancelled():
+                return
             summary = generate_diff_summary(file, diff, model)
             with summary_lock:
                 file_summary_map[file] = summary
@@ -101,7 +106,7 @@ def chat_review_summary(changes, model):
         for file, diff in file_diff_map.items():
             futures.append(executor.submit(process_summary, file, diff, model))
         # 等待所有任务完成
-        concurrent.futures.wait(futures)
+        wait_futures(futures, cancel_token)
 
     log.info("code diff review完成，batch summary中")
     summaries_content = ""
@@ -111,6 +116,8 @@ def chat_review_summary(changes, model):
         for file in batch_data:
             summaries_content += f"---\n{file}: {file_summary_map[file]}\n"
         batch_changesets_prompt = BATCH_SUMMARY_PROMPT.replace("$raw_summary", summaries_content)
+        if cancel_token:
+            cancel_token.raise_if_cancelled()
         batch_summary_msg = [
             {"role": "system",
              "content": REVIEW_SUMMARY_SETTING
@@ -119,8 +126,8 @@ def chat_review_summary(changes, model):
              "content": f"{batch_changesets_prompt}"
              }
         ]
-        model.generate_text(batch_summary_msg)
-        content = model.get_respond_content()
+        llm_response = model.generate_text(batch_summary_msg)
+        content = llm_response.content
         if not content:
             log.error("LLM返回内容为空 (chat_review_summary)")
             return ""
@@ -139,11 +146,13 @@ def chat_review_summary(changes, model):
          "content": f"{final_summaries_content}"
          }
     ]
+    if cancel_token:
+        cancel_token.raise_if_cancelled()
     summary_result = generate_diff_summary(model=model, messages=final_summary_msg)
     log.info("code diff review summary完成")
     return summary_result+"\n\n---\n\n" if summary_result else ""
 
-def chat_review_inline_comment(changes, model, merge_info):
+def chat_review_inline_comment(changes, model, merge_info, cancel_token=None):
     """行内comment"""
     log.info("开始code review inline comment")
     comment_results = []
@@ -151,8 +160,10 @@ def chat_review_inline_comment(changes, model, merge_info):
     diff_refs = merge_info['diff_refs']
 
     # 对单个diff块生成 inline comment
-    with concurrent.futures.ThreadPoolExecutor() as executor:
+    with cancellable_executor(cancel_token) as executor:
         def process_comment(diff, model, change, old_line_end, new_line_end):
+            if cancel_token and cancel_token.is_cancelled():
+                return
             comment = generate_inline_comment(diff, model)
             comment_json = get_comment_request_json(comment, change, old_line_end, new_line_end ,diff_refs)
             with comment_lock:
@@ -169,15 +180,25 @@ def chat_review_inline_comment(changes, model, merge_info):
                 old_line_end, new_line_end =  extract_comment_end_line(diff)
                 futures.append(executor.submit(process_comment, diff, model, change, old_line_end, new_line_end))
         # 等待所有任务完成
-        concurrent.futures.wait(futures)
+        wait_futures(futures, cancel_token)
 
     log.info("inline comment 完成")
     return comment_results if comment_results else None
 
 
+def fit_diff_to_token_budget(diff):
+    """把diff截断到模型的输入窗口以内（扣除总结提示词）"""
+    reserve = count_tokens(REVIEW_SUMMARY_SETTING) + count_tokens(FILE_DIFF_REVIEW_PROMPT) + PROMPT_TEMPLATE_RESERVE
+    diff, truncated = fit_to_token_budget(diff, reserve)
+    if truncated:
+        log.warning("⚠️ diff内容超过模型输入窗口，将被截断")
+        diff += "\n\n... (内容过长，已截断)"
+    return diff
+
+
 @retry(stop_max_attempt_number=3, wait_fixed=60000)
 def generate_inline_comment(diff, model):
-    file_diff_prompt = FILE_DIFF_REVIEW_PROMPT.replace('$file_diff', diff)
+    file_diff_prompt = FILE_DIFF_REVIEW_PROMPT.replace('$file_diff', fit_diff_to_token_budget(diff))
     file_diff_prompt += "\n\n要求总结用中文回答，评价尽可能全面且精炼，字数不超过50字。"
     messages = [
         {"role": "system",
@@ -188,8 +209,8 @@ def generate_inline_comment(diff, model):
             "content": f"{file_diff_prompt}",
         },
     ]
-    model.generate_text(messages)
-    content = model.get_respond_content()
+    llm_response = model.generate_text(messages)
+    content = llm_response.content
     if not content:
         log.error("LLM返回内容为空 (generate_inline_comment)")
         return "comment: nothing obtained from LLM"
@@ -205,7 +226,7 @@ def generate_inline_comment(diff, model):
 
 @retry(stop_max_attempt_number=3, wait_fixed=60000)
 def generate_diff_summary(file=None, diff=None, model=None, messages=None):
-    file_diff_prompt =  FILE_DIFF_REVIEW_PROMPT.replace('$file_diff', diff) if diff else ""
+    file_diff_prompt =  FILE_DIFF_REVIEW_PROMPT.replace('$file_diff', fit_diff_to_token_budget(diff)) if diff else ""
     messages = [
         {"role": "system",
          "content": REVIEW_SUMMARY_SETTING
@@ -217,8 +238,8 @@ def generate_diff_summary(file=None, diff=None, model=None, messages=None):
     ] if messages is None else messages
     if model is None:
         return "summarize: model is None"
-    model.generate_text(messages)
-    content = model.get_respond_content()
+    llm_response = model.generate_text(messages)
+    content = llm_response.content
     if not content:
         log.error("LLM返回内容为空 (generate_diff_summary)")
         return "summarize: nothing obtained from LLM"
@@ -264,6 +285,13 @@ def generate_review_note_with_context(change, model, gitlab_fetcher, merge_info)
             log.warning(f"⚠️ 文件 {new_path} 的最终内容过长，将被截断")
             content = content[:MAX_CONTENT_LENGTH] + "\n\n... (内容过长，已截断)"
         
+        # 按模型的输入窗口截断
+        if content:
+            content, truncated = fit_to_token_budget(content, count_tokens(CODE_REVIEW_PROMPT) + PROMPT_TEMPLATE_RESERVE)
+            if truncated:
+                log.warning(f"⚠️ 文件 {new_path} 的内容超过模型输入窗口，将被截断")
+                content += "\n\n... (内容过长，已截断)"
+        
         # 检查最终内容
         if not content or content.strip() == "":
             log.warning(f"⚠️ 文件 {new_path} 处理后内容为空，跳过审查")
@@ -288,13 +316,13 @@ def generate_review_note_with_context(change, model, gitlab_fetcher, merge_info)
         
         # review
         log.info(f"📤 正在审查文件: {new_path}")
-        model.generate_text(messages)
-        content = model.get_respond_content()
+        llm_response = model.generate_text(messages)
+        content = llm_response.content
         if not content:
             log.error(f"LLM返回内容为空 (generate_review_note_with_context) for {new_path}")
             return ""
         response_content = content.replace('\n\n', '\n')
-        total_tokens = model.get_respond_tokens()
+        total_tokens = llm_response.tokens
 
         # response
         review_note = f"<details><summary>📚<strong><code>{new_path}</code></strong></summary>\
@@ -313,13 +341,14 @@ def generate_review_note_with_context(change, model, gitlab_fetcher, merge_info)
 
 
 class MainReviewHandle(ReviewHandle):
-    def merge_handle(self, gitlabMergeRequestFetcher, gitlabRepoManager, hook_info, reply, model):
-        changes = gitlabMergeRequestFetcher.get_changes()
+    def merge_handle(self, gitlabMergeRequestFetcher, gitlabRepoManager, hook_info, reply, model, cancel_token=None):
+        # 超过MAX_FILES的MR不审查，只需要知道文件数超出上限
+        changes = gitlabMergeRequestFetcher.get_changes(limit=MAX_FILES + 1)
         merge_info = gitlabMergeRequestFetcher.get_info()
-        self.default_handle(changes, merge_info, hook_info, reply, model, gitlabMergeRequestFetcher)
+        self.default_handle(changes, merge_info, hook_info, reply, model, gitlabMergeRequestFetcher, cancel_token)
 
 
-    def default_handle(self, changes, merge_info, hook_info, reply, model, gitlab_fetcher):
+    def default_handle(self, changes, merge_info, hook_info, reply, model, gitlab_fetcher, cancel_token=None):
         if changes and len(changes) <= MAX_FILES:
             # 获取审查模式配置
             from config.config import REVIEW_MODE
@@ -329,13 +358,14 @@ class MainReviewHandle(ReviewHandle):
             # 根据模式决定是否生成MR总结
             if REVIEW_MODE in ["summary_only", "summary_and_commit"]:
                 # 生成总结评论
-                review_summary = chat_review_summary(changes, model)
+                review_summary = chat_review_summary(changes, model, cancel_token=cancel_token)
                 
                 # 根据模式决定是否包含详细文件审查
                 if REVIEW_MODE == "summary_only":
                     # 模式1：只有MR总结（包含详细文件审查）
                     log.info("📝 模式1：只有MR总结，生成详细文件审查内容")
-                    review_info = chat_review(changes, generate_review_note_with_context, model, gitlab_fetcher, merge_info)
+                    review_info = chat_review(changes, generate_review_note_with_context, model, gitlab_fetcher, merge_info,
+                                              cancel_token=cancel_token)
                     review_info = review_summary + review_info
                 else:
                     # 模式2：MR总结 + commit审查（MR总结不包含详细文件审查）
@@ -351,10 +381,14 @@ class MainReviewHandle(ReviewHandle):
             review_inline_comments = None
             if ENABLE_INLINE_COMMENTS:
                 log.info("📝 Inline评论功能已启用，开始生成inline评论")
-                review_inline_comments = chat_review_inline_comment(changes, model, merge_info)
+                review_inline_comments = chat_review_inline_comment(changes, model, merge_info, cancel_token=cancel_token)
             else:
                 log.info("📝 Inline评论功能已禁用，跳过inline评论生成")
 
+            # SINGLE消息会立即发送，MR已关闭或有新的推送时不再发送
+            if cancel_token:
+                cancel_token.raise_if_cancelled()
+
             if review_info:
                 # 构建增强的MR总结
                 enhanced_summary = review_info
@@ -431,7 +465,7 @@ class MainReviewHandle(ReviewHandle):
                 'content': (
                     f"## 项目名称: **{hook_info['project']['name']}**\n\n"
                     f"### 备注\n"
-                    f"修改 `{len(changes)}` 个文件 > 50 个文件，不进行 Code Review ⚠️\n\n"
+                    f"修改 `{(merge_info or {}).get('changes_count') or len(changes)}` 个文件 > {MAX_FILES} 个文件，不进行 Code Review ⚠️\n\n"
                     f"### 合并请求详情\n"
                     f"- **MR URL**: [查看合并请求]({hook_info['object_attributes']['url']})\n"
                     f"- **源分支**: `{hook_info['object_attributes']['source_branch']}`\n"
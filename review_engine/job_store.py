@@ -0,0 +1,254 @@
+import json
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from config.config import JOB_STORE_TYPE, JOB_STORE_SQLITE_PATH, REDIS_URL, JOB_STORE_KEY_PREFIX
+from utils.logger import log
+
+
+class AbstractJobStore(ABC):
+    """
+    审查任务持久化存储
+    - put: webhook收到事件后写入，同时由当前实例持有租约
+    - renew: 持有者定期续约，执行中或排队中的任务不会被其他实例接管
+    - ack: 任务结束（完成、失败或被取代）后删除
+    - reclaim: 接管租约已过期的任务（实例崩溃或重启后未ack的任务）
+    """
+
+    @abstractmethod
+    def put(self, job_id: str, record: dict, owner: str, lease_seconds: float) -> None:
+        """写入任务并由owner持有租约"""
+        pass
+
+    @abstractmethod
+    def renew(self, job_ids: list, owner: str, lease_seconds: float) -> None:
+        """为owner持有的任务续约"""
+        pass
+
+    @abstractmethod
+    def ack(self, job_id: str) -> None:
+        """确认任务结束并删除"""
+        pass
+
+    @abstractmethod
+    def reclaim(self, owner: str, lease_seconds: float, limit: int) -> list:
+        """接管最多limit个租约已过期的任务，返回任务记录列表（deliveries已加1）"""
+        pass
+
+    @abstractmethod
+    def size(self) -> int:
+        """未ack的任务数"""
+        pass
+
+
+class MemoryJobStore(AbstractJobStore):
+    """进程内存实现，不具备持久性，用于测试或单实例部署"""
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def put(self, job_id, record, owner, lease_seconds):
+        with self._lock:
+            record = dict(record, deliveries=record.get('deliveries', 1))
+            self._jobs[job_id] = {'record': record, 'owner': owner, 'lease_until': time.time() + lease_seconds}
+
+    def renew(self, job_ids, owner, lease_seconds):
+        lease_until = time.time() + lease_seconds
+        with self._lock:
+            for job_id in job_ids:
+                entry = self._jobs.get(job_id)
+                if entry and entry['owner'] == owner:
+                    entry['lease_until'] = lease_until
+
+    def ack(self, job_id):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def reclaim(self, owner, lease_seconds, limit):
+        now = time.time()
+        reclaimed = []
+        with self._lock:
+            expired = sorted((entry['lease_until'], job_id) for job_id, entry in self._jobs.items()
+                             if entry['lease_until'] <= now)
+            for _, job_id in expired[:limit]:
+                entry = self._jobs[job_id]
+                entry['owner'] = owner
+                entry['lease_until'] = now + lease_seconds
+                entry['record']['deliveries'] = entry['record'].get('deliveries', 1) + 1
+                reclaimed.append(dict(entry['record']))
+        return reclaimed
+
+    def size(self):
+        with self._lock:
+            return len(self._jobs)
+
+
+class SQLiteJobStore(AbstractJobStore):
+    """SQLite实现，单机部署时提供重启后的任务恢复"""
+
+    def __init__(self, path=JOB_STORE_SQLITE_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS review_jobs ("
+            "job_id TEXT PRIMARY KEY, record TEXT NOT NULL, owner TEXT, "
+            "lease_until REAL NOT NULL, deliveries INTEGER NOT NULL DEFAULT 1)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_review_jobs_lease ON review_jobs (lease_until)")
+
+    def put(self, job_id, record, owner, lease_seconds):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO review_jobs (job_id, record, owner, lease_until, deliveries) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (job_id, json.dumps(record, ensure_ascii=False), owner, time.time() + lease_seconds,
+                 record.get('deliveries', 1)))
+
+    def renew(self, job_ids, owner, lease_seconds):
+        if not job_ids:
+            return
+        lease_until = time.time() + lease_seconds
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE review_jobs SET lease_until = ? WHERE job_id = ? AND owner = ?",
+                [(lease_until, job_id, owner) for job_id in job_ids])
+
+    def ack(self, job_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM review_jobs WHERE job_id = ?", (job_id,))
+
+    def reclaim(self, owner, lease_seconds, limit):
+        now = time.time()
+        reclaimed = []
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT job_id, record, deliveries FROM review_jobs WHERE lease_until <= ? "
+                    "ORDER BY lease_until LIMIT ?", (now, limit)).fetchall()
+                for job_id, record, deliveries in rows:
+                    self._conn.execute(
+                        "UPDATE review_jobs SET owner = ?, lease_until = ?, deliveries = ? WHERE job_id = ?",
+                        (owner, now + lease_seconds, deliveries + 1, job_id))
+                    record = json.loads(record)
+                    record['deliveries'] = deliveries + 1
+                    reclaimed.append(record)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return reclaimed
+
+    def size(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM review_jobs").fetchone()[0]
+
+
+class RedisJobStore(AbstractJobStore):
+    """
+    Redis实现，多个codereview实例共享同一个任务存储
+    - {prefix}:jobs        hash，job_id -> 任务记录
+    - {prefix}:owners      hash，job_id -> 租约持有者
+    - {prefix}:deliveries  hash，job_id -> 投递次数
+    - {prefix}:leases      zset，job_id -> 租约到期时间
+    """
+
+    # 原子地接管过期任务：更新租约、持有者与投递次数
+    _RECLAIM_SCRIPT = """
+    local ids = redis.call('ZRANGEBYSCORE', KEYS[4], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[4]))
+    local result = {}
+    for _, id in ipairs(ids) do
+        local raw = redis.call('HGET', KEYS[1], id)
+        if raw then
+            redis.call('HSET', KEYS[2], id, ARGV[3])
+            local deliveries = redis.call('HINCRBY', KEYS[3], id, 1)
+            redis.call('ZADD', KEYS[4], ARGV[2], id)
+            table.insert(result, raw)
+            table.insert(result, tostring(deliveries))
+        else
+            redis.call('ZREM', KEYS[4], id)
+        end
+    end
+    return result
+    """
+
+    # 只为自己持有的任务续约，避免覆盖其他实例已接管的任务
+    _RENEW_SCRIPT = """
+    for i = 3, #ARGV do
+        if redis.call('HGET', KEYS[1], ARGV[i]) == ARGV[2] then
+            redis.call('ZADD', KEYS[2], 'XX', ARGV[1], ARGV[i])
+        end
+    end
+    return 1
+    """
+
+    def __init__(self, url=REDIS_URL, prefix=JOB_STORE_KEY_PREFIX):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("JOB_STORE_TYPE='redis' requires the redis package, please `pip install redis`")
+        self._redis = redis.Redis.from_url(url)
+        self._jobs_key = f"{prefix}:jobs"
+        self._owners_key = f"{prefix}:owners"
+        self._deliveries_key = f"{prefix}:deliveries"
+        self._leases_key = f"{prefix}:leases"
+        self._reclaim = self._redis.register_script(self._RECLAIM_SCRIPT)
+        self._renew = self._redis.register_script(self._RENEW_SCRIPT)
+
+    def put(self, job_id, record, owner, lease_seconds):
+        pipe = self._redis.pipeline()
+        pipe.hset(self._jobs_key, job_id, json.dumps(record, ensure_ascii=False))
+        pipe.hset(self._owners_key, job_id, owner)
+        pipe.hset(self._deliveries_key, job_id, record.get('deliveries', 1))
+        pipe.zadd(self._leases_key, {job_id: time.time() + lease_seconds})
+        pipe.execute()
+
+    def renew(self, job_ids, owner, lease_seconds):
+        if not job_ids:
+            return
+        self._renew(keys=[self._owners_key, self._leases_key],
+                    args=[time.time() + lease_seconds, owner] + list(job_ids))
+
+    def ack(self, job_id):
+        pipe = self._redis.pipeline()
+        pipe.hdel(self._jobs_key, job_id)
+        pipe.hdel(self._owners_key, job_id)
+        pipe.hdel(self._deliveries_key, job_id)
+        pipe.zrem(self._leases_key, job_id)
+        pipe.execute()
+
+    def reclaim(self, owner, lease_seconds, limit):
+        now = time.time()
+        result = self._reclaim(keys=[self._jobs_key, self._owners_key, self._deliveries_key, self._leases_key],
+                               args=[now, now + lease_seconds, owner, limit])
+        reclaimed = []
+        for raw, deliveries in zip(result[::2], result[1::2]):
+            record = json.loads(raw)
+            record['deliveries'] = int(deliveries)
+            reclaimed.append(record)
+        return reclaimed
+
+    def size(self):
+        return self._redis.hlen(self._jobs_key)
+
+
+def create_job_store(store_type=JOB_STORE_TYPE):
+    """
+    根据配置创建任务存储，store_type为none时返回None（不持久化）
+    """
+    store_type = (store_type or 'none').lower()
+    if store_type == 'none':
+        return None
+    if store_type == 'memory':
+        store = MemoryJobStore()
+    elif store_type == 'sqlite':
+        store = SQLiteJobStore()
+    elif store_type == 'redis':
+        store = RedisJobStore()
+    else:
+        raise ValueError(f"Unsupported JOB_STORE_TYPE: {store_type}")
+    log.info(f"🗄️ 审查任务存储: {store.__class__.__name__}")
+    return store
@@ -1,10 +1,70 @@
+import concurrent.futures
 import threading
 
+from config.config import REVIEW_WORKER_NUM, REVIEW_HANDLER_HEADROOM, PUSH_REVIEW_RATE_PER_MINUTE, PUSH_REVIEW_BURST
 from large_model.llm_generator import LLMGenerator
+from large_model.rate_limited_api import RateLimitedApi
+from utils.cancellation import ReviewCancelledError, wait_futures
+from utils.logger import log
+from utils.rate_limiter import TokenBucket
 from utils.tools import import_submodules
 
 import_submodules('review_engine.handler')
 
+# 所有审查任务共享的handler线程池，大小随worker数量固定，避免每个MR额外创建线程
+_handler_executor = None
+_handler_threads = 0
+_handler_executor_lock = threading.Lock()
+# 任务已取消、worker已释放但仍在执行的handler数，最多占用REVIEW_HANDLER_HEADROOM个线程
+_zombie_handlers = 0
+
+# push审查中每次调用大模型都要获取令牌，所有push任务共享，避免大量commit的force-push占满大模型配额
+push_review_limiter = TokenBucket(PUSH_REVIEW_RATE_PER_MINUTE / 60, PUSH_REVIEW_BURST)
+
+
+def get_handler_executor(handle_num):
+    global _handler_executor, _handler_threads
+    with _handler_executor_lock:
+        if _handler_executor is None:
+            # 每个worker的所有handler同时执行，另外预留线程给取消后仍在退出中的handler
+            _handler_threads = max(1, REVIEW_WORKER_NUM * handle_num + REVIEW_HANDLER_HEADROOM)
+            _handler_executor = concurrent.futures.ThreadPoolExecutor(max_workers=_handler_threads,
+                                                                      thread_name_prefix='review-handler')
+        return _handler_executor
+
+
+def get_handler_stats():
+    """handler线程池的大小，以及所属任务已取消但仍在执行的handler数"""
+    with _handler_executor_lock:
+        return {
+            'threads': _handler_threads,
+            'zombie_handlers': _zombie_handlers,
+            'zombie_limit': REVIEW_HANDLER_HEADROOM,
+        }
+
+
+def _detach_cancelled_handlers(futures):
+    """
+    任务取消后，仍在执行的handler计入预留线程，不再占用worker
+    :return: 预留线程已用完时返回False，调用方需等待handler退出
+    """
+    global _zombie_handlers
+    running = [future for future in futures if not future.done()]
+    with _handler_executor_lock:
+        if _zombie_handlers + len(running) > REVIEW_HANDLER_HEADROOM:
+            return False
+        _zombie_handlers += len(running)
+
+    def on_exit(_):
+        global _zombie_handlers
+        with _handler_executor_lock:
+            _zombie_handlers -= 1
+
+    for future in running:
+        future.add_done_callback(on_exit)
+    return True
+
+
 class ReviewEngine:
     def __init__(self, reply):
         self.handles = []
@@ -14,15 +74,78 @@ class ReviewEngine:
         for handle in ReviewHandle.__subclasses__():
             self.handles.append(handle())
 
-    def handle_merge(self, gitlabMergeRequestFetcher, gitlabRepoManager, webhook_info):
-        # 多线程处理
-        threads = [threading.Thread(target=handle.merge_handle,
-                                    args=(gitlabMergeRequestFetcher, gitlabRepoManager, webhook_info, self.reply,
-                                          LLMGenerator.new_model())) for handle in self.handles]
-        for thread in threads:
-            thread.start()
-        for thread in threads:
-            thread.join()
-        gitlabRepoManager.delete_repo()
+    def handle_merge(self, gitlabMergeRequestFetcher, gitlabRepoManager, webhook_info, cancel_token=None):
+        if cancel_token and cancel_token.is_cancelled():
+            log.info(f"🛑 审查已取消，跳过执行: {cancel_token.reason}")
+            return
+        # 检出的代码在所有handler结束后删除：取消时handler可能仍在读取，不能在这里直接删除
+        self._run_handles('merge_handle', cancel_token, gitlabMergeRequestFetcher, gitlabRepoManager, webhook_info,
+                          cleanup=gitlabRepoManager.delete_repo)
+        # 审查期间MR有新的推送，结果已过期，不再发送
+        if cancel_token and cancel_token.is_cancelled():
+            log.info(f"🛑 审查已取消，丢弃审查结果: {cancel_token.reason}")
+            return
         self.reply.send()
-        self.reply.send_comments()
\ No newline at end of file
+        self.reply.send_comments()
+
+    def handle_push(self, gitlabCommitFetcher, push_info, cancel_token=None):
+        if cancel_token and cancel_token.is_cancelled():
+            log.info(f"🛑 审查已取消，跳过执行: {cancel_token.reason}")
+            return
+        model = RateLimitedApi(LLMGenerator.shared_model(), push_review_limiter, cancel_token)
+        self._run_handles('push_handle', cancel_token, gitlabCommitFetcher, push_info, model=model)
+        if cancel_token and cancel_token.is_cancelled():
+            log.info(f"🛑 审查已取消，丢弃审查结果: {cancel_token.reason}")
+            return
+        self.reply.send()
+
+    def _run_handles(self, method_name, cancel_token, *args, cleanup=None, model=None):
+        """
+        :param cleanup: 所有handler结束后调用（包括取消后仍在执行、稍后才退出的handler）
+        :param model: 传给handler的模型实例，默认为共享模型
+        """
+        # 在共享线程池中并行执行各handler，模型接口可重入，所有handler共用一个模型实例
+        executor = get_handler_executor(len(self.handles))
+        model = model or LLMGenerator.shared_model()
+        futures = [executor.submit(getattr(handle, method_name), *args, self.reply, model,
+                                   cancel_token=cancel_token)
+                   for handle in self.handles]
+        if cleanup is not None:
+            _when_all_done(futures, cleanup)
+        try:
+            # 取消时不等待仍在执行的handler，立即释放worker，handler会在下一个检查点退出
+            wait_futures(futures, cancel_token)
+        except ReviewCancelledError:
+            if not _detach_cancelled_handlers(futures):
+                log.warning("⚠️ 取消后仍在执行的handler过多，等待本任务的handler退出后再释放worker")
+                concurrent.futures.wait(futures)
+            return
+        for future in futures:
+            try:
+                future.result()
+            except ReviewCancelledError:
+                pass
+            except Exception as e:
+                log.error(f"审查handler执行失败: {e}")
+
+
+def _when_all_done(futures, callback):
+    """所有future完成（或被取消）后，在最后完成的线程中调用callback"""
+    if not futures:
+        callback()
+        return
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def on_done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        try:
+            callback()
+        except Exception as e:
+            log.error(f"审查结束后的清理失败: {e}")
+
+    for future in futures:
+        future.add_done_callback(on_done)
@@ -0,0 +1,388 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+
+from config.config import (REVIEW_WORKER_NUM, REVIEW_QUEUE_MAX_SIZE, JOB_LEASE_SECONDS, JOB_RENEW_INTERVAL,
+                           JOB_MAX_DELIVERIES)
+from utils.cancellation import CancellationToken, ReviewCancelledError
+from utils.logger import log
+from utils.tools import loads_json
+
+
+class ReviewQueueFullError(Exception):
+    """审查队列已满，调用方应返回背压响应（429）"""
+    pass
+
+
+class ReviewQueueClosedError(Exception):
+    """审查队列正在关闭，不再接收新任务（503）"""
+    pass
+
+
+class ReviewJob:
+    """
+    一次审查任务，对应一个需要处理的webhook事件
+    """
+
+    def __init__(self, kind, project_id, payload, merge_request_iid=None, reply_config=None,
+                 head_sha=None, debounce=0, labels=None, project_path=None):
+        """
+        :param head_sha: MR的head commit，用于判断任务是否已被新的推送取代
+        :param debounce: 入队后延迟执行的秒数，期间同一MR的新事件会合并进来
+        :param labels: MR标签，用于优先级调度
+        :param project_path: 项目path_with_namespace，用于优先级调度
+        """
+        target = merge_request_iid if merge_request_iid is not None else (head_sha or '')[:8]
+        self.job_id = f"{kind}-{project_id}-{target}-{uuid.uuid4().hex[:12]}"
+        self.kind = kind
+        self.project_id = project_id
+        self.merge_request_iid = merge_request_iid
+        self.payload = payload
+        self.reply_config = reply_config or {'type': kind, 'project_id': project_id}
+        self.head_sha = head_sha
+        self.debounce = debounce
+        self.cancel_token = CancellationToken()
+        self.enqueued_at = time.time()
+        self.ready_at = self.enqueued_at
+        self.started_at = None
+        self.deliveries = 1
+        self.labels = list(labels or [])
+        self.project_path = project_path
+        # 调度器预估的MR规模，预估前为None
+        self.changed_files = None
+        self.estimated_tokens = None
+        # 预估规模时已获取过changes的fetcher，执行时复用
+        self.fetcher = None
+
+    @property
+    def key(self):
+        return self.project_id, self.merge_request_iid
+
+    @property
+    def group(self):
+        """项目所在的GitLab group（namespace），未知时为None"""
+        if not self.project_path or '/' not in self.project_path:
+            return None
+        return self.project_path.rsplit('/', 1)[0]
+
+    def load_payload(self):
+        """
+        webhook入队时payload为原始body（bytes），在worker中才完整解析
+        """
+        if isinstance(self.payload, (bytes, str)):
+            self.payload = loads_json(self.payload)
+        return self.payload
+
+    def to_record(self):
+        """序列化为可持久化的任务记录"""
+        return {
+            'job_id': self.job_id,
+            'kind': self.kind,
+            'project_id': self.project_id,
+            'merge_request_iid': self.merge_request_iid,
+            'payload': self.payload.decode('utf-8') if isinstance(self.payload, bytes) else self.payload,
+            'reply_config': self.reply_config,
+            'head_sha': self.head_sha,
+            'enqueued_at': self.enqueued_at,
+            'deliveries': self.deliveries,
+            'labels': self.labels,
+            'project_path': self.project_path,
+        }
+
+    @classmethod
+    def from_record(cls, record):
+        """从任务记录恢复任务（重新投递时不再防抖）"""
+        job = cls(record['kind'], record['project_id'], record['payload'],
+                  merge_request_iid=record.get('merge_request_iid'), reply_config=record.get('reply_config'),
+                  head_sha=record.get('head_sha'), labels=record.get('labels'),
+                  project_path=record.get('project_path'))
+        job.job_id = record['job_id']
+        job.deliveries = record.get('deliveries', 1)
+        return job
+
+    def __repr__(self):
+        return f"ReviewJob({self.job_id})"
+
+
+class ReviewJobQueue:
+    """
+    有界审查任务队列 + 固定大小的worker线程池
+    - 队列满时submit抛出 ReviewQueueFullError，由webhook返回背压响应
+    - worker在首次提交任务时才启动，避免import时创建线程
+    - 同一MR的任务会被合并：等待中的旧任务被新任务替换，执行中的旧head任务被取消
+    - 配置了job_store时任务在入队时持久化、结束时ack，租约过期的任务（实例崩溃）会被重新投递
+    - 配置了scheduler时按优先级、项目公平份额与并发上限选择下一个任务，否则先进先出
+    """
+
+    def __init__(self, job_runner, worker_num=REVIEW_WORKER_NUM, max_size=REVIEW_QUEUE_MAX_SIZE, job_store=None,
+                 scheduler=None):
+        """
+        :param job_runner: 执行单个任务的函数，参数为 ReviewJob
+        :param worker_num: worker线程数
+        :param max_size: 队列中等待任务的最大数量
+        :param job_store: 任务持久化存储（AbstractJobStore），为None时不持久化
+        :param scheduler: 优先级调度器（ReviewScheduler），为None时先进先出
+        """
+        self._job_runner = job_runner
+        self._job_store = job_store
+        self._scheduler = scheduler
+        self.owner_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.worker_num = max(1, int(worker_num))
+        self.max_size = max(1, int(max_size))
+        self._pending = deque()
+        self._running = {}
+        self._cond = threading.Condition()
+        self._workers = []
+        self._started = False
+        self._closed = False
+        self._counters = {
+            'submitted': 0,
+            'rejected': 0,
+            'completed': 0,
+            'failed': 0,
+            'coalesced': 0,
+            'superseded': 0,
+            'cancelled': 0,
+            'redelivered': 0,
+        }
+
+    def start(self):
+        with self._cond:
+            self._start_locked()
+
+    def _start_locked(self):
+        if self._started:
+            return
+        self._started = True
+        for i in range(self.worker_num):
+            worker = threading.Thread(target=self._worker_loop, name=f"review-worker-{i + 1}", daemon=True)
+            self._workers.append(worker)
+            worker.start()
+        if self._job_store is not None:
+            threading.Thread(target=self._maintenance_loop, name="review-job-store", daemon=True).start()
+        log.info(f"🧵 审查worker池已启动：{self.worker_num} 个worker，队列上限 {self.max_size}")
+
+    def submit(self, job, persist=True):
+        """
+        提交任务
+        :param persist: 是否写入任务存储（重新投递的任务已在存储中）
+        :return: 实际会执行的任务（与已在执行的同一head任务合并时返回该任务）
+        :raises ReviewQueueFullError: 队列已满
+        :raises ReviewQueueClosedError: 队列已关闭
+        """
+        with self._cond:
+            if self._closed:
+                raise ReviewQueueClosedError("review queue is shutting down")
+            self._start_locked()
+            if job.kind == 'merge_request':
+                running_job = self._coalesce_locked(job)
+                if running_job is not None:
+                    if not persist:
+                        self._store_call('ack', job.job_id)
+                    self._counters['coalesced'] += 1
+                    log.info(f"🔁 MR #{job.merge_request_iid} 的head {job.head_sha} 正在审查中，合并到任务 {running_job.job_id}")
+                    return running_job
+            if len(self._pending) >= self.max_size:
+                self._counters['rejected'] += 1
+                raise ReviewQueueFullError(f"review queue is full ({self.max_size})")
+            job.enqueued_at = time.time()
+            job.ready_at = job.enqueued_at + job.debounce
+            if persist:
+                self._store_call('put', job.job_id, job.to_record(), self.owner_id, JOB_LEASE_SECONDS)
+            self._pending.append(job)
+            self._counters['submitted'] += 1
+            depth = len(self._pending)
+            self._cond.notify()
+        if self._scheduler is not None:
+            self._scheduler.prepare(job)
+        log.info(f"📥 任务入队 {job.job_id}，当前队列深度 {depth}/{self.max_size}")
+        return job
+
+    def _coalesce_locked(self, job):
+        """
+        合并同一MR的任务，调用时需持有锁
+        - 等待中的同MR任务被新任务取代并移出队列
+        - 执行中的同MR任务若head已过期则取消，若head相同则返回该任务，新任务无需入队
+        """
+        for pending_job in [j for j in self._pending if j.kind == job.kind and j.key == job.key]:
+            self._pending.remove(pending_job)
+            pending_job.cancel_token.cancel(f"superseded by {job.job_id}")
+            self._store_call('ack', pending_job.job_id)
+            self._counters['superseded'] += 1
+            log.info(f"🔁 等待中的任务 {pending_job.job_id} 被 {job.job_id} 取代")
+        for running_job in self._running.values():
+            if running_job.kind != job.kind or running_job.key != job.key or running_job.cancel_token.is_cancelled():
+                continue
+            if job.head_sha and running_job.head_sha == job.head_sha:
+                return running_job
+            running_job.cancel_token.cancel(f"head superseded by {job.head_sha}")
+            self._counters['superseded'] += 1
+            log.info(f"🛑 执行中的任务 {running_job.job_id} 的head已过期({running_job.head_sha} -> {job.head_sha})，取消审查")
+        return None
+
+    def cancel(self, kind, key, reason):
+        """
+        取消指定MR的所有任务（例如MR已关闭或合并）
+        - 等待中的任务直接移出队列
+        - 执行中的任务通过cancel_token通知，handler在下一个检查点退出
+        :return: 被取消的任务数
+        """
+        cancelled = 0
+        with self._cond:
+            for pending_job in [j for j in self._pending if j.kind == kind and j.key == key]:
+                self._pending.remove(pending_job)
+                pending_job.cancel_token.cancel(reason)
+                self._store_call('ack', pending_job.job_id)
+                self._counters['cancelled'] += 1
+                cancelled += 1
+            for running_job in self._running.values():
+                if running_job.kind == kind and running_job.key == key and not running_job.cancel_token.is_cancelled():
+                    running_job.cancel_token.cancel(reason)
+                    cancelled += 1
+        if cancelled:
+            log.info(f"🛑 已取消 {kind} {key} 的 {cancelled} 个审查任务: {reason}")
+        return cancelled
+
+    def _select_job(self, now):
+        """从等待队列中选出下一个已到执行时间的任务，调用时需持有锁（关闭时忽略防抖）"""
+        ready_jobs = [job for job in self._pending if job.ready_at <= now or self._closed]
+        if not ready_jobs:
+            return None
+        if self._scheduler is None:
+            job = ready_jobs[0]
+        else:
+            job = self._scheduler.select(ready_jobs, list(self._running.values()), now)
+            if job is None:
+                return None
+        self._pending.remove(job)
+        return job
+
+    def _next_job(self):
+        with self._cond:
+            while True:
+                now = time.time()
+                job = self._select_job(now)
+                if job is not None:
+                    job.started_at = now
+                    self._running[job.job_id] = job
+                    return job
+                if self._closed and not self._pending:
+                    return None
+                # 等待新任务、任务结束（并发上限释放），或等待最早的防抖任务到期
+                timeout = min((j.ready_at for j in self._pending if j.ready_at > now), default=None)
+                self._cond.wait(None if timeout is None else max(0.0, timeout - now))
+
+    def _worker_loop(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            wait_seconds = job.started_at - job.enqueued_at
+            log.info(f"🚀 开始执行任务 {job.job_id}（排队 {wait_seconds:.1f}s）")
+            try:
+                self._job_runner(job)
+                result = 'cancelled' if job.cancel_token.is_cancelled() else 'completed'
+            except ReviewCancelledError:
+                result = 'cancelled'
+            except Exception as e:
+                log.error(f"❌ 任务 {job.job_id} 执行失败: {e}")
+                result = 'failed'
+            self._store_call('ack', job.job_id)
+            if self._scheduler is not None:
+                self._scheduler.job_finished(job, time.time() - job.started_at)
+            with self._cond:
+                self._running.pop(job.job_id, None)
+                self._counters[result] += 1
+                self._cond.notify_all()
+            log.info(f"✅ 任务 {job.job_id} 结束（{result}），耗时 {time.time() - job.started_at:.1f}s")
+
+    def _store_call(self, method, *args):
+        """调用任务存储，存储不可用时只记录日志，不影响审查本身"""
+        if self._job_store is None:
+            return None
+        try:
+            return getattr(self._job_store, method)(*args)
+        except Exception as e:
+            log.error(f"❌ 任务存储操作 {method} 失败: {e}")
+            return None
+
+    def _maintenance_loop(self):
+        """
+        定期为本实例持有的任务续约，并接管租约已过期的任务（包括本实例启动前崩溃遗留的任务）
+        """
+        while True:
+            with self._cond:
+                job_ids = [job.job_id for job in self._pending] + list(self._running.keys())
+                if self._closed and not job_ids:
+                    return
+                free_slots = 0 if self._closed else self.max_size - len(self._pending)
+            self._store_call('renew', job_ids, self.owner_id, JOB_LEASE_SECONDS)
+            if free_slots > 0:
+                for record in self._store_call('reclaim', self.owner_id, JOB_LEASE_SECONDS, free_slots) or []:
+                    self._redeliver(record)
+            time.sleep(JOB_RENEW_INTERVAL)
+
+    def _redeliver(self, record):
+        job = ReviewJob.from_record(record)
+        if job.deliveries > JOB_MAX_DELIVERIES:
+            log.error(f"❌ 任务 {job.job_id} 已投递 {job.deliveries - 1} 次仍未完成，放弃该任务")
+            self._store_call('ack', job.job_id)
+            return
+        log.warning(f"♻️ 重新投递未完成的任务 {job.job_id}（第 {job.deliveries} 次）")
+        try:
+            self.submit(job, persist=False)
+            with self._cond:
+                self._counters['redelivered'] += 1
+        except (ReviewQueueFullError, ReviewQueueClosedError) as e:
+            # 未续约的租约到期后会被再次接管
+            log.warning(f"⚠️ 任务 {job.job_id} 暂时无法重新投递: {e}")
+
+    def get_stats(self):
+        """队列深度与worker利用率"""
+        with self._cond:
+            busy = len(self._running)
+            stats = {
+                'queue_depth': len(self._pending),
+                'queue_max_size': self.max_size,
+                'workers': self.worker_num,
+                'busy_workers': busy,
+                'worker_utilization': round(busy / self.worker_num, 3),
+                'running_jobs': list(self._running.keys()),
+                'closed': self._closed,
+                'tenants': self._tenant_stats_locked(),
+            }
+            stats.update(self._counters)
+        if self._job_store is not None:
+            stats['stored_jobs'] = self._store_call('size')
+        return stats
+
+    def _tenant_stats_locked(self):
+        """各项目排队与执行中的任务数，调用时需持有锁"""
+        tenants = {}
+        for state, jobs in (('queued', self._pending), ('running', self._running.values())):
+            for job in jobs:
+                tenant = tenants.setdefault(job.project_id, {'project_path': job.project_path, 'group': job.group,
+                                                             'queued': 0, 'running': 0})
+                tenant[state] += 1
+        return tenants
+
+    def shutdown(self, wait=True, timeout=None):
+        """
+        停止接收新任务，worker在处理完等待队列中的任务后退出
+        :param wait: 是否等待worker退出
+        :param timeout: 等待的总超时时间（秒）
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._scheduler is not None:
+            self._scheduler.shutdown()
+        if not wait:
+            return
+        deadline = None if timeout is None else time.time() + timeout
+        for worker in self._workers:
+            remaining = None if deadline is None else max(0, deadline - time.time())
+            worker.join(remaining)
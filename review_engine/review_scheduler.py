@@ -0,0 +1,154 @@
+import concurrent.futures
+import threading
+import time
+
+from config.config import (REVIEW_SIZING_WORKER_NUM, PROJECT_PRIORITY, PROJECT_PRIORITY_TIERS, PRIORITY_LABELS,
+                           PRIORITY_SECONDS_PER_FILE, PRIORITY_SECONDS_PER_1K_TOKENS, PRIORITY_MAX_SIZE_PENALTY,
+                           PRIORITY_UNSIZED_PENALTY, PROJECT_MAX_CONCURRENCY, GROUP_MAX_CONCURRENCY,
+                           PROJECT_CONCURRENCY_LIMITS, GROUP_CONCURRENCY_LIMITS, PROJECT_WEIGHTS)
+from utils.logger import log
+
+# 尚无执行记录时假设的单个任务耗时（秒）
+_DEFAULT_JOB_SECONDS = 60
+# 任务耗时滑动平均的权重
+_DURATION_EWMA_ALPHA = 0.2
+# 项目虚拟时钟记录数超过该值时清理已落后于当前时间的记录
+_TENANT_CLOCK_PRUNE_SIZE = 1000
+
+
+class ReviewScheduler:
+    """
+    审查任务优先级调度 + 多项目公平调度
+    每个任务的虚拟开始时间 = max(ready_at + 优先级偏移, 项目虚拟时钟)，可执行任务中虚拟开始时间最早的先执行
+    - 项目等级：PROJECT_PRIORITY / PROJECT_PRIORITY_TIERS
+    - MR标签：PRIORITY_LABELS
+    - MR规模：变更文件数与预估token数，入队后由sizer在后台线程中预估
+    - 公平调度（VirtualClock）：项目每执行一个任务，其虚拟时钟前进 任务耗时/项目权重，
+      占用worker时间多的项目排在安静项目之后；没有其他项目等待时仍会立即执行
+    - 并发上限：已达到项目或group并发上限的任务暂不调度
+    所有任务以相同速度老化，偏移有上限，因此任何任务的等待时间都是有界的
+    """
+
+    def __init__(self, sizer=None, sizing_workers=REVIEW_SIZING_WORKER_NUM):
+        """
+        :param sizer: 预估任务规模的函数，参数为 ReviewJob，返回 (变更文件数, 预估token数)
+        :param sizing_workers: 预估规模的线程数
+        """
+        self._sizer = sizer
+        self._sizing_workers = max(1, int(sizing_workers))
+        self._executor = None
+        self._lock = threading.Lock()
+        self._tenant_clocks = {}  # project_id -> 虚拟时钟
+        self._charges = {}  # job_id -> 开始执行时预扣的虚拟时间
+        self._avg_job_seconds = _DEFAULT_JOB_SECONDS
+
+    def prepare(self, job):
+        """任务入队后调用，在后台预估规模，预估完成前使用 PRIORITY_UNSIZED_PENALTY"""
+        if self._sizer is None or job.kind != 'merge_request':
+            return
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self._sizing_workers, thread_name_prefix='review-sizing')
+            self._executor.submit(self._size, job)
+
+    def _size(self, job):
+        # 已开始执行或已被取代的任务不再预估
+        if job.started_at is not None or job.cancel_token.is_cancelled():
+            return
+        try:
+            job.changed_files, job.estimated_tokens = self._sizer(job)
+        except Exception as e:
+            log.warning(f"⚠️ 预估任务 {job.job_id} 的规模失败: {e}")
+
+    @staticmethod
+    def priority_offset(job):
+        """任务的优先级偏移（秒），越小越优先"""
+        tier = PROJECT_PRIORITY.get(job.project_id) or PROJECT_PRIORITY.get(job.project_path) or 'normal'
+        offset = PROJECT_PRIORITY_TIERS.get(tier, 0)
+        label_offsets = [PRIORITY_LABELS[label.lower()] for label in job.labels if label.lower() in PRIORITY_LABELS]
+        if label_offsets:
+            offset += min(label_offsets)
+        if job.changed_files is None:
+            size_penalty = PRIORITY_UNSIZED_PENALTY
+        else:
+            size_penalty = (job.changed_files * PRIORITY_SECONDS_PER_FILE +
+                            (job.estimated_tokens or 0) / 1000 * PRIORITY_SECONDS_PER_1K_TOKENS)
+        return offset + min(size_penalty, PRIORITY_MAX_SIZE_PENALTY)
+
+    @staticmethod
+    def project_weight(job):
+        weight = PROJECT_WEIGHTS.get(job.project_id) or PROJECT_WEIGHTS.get(job.project_path) or 1
+        return max(float(weight), 0.01)
+
+    @staticmethod
+    def project_limit(job):
+        """项目的并发上限，None表示不限制；显式配置的0表示暂停该项目的审查"""
+        limit = PROJECT_CONCURRENCY_LIMITS.get(job.project_id)
+        if limit is None:
+            limit = PROJECT_CONCURRENCY_LIMITS.get(job.project_path, PROJECT_MAX_CONCURRENCY)
+        return limit
+
+    @staticmethod
+    def group_limit(job):
+        """group的并发上限，None表示不限制"""
+        return GROUP_CONCURRENCY_LIMITS.get(job.group, GROUP_MAX_CONCURRENCY)
+
+    @staticmethod
+    def _at_limit(running, limit):
+        return limit is not None and running >= limit
+
+    def select(self, jobs, running_jobs, now):
+        """
+        从可执行的任务中选出下一个任务，所有任务都受并发上限限制时返回None
+        :param jobs: 已到执行时间的等待任务
+        :param running_jobs: 正在执行的任务
+        """
+        project_running, group_running = {}, {}
+        for job in running_jobs:
+            project_running[job.project_id] = project_running.get(job.project_id, 0) + 1
+            if job.group:
+                group_running[job.group] = group_running.get(job.group, 0) + 1
+        with self._lock:
+            selected, selected_start = None, None
+            for job in jobs:
+                if self._at_limit(project_running.get(job.project_id, 0), self.project_limit(job)):
+                    continue
+                if job.group and self._at_limit(group_running.get(job.group, 0), self.group_limit(job)):
+                    continue
+                start = max(job.ready_at + self.priority_offset(job), self._tenant_clocks.get(job.project_id, 0))
+                if selected is None or start < selected_start:
+                    selected, selected_start = job, start
+            if selected is not None:
+                # 按平均耗时预扣虚拟时间，任务结束后按实际耗时修正
+                charge = self._avg_job_seconds / self.project_weight(selected)
+                self._charges[selected.job_id] = charge
+                self._tenant_clocks[selected.project_id] = max(
+                    now, self._tenant_clocks.get(selected.project_id, 0)) + charge
+                if len(self._tenant_clocks) > _TENANT_CLOCK_PRUNE_SIZE:
+                    self._tenant_clocks = {project_id: clock for project_id, clock in self._tenant_clocks.items()
+                                           if clock > now}
+            return selected
+
+    def job_finished(self, job, duration):
+        """任务结束后调用，按实际耗时修正项目的虚拟时钟"""
+        with self._lock:
+            charge = self._charges.pop(job.job_id, None)
+            if charge is None:
+                return
+            actual = duration / self.project_weight(job)
+            if job.project_id in self._tenant_clocks:
+                self._tenant_clocks[job.project_id] += actual - charge
+            self._avg_job_seconds += _DURATION_EWMA_ALPHA * (duration - self._avg_job_seconds)
+
+    def get_tenant_clocks(self):
+        """各项目虚拟时钟领先当前时间的秒数（只包含仍领先的项目）"""
+        now = time.time()
+        with self._lock:
+            return {project_id: round(clock - now, 1) for project_id, clock in self._tenant_clocks.items()
+                    if clock > now}
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,133 @@
+"""
+webhook压测脚本：持续发送MR webhook，统计接收速率与延迟
+
+用法：
+    # 压测运行中的服务（默认发送无需审查的事件，只测量webhook处理路径）
+    python scripts/webhook_load_test.py --url http://localhost:8080/git/webhook -n 5000 -c 32
+
+    # 发送需要审查的事件，测量入队路径与队列背压（会真实触发审查，请勿对生产GitLab项目使用）
+    python scripts/webhook_load_test.py --url http://localhost:8080/git/webhook --reviewable
+
+    # 进程内压测：使用Flask test client，审查任务替换为空操作，无需启动服务
+    python scripts/webhook_load_test.py --in-process --reviewable -n 5000 -c 16
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import sys
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import Counter
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+def build_payload(index, reviewable, description_size):
+    """构造MR webhook payload，每个事件使用不同的head SHA"""
+    return {
+        'object_kind': 'merge_request',
+        'event_type': 'merge_request',
+        'project': {'id': 1000 + index % 20, 'name': f'load-test-{index % 20}',
+                    'path_with_namespace': f'load-test/project-{index % 20}'},
+        'object_attributes': {
+            'iid': index,
+            'title': f'load test MR {index}',
+            'description': 'x' * description_size,
+            'state': 'opened' if reviewable else 'closed',
+            'action': 'open' if reviewable else 'close',
+            'merge_status': 'unchecked',
+            'source_branch': 'feature',
+            'target_branch': 'main',
+            'url': f'http://gitlab.local/load-test/merge_requests/{index}',
+            'last_commit': {'id': uuid.uuid4().hex + uuid.uuid4().hex[:8]},
+        },
+    }
+
+
+def make_http_sender(url, timeout):
+    def send(body):
+        request = urllib.request.Request(url, data=body, method='POST', headers={
+            'Content-Type': 'application/json',
+            'X-Gitlab-Event': 'Merge Request Hook',
+            'X-Gitlab-Event-UUID': str(uuid.uuid4()),
+        })
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+    return send
+
+
+def make_in_process_sender():
+    from app import create_app
+    from gitlab_integration.webhook_listener import webhook_listener
+
+    # 只测量webhook与入队开销，任务本身不访问GitLab和大模型
+    webhook_listener.review_queue._job_runner = lambda job: None
+    if webhook_listener.review_queue._scheduler is not None:
+        webhook_listener.review_queue._scheduler._sizer = None
+    client = create_app().test_client()
+
+    def send(body):
+        return client.post('/git/webhook', data=body, headers={
+            'Content-Type': 'application/json',
+            'X-Gitlab-Event': 'Merge Request Hook',
+            'X-Gitlab-Event-UUID': str(uuid.uuid4()),
+        }).status_code
+    return send
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='webhook接收速率压测')
+    parser.add_argument('--url', default='http://localhost:8080/git/webhook')
+    parser.add_argument('-n', '--requests', type=int, default=2000, help='请求总数')
+    parser.add_argument('-c', '--concurrency', type=int, default=16, help='并发数')
+    parser.add_argument('--reviewable', action='store_true', help='发送需要审查的事件（会进入审查队列）')
+    parser.add_argument('--description-size', type=int, default=2000, help='MR描述长度，用于调整payload大小')
+    parser.add_argument('--timeout', type=float, default=10)
+    parser.add_argument('--in-process', action='store_true', help='使用Flask test client进行进程内压测')
+    args = parser.parse_args()
+
+    send = make_in_process_sender() if args.in_process else make_http_sender(args.url, args.timeout)
+    bodies = [json.dumps(build_payload(i, args.reviewable, args.description_size)).encode('utf-8')
+              for i in range(args.requests)]
+
+    def timed_send(body):
+        start = time.perf_counter()
+        try:
+            status = send(body)
+        except Exception as e:
+            status = type(e).__name__
+        return status, (time.perf_counter() - start) * 1000
+
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(timed_send, bodies))
+    elapsed = time.perf_counter() - started
+
+    statuses = Counter(status for status, _ in results)
+    latencies = [latency for status, latency in results if status == 200]
+    print(f"requests:     {args.requests} (concurrency {args.concurrency}, payload ~{len(bodies[0])} bytes)")
+    print(f"elapsed:      {elapsed:.2f}s")
+    print(f"throughput:   {args.requests / elapsed:.1f} req/s")
+    print(f"accepted:     {statuses.get(200, 0) / elapsed:.1f} req/s")
+    print(f"status codes: {dict(statuses)}")
+    print(f"latency ms:   p50 {percentile(latencies, 50):.2f} | p95 {percentile(latencies, 95):.2f} | "
+          f"p99 {percentile(latencies, 99):.2f} | max {max(latencies, default=0):.2f}")
+
+
+if __name__ == '__main__':
+    main()
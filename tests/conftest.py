@@ -0,0 +1,8 @@
+import os
+import sys
+
+# config/config.py 在导入时校验必需的环境变量
+os.environ.setdefault("GITLAB_PRIVATE_TOKEN", "test-token")
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,88 @@
+import threading
+
+import pytest
+
+from large_model.abstract_api import AbstractApi, LLMResponse, LLMStream
+from review_engine.handler import commit_handler
+from utils.cancellation import CancellationToken, ReviewCancelledError
+
+COMMIT = {'id': 'a' * 40, 'message': 'fix', 'author_name': 'dev', 'created_at': '2024-01-01'}
+CHANGES = [{'new_path': 'a.py', 'diff': '@@ -1 +1 @@\n-a = 1\n+a = 2\n'}]
+
+
+class BlockingApi(AbstractApi):
+    """generate_text阻塞到release被设置，stream_text逐块输出直到release被设置"""
+
+    def __init__(self):
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def set_config(self, api_config):
+        return True
+
+    def generate_text(self, messages):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        return LLMResponse("review [DIFF_PLACEHOLDER_FILE_1]", tokens=1)
+
+    def stream_text(self, messages):
+        self.calls += 1
+
+        def chunks():
+            self.started.set()
+            while not self.release.is_set():
+                yield "## 📋 Commit概述\n"
+                self.release.wait(0.01)
+            return 0
+        return LLMStream(chunks())
+
+
+@pytest.fixture(params=[commit_handler.generate_commit_review_note,
+                        commit_handler.generate_commit_review_note_enhanced])
+def review(request):
+    return request.param
+
+
+@pytest.fixture(params=[False, True], ids=['blocking', 'streaming'])
+def model(request, monkeypatch):
+    monkeypatch.setattr(commit_handler, 'STREAMING_COMMIT_REVIEW', request.param)
+    api = BlockingApi()
+    yield api
+    api.release.set()
+
+
+def test_cancelled_review_does_not_call_model(review, model):
+    token = CancellationToken()
+    token.cancel("superseded")
+    with pytest.raises(ReviewCancelledError):
+        review(COMMIT, CHANGES, model, None, {}, cancel_token=token)
+    assert model.calls == 0
+
+
+def test_cancel_during_model_call(review, model):
+    if review is commit_handler.generate_commit_review_note and commit_handler.STREAMING_COMMIT_REVIEW:
+        pytest.skip("simple review does not stream")
+    token = CancellationToken()
+    threading.Thread(target=lambda: model.started.wait(5) and token.cancel("superseded")).start()
+    with pytest.raises(ReviewCancelledError):
+        review(COMMIT, CHANGES, model, None, {}, cancel_token=token)
+    assert model.calls == 1
+
+
+def test_batch_review_checks_token_between_batches(monkeypatch):
+    monkeypatch.setattr(commit_handler, 'BATCH_SIZE_FOR_COMMIT_REVIEW', 1)
+    token = CancellationToken()
+
+    class CancellingApi(BlockingApi):
+        def generate_text(self, messages):
+            self.calls += 1
+            token.cancel("merge request closed")
+            return LLMResponse("ok", tokens=1)
+
+    model = CancellingApi()
+    changes = CHANGES + [{'new_path': 'b.py', 'diff': '@@ -1 +1 @@\n-b = 1\n+b = 2\n'}]
+    with pytest.raises(ReviewCancelledError):
+        commit_handler.generate_commit_review_note_batch(COMMIT, changes, model, None, {}, cancel_token=token)
+    assert model.calls == 1
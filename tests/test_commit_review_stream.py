@@ -0,0 +1,36 @@
+from review_engine.handler.commit_handler import CommitReviewStreamMonitor
+
+
+def _feed(monitor, text, chunk_size=7):
+    for i in range(0, len(text), chunk_size):
+        monitor.feed(text[i:i + chunk_size])
+
+
+def test_placeholder_missing_once_next_file_starts():
+    monitor = CommitReviewStreamMonitor(3)
+    _feed(monitor, "## 📝 Commit概述\n涉及文件 2: 配置\n## 📄 文件变更分析\n**文件 1**: a.py\n分析\n")
+    assert monitor.missing_placeholders() == []
+
+    _feed(monitor, "**文件 2**: b.py\n")
+    assert monitor.missing_placeholders() == ["[DIFF_PLACEHOLDER_FILE_1]"]
+    assert not monitor.should_abort()
+
+    _feed(monitor, "[DIFF_PLACEHOLDER_FILE_2]\n**文件 3**: c.py\n")
+    assert monitor.missing_placeholders() == ["[DIFF_PLACEHOLDER_FILE_1]"]
+
+
+def test_summary_closes_all_files_and_aborts():
+    monitor = CommitReviewStreamMonitor(2)
+    text = "## 📄 文件变更分析\n**文件 1**: a.py\n**文件 2**: b.py\n## 🔍 整体评价\n"
+    _feed(monitor, text, chunk_size=3)
+    assert monitor.missing_placeholders() == ["[DIFF_PLACEHOLDER_FILE_1]", "[DIFF_PLACEHOLDER_FILE_2]"]
+    assert monitor.should_abort()
+    assert monitor.content == text
+
+
+def test_complete_response():
+    monitor = CommitReviewStreamMonitor(2)
+    _feed(monitor, "## 📄 文件变更分析\n文件 1: a.py\n[DIFF_PLACEHOLDER_FILE_1]\n"
+                   "文件 2: b.py\n[DIFF_PLACEHOLDER_FILE_2]\n## 🔍 整体评价\n良好")
+    assert monitor.missing_placeholders() == []
+    assert not monitor.should_abort()
@@ -0,0 +1,54 @@
+import pytest
+
+from gitlab_integration.event_dedup import WebhookEventDeduplicator, RedisWebhookEventDeduplicator
+
+MR_PAYLOAD = {
+    'object_kind': 'merge_request',
+    'project': {'id': 1},
+    'object_attributes': {'iid': 7, 'action': 'update', 'diff_refs': {'head_sha': 'abc'}},
+}
+PUSH_PAYLOAD = {'object_kind': 'push', 'project': {'id': 1}, 'ref': 'refs/heads/main', 'before': 'a1', 'after': 'b2'}
+
+
+def test_build_keys():
+    assert WebhookEventDeduplicator.build_keys(MR_PAYLOAD, 'uuid-1') == ['mr:1:7:abc:update', 'uuid:uuid-1']
+    assert WebhookEventDeduplicator.build_keys(PUSH_PAYLOAD) == ['push:1:refs/heads/main:a1:b2']
+    # 删除分支等没有after的push不去重
+    assert WebhookEventDeduplicator.build_keys(dict(PUSH_PAYLOAD, after=None)) == []
+
+
+def test_claim_once_until_released():
+    dedup = WebhookEventDeduplicator(ttl=60, max_size=10)
+    keys = dedup.build_keys(MR_PAYLOAD, 'uuid-1')
+    assert dedup.claim(keys)
+    assert not dedup.claim(keys)
+    # 任一标识命中即视为重复
+    assert not dedup.claim(['uuid:uuid-1'])
+
+    dedup.release(keys)
+    assert dedup.claim(keys)
+
+
+def test_expired_and_evicted_keys_are_claimable():
+    dedup = WebhookEventDeduplicator(ttl=0, max_size=10)
+    assert dedup.claim(['a'])
+    assert dedup.claim(['a'])
+
+    dedup = WebhookEventDeduplicator(ttl=60, max_size=2)
+    for key in ('a', 'b', 'c'):
+        assert dedup.claim([key])
+    assert dedup.claim(['a'])
+    assert not dedup.claim(['c'])
+
+
+def test_redis_index_is_shared(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr("redis.Redis.from_url", lambda url: fakeredis.FakeRedis(server=server))
+    first, second = RedisWebhookEventDeduplicator(ttl=60), RedisWebhookEventDeduplicator(ttl=60)
+    keys = first.build_keys(PUSH_PAYLOAD)
+
+    assert first.claim(keys)
+    assert not second.claim(keys)
+    first.release(keys)
+    assert second.claim(keys)
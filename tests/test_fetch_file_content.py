@@ -0,0 +1,112 @@
+import pytest
+
+from gitlab_integration import gitlab_fetcher
+from gitlab_integration.content_cache import MemoryContentCache
+
+SHA_1 = "1" * 40
+SHA_2 = "2" * 40
+
+
+class FakeResponse:
+    def __init__(self, status_code, text="", headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+
+
+class FakeGitlab:
+    """按 (分支或commit, 路径) 返回文件，记录发出的请求"""
+
+    def __init__(self):
+        self.files = {}  # (ref, path) -> (blob_id, commit_id, content)
+        self.requests = []
+
+    def _lookup(self, url, params):
+        path = url.split("/repository/files/")[1].split("/raw")[0]
+        return self.files.get((params["ref"], path))
+
+    def get(self, url, params=None):
+        self.requests.append(("GET", url))
+        entry = self._lookup(url, params)
+        if entry is None:
+            return FakeResponse(404)
+        blob_id, commit_id, content = entry
+        return FakeResponse(200, content, {"X-Gitlab-Blob-Id": blob_id, "X-Gitlab-Commit-Id": commit_id})
+
+    def head(self, url, params=None):
+        self.requests.append(("HEAD", url))
+        entry = self._lookup(url, params)
+        if entry is None:
+            return FakeResponse(404)
+        return FakeResponse(200, "", {"X-Gitlab-Blob-Id": entry[0], "X-Gitlab-Commit-Id": entry[1]})
+
+
+@pytest.fixture
+def gitlab(monkeypatch):
+    fake = FakeGitlab()
+    monkeypatch.setattr(gitlab_fetcher, "gitlab_client", fake)
+    monkeypatch.setattr(gitlab_fetcher, "file_content_cache", MemoryContentCache(max_size=1024 * 1024))
+    monkeypatch.setattr(gitlab_fetcher.repo_mirror_cache, "read_file", lambda *args: (False, None))
+    return fake
+
+
+def _methods(gitlab):
+    methods = [method for method, _ in gitlab.requests]
+    gitlab.requests.clear()
+    return methods
+
+
+def test_miss_downloads_once_and_fills_caches(gitlab):
+    gitlab.files[("main", "a.py")] = ("blob-a", SHA_1, "print(1)")
+    gitlab.files[(SHA_1, "a.py")] = ("blob-a", SHA_1, "print(1)")
+
+    assert gitlab_fetcher.fetch_file_content(1, "a.py", "main") == "print(1)"
+    assert _methods(gitlab) == ["GET"]
+    # 响应头中的commit SHA同样被记录，按commit获取时无需访问GitLab
+    assert gitlab_fetcher.fetch_file_content(1, "a.py", SHA_1) == "print(1)"
+    assert _methods(gitlab) == []
+
+
+def test_branch_hit_is_revalidated_with_head(gitlab):
+    gitlab.files[("main", "a.py")] = ("blob-a", SHA_1, "v1")
+    gitlab_fetcher.fetch_file_content(1, "a.py", "main")
+    _methods(gitlab)
+
+    assert gitlab_fetcher.fetch_file_content(1, "a.py", "main") == "v1"
+    assert _methods(gitlab) == ["HEAD"]
+
+    gitlab.files[("main", "a.py")] = ("blob-b", SHA_2, "v2")
+    assert gitlab_fetcher.fetch_file_content(1, "a.py", "main") == "v2"
+    assert _methods(gitlab) == ["HEAD", "GET"]
+
+
+def test_branch_revalidation_reuses_blob_cached_by_other_ref(gitlab):
+    gitlab.files[("feature", "a.py")] = ("blob-b", SHA_2, "v2")
+    gitlab.files[("main", "a.py")] = ("blob-a", SHA_1, "v1")
+    gitlab_fetcher.fetch_file_content(1, "a.py", "feature")
+    gitlab_fetcher.fetch_file_content(1, "a.py", "main")
+    _methods(gitlab)
+
+    # main合并了feature，内容与已缓存的blob相同
+    gitlab.files[("main", "a.py")] = ("blob-b", SHA_2, "v2")
+    assert gitlab_fetcher.fetch_file_content(1, "a.py", "main") == "v2"
+    assert _methods(gitlab) == ["HEAD"]
+
+
+def test_missing_file_and_force(gitlab):
+    assert gitlab_fetcher.fetch_file_content(1, "missing.py", SHA_1) is None
+    assert _methods(gitlab) == ["GET"]
+
+    gitlab.files[(SHA_1, "a.py")] = ("blob-a", SHA_1, "v1")
+    gitlab_fetcher.fetch_file_content(1, "a.py", SHA_1)
+    _methods(gitlab)
+    assert gitlab_fetcher.fetch_file_content(1, "a.py", SHA_1, force=True) == "v1"
+    assert _methods(gitlab) == ["GET"]
+
+    # 分支上的文件被删除
+    gitlab.files[("main", "a.py")] = ("blob-a", SHA_1, "v1")
+    gitlab_fetcher.fetch_file_content(1, "a.py", "main")
+    del gitlab.files[("main", "a.py")]
+    _methods(gitlab)
+    assert gitlab_fetcher.fetch_file_content(1, "a.py", "main") is None
+    assert _methods(gitlab) == ["HEAD"]
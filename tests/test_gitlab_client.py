@@ -0,0 +1,44 @@
+import time
+
+import requests
+
+from gitlab_integration.gitlab_client import RetryPolicy, rate_limit_wait
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+def test_idempotent_requests_retry_transient_errors():
+    policy = RetryPolicy(max_attempts=3)
+    assert policy.should_retry("GET", 1, response=FakeResponse(502))
+    assert policy.should_retry("get", 1, error=requests.ReadTimeout())
+    assert not policy.should_retry("GET", 1, response=FakeResponse(404))
+    assert not policy.should_retry("GET", 3, response=FakeResponse(502))
+
+
+def test_non_idempotent_requests_retry_only_unprocessed():
+    policy = RetryPolicy(max_attempts=3)
+    assert policy.should_retry("POST", 1, response=FakeResponse(429))
+    assert policy.should_retry("POST", 1, error=requests.ConnectTimeout())
+    # 服务端可能已经处理了请求，重试会产生重复评论
+    assert not policy.should_retry("POST", 1, response=FakeResponse(502))
+    assert not policy.should_retry("POST", 1, error=requests.ReadTimeout())
+
+
+def test_delay_uses_rate_limit_headers_with_cap():
+    policy = RetryPolicy(base_delay=1, max_delay=10)
+    assert policy.delay(1, FakeResponse(429, {"Retry-After": "3"})) == 3
+    assert policy.delay(1, FakeResponse(429, {"Retry-After": "120"})) == 10
+    for attempt in range(1, 6):
+        assert 0 <= policy.delay(attempt) <= min(2 ** (attempt - 1), 10)
+
+
+def test_rate_limit_wait():
+    reset = time.time() + 5
+    wait = rate_limit_wait(FakeResponse(429, {"RateLimit-Remaining": "0", "RateLimit-Reset": str(reset)}))
+    assert 4 <= wait <= 5
+    assert rate_limit_wait(FakeResponse(429, {"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"})) == 0
+    assert rate_limit_wait(FakeResponse(200, {"RateLimit-Remaining": "10"})) is None
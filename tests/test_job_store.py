@@ -0,0 +1,159 @@
+import threading
+import time
+
+import pytest
+
+from review_engine import review_queue
+from review_engine.job_store import MemoryJobStore, SQLiteJobStore
+from review_engine.review_queue import ReviewJob, ReviewJobQueue
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryJobStore()
+    return SQLiteJobStore(str(tmp_path / "jobs.db"))
+
+
+def _record(job_id, **extra):
+    return dict({'job_id': job_id, 'kind': 'merge_request', 'project_id': 1, 'merge_request_iid': 7,
+                 'payload': '{}', 'head_sha': 'abc'}, **extra)
+
+
+def _mr_job(head_sha, debounce=0):
+    return ReviewJob('merge_request', 1, b'{}', merge_request_iid=7, head_sha=head_sha, debounce=debounce)
+
+
+def test_put_and_ack(store):
+    store.put('job-1', _record('job-1'), 'owner-a', 60)
+    assert store.size() == 1
+    store.ack('job-1')
+    assert store.size() == 0
+    store.ack('job-1')  # 重复ack不报错
+
+
+def test_reclaim_only_expired_leases(store):
+    store.put('live', _record('live'), 'owner-a', 60)
+    store.put('expired', _record('expired'), 'owner-a', 0)
+
+    reclaimed = store.reclaim('owner-b', 60, 10)
+
+    assert [record['job_id'] for record in reclaimed] == ['expired']
+    assert reclaimed[0]['deliveries'] == 2
+    # 接管后租约已延长，不会被再次接管
+    assert store.reclaim('owner-c', 60, 10) == []
+
+
+def test_reclaim_respects_limit(store):
+    for i in range(3):
+        store.put(f'job-{i}', _record(f'job-{i}'), 'owner-a', 0)
+    assert len(store.reclaim('owner-b', 60, 2)) == 2
+    assert len(store.reclaim('owner-b', 60, 2)) == 1
+
+
+def test_renew_only_by_owner(store):
+    store.put('job-1', _record('job-1'), 'owner-a', 0)
+    store.reclaim('owner-b', 60, 10)
+
+    # 原持有者已失去租约，续约不生效
+    store.renew(['job-1'], 'owner-a', 0)
+    assert store.reclaim('owner-c', 60, 10) == []
+
+    store.renew(['job-1'], 'owner-b', 0)
+    reclaimed = store.reclaim('owner-c', 60, 10)
+    assert [record['deliveries'] for record in reclaimed] == [3]
+
+
+@pytest.fixture
+def blocking_queue(store):
+    """worker在release被设置前阻塞，任务停留在执行中"""
+    release = threading.Event()
+    started = []
+
+    def run(job):
+        started.append(job.job_id)
+        release.wait(5)
+
+    queue = ReviewJobQueue(run, worker_num=1, max_size=10, job_store=store)
+    yield queue, started, release
+    release.set()
+    queue.shutdown(wait=True, timeout=5)
+
+
+def test_supersede_pending_job_acks_it(store, blocking_queue):
+    queue, _, _ = blocking_queue
+    old_job = queue.submit(_mr_job('sha-1', debounce=60))
+    assert store.size() == 1
+
+    new_job = queue.submit(_mr_job('sha-2', debounce=60))
+
+    assert old_job.cancel_token.is_cancelled()
+    assert store.size() == 1
+    assert [record['job_id'] for record in store.reclaim('other', 60, 10)] == []
+    stats = queue.get_stats()
+    assert stats['superseded'] == 1
+    assert stats['queue_depth'] == 1
+    assert new_job.job_id != old_job.job_id
+
+
+def test_redelivered_duplicate_of_running_head_is_acked(store, blocking_queue):
+    queue, started, _ = blocking_queue
+    running_job = queue.submit(_mr_job('sha-1'))
+    _wait_for(lambda: started)
+
+    # 崩溃实例遗留的同一head任务被接管后合并到执行中的任务，存储中的记录需要ack
+    store.put('crashed-job', _record('crashed-job', head_sha='sha-1'), 'crashed-owner', 0)
+    for record in store.reclaim(queue.owner_id, 60, 10):
+        queue._redeliver(record)
+
+    assert store.size() == 1
+    assert queue.get_stats()['coalesced'] == 1
+    assert started == [running_job.job_id]
+
+
+def test_redelivery_runs_job_and_acks(store):
+    done = threading.Event()
+    queue = ReviewJobQueue(lambda job: done.set(), worker_num=1, max_size=10, job_store=store)
+    store.put('crashed-job', _record('crashed-job'), 'crashed-owner', 0)
+
+    for record in store.reclaim(queue.owner_id, 60, 10):
+        queue._redeliver(record)
+
+    assert done.wait(5)
+    queue.shutdown(wait=True, timeout=5)
+    assert store.size() == 0
+    stats = queue.get_stats()
+    assert stats['redelivered'] == 1
+    assert stats['completed'] == 1
+
+
+def test_max_deliveries_dead_letters_job(store, monkeypatch):
+    monkeypatch.setattr(review_queue, 'JOB_MAX_DELIVERIES', 2)
+    ran = []
+    queue = ReviewJobQueue(ran.append, worker_num=1, max_size=10, job_store=store)
+    store.put('poison-job', _record('poison-job'), 'crashed-owner', 0)
+
+    # 第2次投递仍在上限内
+    for record in store.reclaim(queue.owner_id, 0, 10):
+        queue._redeliver(record)
+    _wait_for(lambda: ran)
+    queue.shutdown(wait=True, timeout=5)
+    assert len(ran) == 1
+
+    # 模拟执行过程中实例崩溃：记录未被ack，租约过期后第3次投递超过上限，直接放弃
+    store.put('poison-job', _record('poison-job', deliveries=2), 'crashed-owner', 0)
+    queue = ReviewJobQueue(ran.append, worker_num=1, max_size=10, job_store=store)
+    for record in store.reclaim(queue.owner_id, 60, 10):
+        assert record['deliveries'] == 3
+        queue._redeliver(record)
+
+    assert store.size() == 0
+    assert len(ran) == 1
+    assert queue.get_stats()['redelivered'] == 0
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not met in time"
+        time.sleep(0.01)
@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+from utils.json_scanner import scan_json_fields
+
+SPEC = {'object_kind': None, 'project': {'id': None}, 'object_attributes': {'iid': None, 'title': None}}
+
+
+def test_extracts_only_requested_fields():
+    payload = {'object_kind': 'merge_request', 'user': {'id': 9, 'name': 'dev'},
+               'project': {'name': 'demo', 'id': 1},
+               'object_attributes': {'description': 'x' * 10000, 'iid': 7, 'title': 'Fix'}}
+    assert scan_json_fields(json.dumps(payload).encode(), SPEC) == {
+        'object_kind': 'merge_request', 'project': {'id': 1}, 'object_attributes': {'iid': 7, 'title': 'Fix'}}
+
+
+def test_string_escapes():
+    payload = {'object_kind': 'merge_request', 'object_attributes': {
+        'description': 'say "hi" \\ {"iid": 99} \\"', 'title': 'a "quoted" \\ title 中\n', 'iid': 7}}
+    result = scan_json_fields(json.dumps(payload, ensure_ascii=True).encode(), SPEC)
+    assert result['object_attributes'] == {'iid': 7, 'title': 'a "quoted" \\ title 中\n'}
+
+
+def test_escaped_key():
+    raw = b'{"object_\\u006bind": "push", "project": {"id": 1}}'
+    assert scan_json_fields(raw, {'object_kind': None})['object_kind'] == 'push'
+
+
+def test_nested_fields_with_same_name_are_skipped():
+    raw = json.dumps({
+        'changes': {'project': {'id': 2}, 'iid': [{'iid': 3}, "]}"]},
+        'labels': [{'project': {'id': 4}}],
+        'project': {'id': 1},
+        'object_kind': 'merge_request',
+        'object_attributes': {'last_commit': {'iid': 5, 'title': 'nested'}, 'iid': 7, 'title': 'top'},
+    }).encode()
+    assert scan_json_fields(raw, SPEC) == {
+        'object_kind': 'merge_request', 'project': {'id': 1}, 'object_attributes': {'iid': 7, 'title': 'top'}}
+
+
+def test_missing_fields_are_absent():
+    # 期望对象但实际不是对象的字段按缺失处理
+    raw = b'{"object_kind": "push", "project": null, "object_attributes": {"iid": null}}'
+    assert scan_json_fields(raw, SPEC) == {'object_kind': 'push', 'object_attributes': {'iid': None}}
+    assert scan_json_fields(b'{}', SPEC) == {}
+
+
+def test_scalar_values():
+    raw = b'{"a": -1.5e3, "b": true, "c": null, "d": [1, {"x": 2}], "e": 12}'
+    spec = {key: None for key in 'abcde'}
+    assert scan_json_fields(raw, spec) == {'a': -1500.0, 'b': True, 'c': None, 'd': [1, {'x': 2}], 'e': 12}
+
+
+def test_stops_once_all_fields_found():
+    # 所需字段之后的内容不再扫描，即使不完整
+    raw = b'{"object_kind": "push", "project": {"id": 1}, "commits": [{"id": "abc"'
+    assert scan_json_fields(raw, {'object_kind': None, 'project': {'id': None}}) == {
+        'object_kind': 'push', 'project': {'id': 1}}
+
+
+@pytest.mark.parametrize('raw', [b'[1, 2]', b'{"object_kind" "push"}', b'{"object_kind": "push"',
+                                 b'{"object_kind": "pu', b'{"a": 1,, "b": 2}'])
+def test_invalid_payload(raw):
+    with pytest.raises(ValueError):
+        scan_json_fields(raw, {'object_kind': None, 'project': {'id': None}})
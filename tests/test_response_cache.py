@@ -0,0 +1,87 @@
+import os
+
+from large_model.abstract_api import AbstractApi, LLMResponse, LLMStream
+from large_model.response_cache import CachedApi, DiskResponseCache
+
+
+class FakeApi(AbstractApi):
+    def __init__(self):
+        self.calls = 0
+
+    def set_config(self, api_config):
+        return True
+
+    def generate_text(self, messages):
+        self.calls += 1
+        return self._remember(LLMResponse(f"review #{self.calls}", tokens=10))
+
+    def stream_text(self, messages):
+        self.calls += 1
+
+        def chunks():
+            yield "part 1, "
+            yield "part 2"
+            return 12
+        return LLMStream(chunks())
+
+
+def test_disk_cache_round_trip_and_ttl(tmp_path):
+    cache = DiskResponseCache(root=str(tmp_path), max_size=1024, ttl=60)
+    assert cache.get("ab12") is None
+    cache.set("ab12", {'content': 'ok', 'tokens': 3})
+    assert cache.get("ab12") == {'content': 'ok', 'tokens': 3}
+    assert cache.get_stats()['hits'] == 1
+
+    path = cache._path("ab12")
+    os.utime(path, (0, 0))
+    assert cache.get("ab12") is None
+    assert not os.path.exists(path)
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    cache = DiskResponseCache(root=str(tmp_path), max_size=100, ttl=60)
+    value = {'content': 'x' * 30}
+    cache.set("aa01", value)
+    cache.set("bb02", value)
+    os.utime(cache._path("aa01"), (1, 1))
+    os.utime(cache._path("bb02"), (2, 2))
+    cache.set("cc03", value)
+
+    assert cache.get("aa01") is None
+    assert cache.get("cc03") == value
+    assert cache.get_stats()['size'] <= 100
+
+
+def test_cached_api_reuses_responses(tmp_path):
+    api = FakeApi()
+    cached = CachedApi(api, DiskResponseCache(root=str(tmp_path), max_size=1024 * 1024, ttl=60))
+    cached.set_config({'model': 'm1', 'api_key': 'secret-1'})
+    messages = [{'role': 'user', 'content': 'diff'}]
+
+    assert cached.generate_text(messages).content == "review #1"
+    response = cached.generate_text(messages)
+    assert (response.content, response.cached, api.calls) == ("review #1", True, 1)
+    assert cached.get_respond_content() == "review #1"
+
+    # 鉴权参数不影响缓存key，模型参数会
+    cached.set_config({'model': 'm1', 'api_key': 'secret-2'})
+    assert cached.generate_text(messages).cached
+    cached.set_config({'model': 'm2'})
+    assert cached.generate_text(messages).content == "review #2"
+
+
+def test_cached_api_stores_only_completed_streams(tmp_path):
+    api = FakeApi()
+    cached = CachedApi(api, DiskResponseCache(root=str(tmp_path), max_size=1024 * 1024, ttl=60))
+    messages = [{'role': 'user', 'content': 'diff'}]
+
+    with cached.stream_text(messages) as stream:
+        next(stream)
+        stream.close()
+    assert api.calls == 1
+
+    with cached.stream_text(messages) as stream:
+        assert "".join(stream) == "part 1, part 2"
+    with cached.stream_text(messages) as stream:
+        assert "".join(stream) == "part 1, part 2"
+    assert api.calls == 2
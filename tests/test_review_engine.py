@@ -0,0 +1,80 @@
+import threading
+
+import pytest
+
+from review_engine import review_engine
+from review_engine.review_engine import ReviewEngine, get_handler_stats
+from utils.cancellation import CancellationToken
+
+
+class SlowHandle:
+    """忽略取消、阻塞到release被设置的handler"""
+
+    def __init__(self, release, started):
+        self.release = release
+        self.started = started
+
+    def push_handle(self, fetcher, push_info, reply, model, cancel_token=None):
+        self.started.release()
+        self.release.wait(5)
+
+
+@pytest.fixture
+def engine_factory(monkeypatch):
+    monkeypatch.setattr(review_engine, 'REVIEW_HANDLER_HEADROOM', 2)
+    monkeypatch.setattr(review_engine, '_handler_executor', None)
+    monkeypatch.setattr(review_engine, '_zombie_handlers', 0)
+    release = threading.Event()
+    started = threading.Semaphore(0)
+
+    def create(handle_num):
+        engine = ReviewEngine.__new__(ReviewEngine)
+        engine.reply = None
+        engine.handles = [SlowHandle(release, started) for _ in range(handle_num)]
+        return engine
+
+    yield create, release, started
+    release.set()
+    review_engine._handler_executor.shutdown(wait=True)
+
+
+def _cancel_after_start(token, started, count):
+    def cancel():
+        for _ in range(count):
+            started.acquire(timeout=5)
+        token.cancel("superseded")
+    threading.Thread(target=cancel).start()
+
+
+def test_cancelled_handlers_are_detached_within_headroom(engine_factory):
+    create, release, started = engine_factory
+    token = CancellationToken()
+    _cancel_after_start(token, started, 2)
+
+    create(2)._run_handles('push_handle', token, None, None, model=object())
+
+    stats = get_handler_stats()
+    assert stats['zombie_handlers'] == 2
+    assert stats['threads'] == review_engine.REVIEW_WORKER_NUM * 2 + 2
+    release.set()
+    review_engine._handler_executor.shutdown(wait=True)
+    assert get_handler_stats()['zombie_handlers'] == 0
+
+
+def test_worker_waits_for_handlers_when_headroom_is_used(engine_factory):
+    create, release, started = engine_factory
+    first = CancellationToken()
+    _cancel_after_start(first, started, 2)
+    create(2)._run_handles('push_handle', first, None, None, model=object())
+
+    second = CancellationToken()
+    _cancel_after_start(second, started, 1)
+    done = threading.Event()
+    thread = threading.Thread(target=lambda: (create(1)._run_handles('push_handle', second, None, None,
+                                                                     model=object()), done.set()))
+    thread.start()
+    # 预留线程已被第一个任务的handler占满，第二个任务取消后仍等待自己的handler退出
+    assert not done.wait(0.3)
+    assert get_handler_stats()['zombie_handlers'] == 2
+    release.set()
+    assert done.wait(5)
@@ -0,0 +1,63 @@
+from review_engine import review_scheduler
+from review_engine.review_queue import ReviewJob
+from review_engine.review_scheduler import ReviewScheduler
+
+
+def _job(project_id, project_path=None, labels=None, ready_at=0.0):
+    job = ReviewJob('merge_request', project_id, b'{}', merge_request_iid=1, head_sha='abc', labels=labels,
+                    project_path=project_path)
+    job.ready_at = ready_at
+    return job
+
+
+def test_busy_project_yields_to_quiet_project():
+    scheduler = ReviewScheduler()
+    busy_first, busy_second, quiet = _job(1), _job(1), _job(2, ready_at=1.0)
+
+    assert scheduler.select([busy_first, busy_second, quiet], [], now=10.0) is busy_first
+    # 项目1的虚拟时钟已前进一个平均任务耗时，后入队的项目2先执行
+    assert scheduler.select([busy_second, quiet], [busy_first], now=10.0) is quiet
+
+
+def test_actual_duration_corrects_tenant_clock():
+    scheduler = ReviewScheduler()
+    job = _job(1)
+    scheduler.select([job], [], now=0.0)
+    charged = scheduler._tenant_clocks[1]
+
+    scheduler.job_finished(job, duration=5)
+
+    assert scheduler._tenant_clocks[1] == charged - review_scheduler._DEFAULT_JOB_SECONDS + 5
+
+
+def test_priority_label_jumps_the_queue():
+    scheduler = ReviewScheduler()
+    normal, hotfix = _job(1, ready_at=0.0), _job(2, labels=['Hotfix'], ready_at=100.0)
+    assert scheduler.select([normal, hotfix], [], now=100.0) is hotfix
+
+
+def test_project_and_group_limits(monkeypatch):
+    monkeypatch.setattr(review_scheduler, 'PROJECT_CONCURRENCY_LIMITS', {1: 1})
+    monkeypatch.setattr(review_scheduler, 'GROUP_CONCURRENCY_LIMITS', {'infra': 1})
+    scheduler = ReviewScheduler()
+    running = [_job(1), _job(3, project_path='infra/api')]
+    limited, grouped, free = _job(1), _job(4, project_path='infra/web'), _job(2, ready_at=50.0)
+
+    assert scheduler.select([limited, grouped, free], running, now=100.0) is free
+    assert scheduler.select([limited, grouped], running, now=100.0) is None
+
+
+def test_unlimited_by_default():
+    scheduler = ReviewScheduler()
+    running = [_job(1) for _ in range(10)]
+    job = _job(1)
+    assert scheduler.project_limit(job) is None
+    assert scheduler.select([job], running, now=0.0) is job
+
+
+def test_sizer_result_is_applied():
+    scheduler = ReviewScheduler(sizer=lambda job: (3, 2000))
+    job = _job(1)
+    scheduler.prepare(job)
+    scheduler._executor.shutdown(wait=True)
+    assert (job.changed_files, job.estimated_tokens) == (3, 2000)
@@ -0,0 +1,42 @@
+from large_model.token_counter import ApproximateTokenCounter
+
+
+def test_approximate_count_by_script():
+    counter = ApproximateTokenCounter()
+    assert counter.count("") == 0
+    assert counter.count("abcd" * 10) == 10
+    assert counter.count("代码审查") == 4
+    assert counter.count("é" * 4) == 2
+
+
+def test_count_is_memoized_by_content():
+    calls = []
+
+    class CountingCounter(ApproximateTokenCounter):
+        def _count(self, text):
+            calls.append(text)
+            return super()._count(text)
+
+    counter = CountingCounter(cache_size=1)
+    long_a, long_b = "a" * 1000, "b" * 1000
+    assert counter.count(long_a) == counter.count(long_a) == 250
+    assert len(calls) == 1
+    counter.count(long_b)
+    counter.count(long_a)  # 缓存容量为1，long_a已被淘汰
+    assert len(calls) == 3
+
+
+def test_truncate_fits_budget():
+    counter = ApproximateTokenCounter()
+    text = "def f():\n    return 1\n" * 200
+    truncated = counter.truncate(text, 100)
+    assert counter.count(truncated) <= 100
+    assert text.startswith(truncated)
+    assert counter.truncate("short", 100) == "short"
+    assert counter.truncate(text, 0) == ""
+
+
+def test_count_messages_includes_overhead():
+    counter = ApproximateTokenCounter()
+    messages = [{'role': 'system', 'content': 'abcd'}, {'role': 'user', 'content': None}]
+    assert counter.count_messages(messages) == 1 + 4 + 0 + 4
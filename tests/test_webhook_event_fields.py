@@ -0,0 +1,37 @@
+import json
+
+from gitlab_integration.webhook_listener import scan_webhook_event
+
+MR_PAYLOAD = {
+    'object_kind': 'merge_request',
+    'project': {'id': 1, 'path_with_namespace': 'group/demo'},
+    'object_attributes': {'iid': 7, 'action': 'update', 'state': 'opened', 'merge_status': 'can_be_merged',
+                          'diff_refs': {'head_sha': 'abc'}, 'last_commit': {'id': 'abc'}},
+    'labels': [{'title': 'hotfix'}],
+}
+PUSH_PAYLOAD = {
+    'object_kind': 'push', 'before': 'a1', 'after': 'b2', 'ref': 'refs/heads/main',
+    'project': {'id': 1, 'path_with_namespace': 'group/demo'},
+}
+
+
+def _truncated(payload, trailer):
+    """在payload后追加不完整的大字段，只有提前结束扫描才能解析成功"""
+    return json.dumps(payload).encode()[:-1] + b', ' + trailer
+
+
+def test_merge_request_event_stops_after_its_fields():
+    raw = _truncated(MR_PAYLOAD, b'"changes": {"description": {"previous": "')
+    assert scan_webhook_event(raw, 'Merge Request Hook') == MR_PAYLOAD
+
+
+def test_push_event_stops_after_its_fields():
+    raw = _truncated(PUSH_PAYLOAD, b'"commits": [{"id": "')
+    assert scan_webhook_event(raw, 'Push Hook') == PUSH_PAYLOAD
+
+
+def test_unknown_or_mismatched_header_scans_all_fields():
+    raw = json.dumps(PUSH_PAYLOAD).encode()
+    assert scan_webhook_event(raw) == PUSH_PAYLOAD
+    assert scan_webhook_event(raw, 'Merge Request Hook') == PUSH_PAYLOAD
+    assert scan_webhook_event(json.dumps(MR_PAYLOAD).encode(), 'Push Hook') == MR_PAYLOAD
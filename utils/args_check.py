@@ -104,7 +104,7 @@ def check_api_config(config):
     try:
         from large_model.llm_generator import LLMGenerator
         api = LLMGenerator.new_model()
-        api.generate_text([
+        response = api.generate_text([
             {"role": "system",
              "content": "你是一个有用的助手"
              },
@@ -112,7 +112,7 @@ def check_api_config(config):
              "content": "请输出ok两个小写字母，不要输出其他任何内容",
              }
         ])
-        res_str = api.get_respond_content()
+        res_str = response.content
         if not res_str or res_str == "":
             error_msg = "Model interface check failed: Please check if the model call related configuration is correct"
             result['errors'].append(error_msg)
@@ -0,0 +1,57 @@
+import concurrent.futures
+import threading
+from contextlib import contextmanager
+
+
+class ReviewCancelledError(Exception):
+    """审查任务已被取消"""
+    pass
+
+
+class CancellationToken:
+    """
+    协作式取消标记：由调度方调用cancel，执行方在关键节点检查
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self.reason = None
+
+    def cancel(self, reason=""):
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    def is_cancelled(self):
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise ReviewCancelledError(self.reason or "review cancelled")
+
+
+def wait_futures(futures, cancel_token=None, poll_interval=0.5):
+    """
+    等待所有future完成，期间被取消时取消尚未开始的future并抛出ReviewCancelledError
+    已经在执行的任务无法中断，其结果会被丢弃
+    """
+    pending = set(futures)
+    while pending:
+        if cancel_token is not None and cancel_token.is_cancelled():
+            for future in pending:
+                future.cancel()
+            cancel_token.raise_if_cancelled()
+        _, pending = concurrent.futures.wait(pending, timeout=None if cancel_token is None else poll_interval)
+
+
+@contextmanager
+def cancellable_executor(cancel_token=None, **kwargs):
+    """
+    线程池上下文：正常结束时等待所有任务完成；已取消时不等待正在执行的任务，直接释放调用方
+    """
+    executor = concurrent.futures.ThreadPoolExecutor(**kwargs)
+    try:
+        yield executor
+    finally:
+        cancelled = cancel_token is not None and cancel_token.is_cancelled()
+        executor.shutdown(wait=not cancelled, cancel_futures=cancelled)
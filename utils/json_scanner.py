@@ -0,0 +1,138 @@
+import json
+import re
+
+_WHITESPACE = re.compile(rb'[ \t\n\r]*')
+_STRUCTURE = re.compile(rb'["\[\]{}]')
+_SCALAR = re.compile(rb'[^,}\]\s]+')
+_WHITESPACE_BYTES = (b' ', b'\t', b'\n', b'\r')
+
+
+class _ScanComplete(Exception):
+    """所需字段已全部找到，提前结束扫描"""
+    pass
+
+
+def scan_json_fields(data, spec):
+    """
+    从JSON原始bytes中只提取spec指定的字段，不构建完整的对象树
+    spec为嵌套dict，值为None表示提取该字段，值为dict表示继续进入该对象，例如：
+        {'object_kind': None, 'project': {'id': None}}
+    未命中的值（包括超长字符串和嵌套对象）只做跳过，所需字段全部找到后立即返回
+    :param data: JSON bytes
+    :param spec: 需要提取的字段
+    :return: 与spec结构相同、只包含实际存在字段的dict
+    :raises ValueError: 已扫描的部分不是合法的JSON对象
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    result = {}
+    remaining = [_count_leaves(spec)]
+    pos = _skip_whitespace(data, 0)
+    if data[pos:pos + 1] != b'{':
+        raise ValueError("JSON payload must be an object")
+    try:
+        _scan_object(data, pos, spec, result, remaining)
+    except _ScanComplete:
+        pass
+    except IndexError:
+        raise ValueError("Truncated JSON payload")
+    return result
+
+
+def _count_leaves(spec):
+    return sum(1 if sub is None else _count_leaves(sub) for sub in spec.values())
+
+
+def _skip_whitespace(data, pos):
+    if data[pos:pos + 1] not in _WHITESPACE_BYTES:
+        return pos
+    return _WHITESPACE.match(data, pos).end()
+
+
+def _string_end(data, pos):
+    """
+    返回从pos（引号）开始的字符串结束后的位置
+    使用bytes.find查找引号，超长字符串（如MR描述）也不会逐字符处理
+    """
+    end = pos
+    while True:
+        end = data.find(b'"', end + 1)
+        if end == -1:
+            raise ValueError(f"Unterminated string at {pos}")
+        backslashes = 0
+        while data[end - 1 - backslashes] == 0x5C:  # 引号前连续的反斜杠为奇数个时引号被转义
+            backslashes += 1
+        if backslashes % 2 == 0:
+            return end + 1
+
+
+def _scan_object(data, pos, spec, result, remaining):
+    """扫描从pos开始的对象，返回对象结束后的位置"""
+    pos = _skip_whitespace(data, pos + 1)
+    if data[pos:pos + 1] == b'}':
+        return pos + 1
+    while True:
+        if data[pos:pos + 1] != b'"':
+            raise ValueError(f"Expecting property name at {pos}")
+        key_end = _string_end(data, pos)
+        key = data[pos + 1:key_end - 1]
+        key = json.loads(data[pos:key_end]) if b'\\' in key else key.decode('utf-8')
+        pos = _skip_whitespace(data, key_end)
+        if data[pos:pos + 1] != b':':
+            raise ValueError(f"Expecting ':' at {pos}")
+        pos = _skip_whitespace(data, pos + 1)
+
+        sub_spec = spec.get(key, False) if key not in result else False
+        if isinstance(sub_spec, dict) and data[pos:pos + 1] == b'{':
+            result[key] = {}
+            pos = _scan_object(data, pos, sub_spec, result[key], remaining)
+        else:
+            end = _skip_value(data, pos)
+            if sub_spec is None:
+                result[key] = _load_value(data[pos:end])
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    raise _ScanComplete()
+            pos = end
+
+        pos = _skip_whitespace(data, pos)
+        token = data[pos:pos + 1]
+        if token == b'}':
+            return pos + 1
+        if token != b',':
+            raise ValueError(f"Expecting ',' or '}}' at {pos}")
+        pos = _skip_whitespace(data, pos + 1)
+
+
+def _load_value(raw):
+    """解析提取出的字段值，普通字符串与整数不经过json模块"""
+    if raw[:1] == b'"' and b'\\' not in raw:
+        return raw[1:-1].decode('utf-8')
+    if raw.isdigit():
+        return int(raw)
+    return json.loads(raw)
+
+
+def _skip_value(data, pos):
+    """跳过从pos开始的任意JSON值，返回值结束后的位置"""
+    token = data[pos:pos + 1]
+    if token == b'"':
+        return _string_end(data, pos)
+    if token in (b'{', b'['):
+        depth = 0
+        while True:
+            match = _STRUCTURE.search(data, pos)
+            if not match:
+                raise ValueError(f"Unterminated container at {pos}")
+            char = match.group()
+            if char == b'"':
+                pos = _string_end(data, match.start())
+                continue
+            depth += 1 if char in (b'{', b'[') else -1
+            pos = match.end()
+            if depth == 0:
+                return pos
+    match = _SCALAR.match(data, pos)
+    if not match:
+        raise ValueError(f"Expecting value at {pos}")
+    return match.end()
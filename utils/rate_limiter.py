@@ -0,0 +1,58 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    令牌桶限流：以固定速率补充令牌，桶容量决定允许的突发量
+    线程安全，acquire会阻塞直到拿到令牌或超时
+    """
+
+    def __init__(self, rate, capacity):
+        """
+        :param rate: 每秒补充的令牌数
+        :param capacity: 桶容量（最大突发请求数）
+        """
+        self.rate = float(rate)
+        self.capacity = max(1.0, float(capacity))
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def try_acquire(self, tokens=1):
+        """非阻塞获取令牌，成功返回True"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens=1, timeout=None, cancel_token=None):
+        """
+        阻塞获取令牌
+        :param timeout: 最长等待时间（秒），为None时一直等待
+        :param cancel_token: 可选的CancellationToken，等待期间被取消时抛出ReviewCancelledError
+        :return: 是否拿到令牌（只有超时才会返回False）
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return True
+                wait = (tokens - self._tokens) / self.rate if self.rate > 0 else 1.0
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            if deadline is not None:
+                if now >= deadline:
+                    return False
+                wait = min(wait, deadline - now)
+            # 分段等待，便于及时响应取消
+            time.sleep(min(wait, 1.0))
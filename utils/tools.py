@@ -4,9 +4,15 @@ import pkgutil
 import subprocess
 import sys
 import itertools
+import json
 
 from utils.logger import log
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 def import_submodules(package_name):
     project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
@@ -46,6 +52,14 @@ def run_command(command):
             log.error(stderr_output.strip())
     return process.returncode
 
+def loads_json(data):
+    """
+    解析JSON，data可以是bytes或str；安装了orjson时使用orjson，直接解析bytes不做额外解码
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
 def batch(iterable, batch_size):
     iterator = iter(iterable)
     for first in iterator: